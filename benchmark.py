@@ -0,0 +1,274 @@
+r"""benchmark.py
+
+Measures how fast intunify generates packages, using stand-ins for
+IntuneWinAppUtil.exe and winget.exe so that it runs on a plain Linux box.
+
+For every catalog size it builds a synthetic catalog shaped like example.json,
+rotating through the registry_key, display_name and file_path detection modes,
+and times:
+    catalog         streaming, parsing and validating the catalog
+    render          rendering an application's four scripts (copy_nary_file)
+    winget_show     get_winget_show_output against the winget stand-in
+    package         create_intunewin_file with the selected packager backend
+    generate        generate_installer end to end, also broken down by detection mode
+    bulk            the bulk generator (--show, --jobs), cold and then incremental
+
+Each catalog size runs in a fresh worker process, and its peak RSS is read from
+the worker's resource usage when it exits.
+Results are written as JSON, e.g.
+    python benchmark.py --sizes 10 1000 --latency 0.01 --jobs 8 -o bench.json
+"""
+
+
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import SUPPRESS, ArgumentParser
+from contextlib import redirect_stdout
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(SCRIPT_DIR))
+
+import intunify
+import bulk_application_installer_generator
+from catalog import iter_applications, iter_catalog
+from create_installer import generate_installer
+from intunify import copy_nary_file, create_intunewin_file, get_winget_show_output, set_packager_backend, PACKAGER_BACKENDS
+from templating import INSTALLER_TEMPLATES_DIR, WINGET_ID_TO_REPLACE, PATH_TO_REPLACE, VERSION_TO_REPLACE, INSTALL_OPTIONS_TO_REPLACE
+from variants import DEFAULT_VARIANT
+
+
+DEFAULT_SIZES = [10, 1000, 10000]
+DETECTION_MODES = ["registry_key", "display_name", "file_path"]
+
+# Stand-ins sleep for $INTUNIFY_STUB_LATENCY seconds. Shell scripts keep their own startup cost low.
+PACKAGER_STUB = r"""#!/bin/sh
+sleep "${INTUNIFY_STUB_LATENCY:-0}"
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -s) setup=$(printf '%s' "$2" | tr '\\' '/'); shift ;;
+        -o) out=$(printf '%s' "$2" | tr '\\' '/'); shift ;;
+    esac
+    shift
+done
+name=$(basename "$setup")
+printf 'stub' > "$out/${name%.*}.intunewin"
+"""
+
+WINGET_STUB = r"""#!/bin/sh
+sleep "${INTUNIFY_STUB_LATENCY:-0}"
+while [ $# -gt 0 ]; do
+    [ "$1" = "--id" ] && id="$2"
+    shift
+done
+printf 'Found %s [%s]\r\nVersion: 1.0.0\r\nPublisher: Benchmark\r\nInstaller Type: exe\r\n' "$id" "$id"
+"""
+
+
+def make_catalog(size: int, path: Path) -> None:
+    """Write a synthetic catalog of 'size' applications shaped like example.json."""
+    with path.open("w") as f:
+        f.write("[\n")
+        for i in range(size):
+            application = {"name": f"Benchmark App {i}", "winget_id": f"Benchmark.App{i}"}
+            mode = DETECTION_MODES[i % len(DETECTION_MODES)]
+            if mode == "registry_key":
+                application[mode] = rf"Computer\HKEY_LOCAL_MACHINE\SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall\BenchmarkApp{i}"
+            elif mode == "display_name":
+                application[mode] = f"Benchmark App {i}"
+            else:
+                application[mode] = rf"C:\Program Files\Benchmark App {i}\app.exe"
+            if i % 4 == 0:
+                application["version"] = f"1.{i}.0"
+            f.write(("  " if i == 0 else ",\n  ") + json.dumps(application))
+        f.write("\n]\n")
+
+
+def install_stubs(bin_dir: Path) -> None:
+    """Write the IntuneWinAppUtil.exe and winget.exe stand-ins to 'bin_dir' and put them first on the path."""
+    for name, script in [("IntuneWinAppUtil.exe", PACKAGER_STUB), ("winget.exe", WINGET_STUB)]:
+        path = bin_dir / name
+        path.write_text(script)
+        path.chmod(0o755)
+    os.environ["PATH"] = f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}"
+    intunify.WINGET_EXECUTABLE = str(bin_dir / "winget.exe")
+    intunify.get_packager_version.cache_clear()
+
+
+def summarize(durations, wall=None) -> dict:
+    """Return count, throughput and latency percentiles (in milliseconds) for a list of durations in seconds."""
+    if not durations:
+        return {"count": 0}
+    wall = wall if wall is not None else sum(durations)
+    ordered = sorted(durations)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        "count": len(durations),
+        "total_s": round(wall, 6),
+        "throughput_per_s": round(len(durations) / wall, 2) if wall else None,
+        "latency_ms": {
+            "mean": round(statistics.fmean(durations) * 1000, 4),
+            "p50": round(percentile(50), 4),
+            "p90": round(percentile(90), 4),
+            "p99": round(percentile(99), 4),
+            "max": round(ordered[-1] * 1000, 4),
+        },
+    }
+
+
+def timed(function, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def run_case(size: int, jobs: int, packager: str) -> dict:
+    """Run every stage against a synthetic catalog of 'size' applications and return the results."""
+    set_packager_backend(packager)
+    results = {"apps": size, "stages": {}}
+    with tempfile.TemporaryDirectory(prefix="intunify-benchmark-") as tmp:
+        tmp = Path(tmp)
+        (tmp / "bin").mkdir()
+        install_stubs(tmp / "bin")
+        catalog_path = tmp / "catalog.json"
+        make_catalog(size, catalog_path)
+
+        start = time.perf_counter()
+        applications = list(iter_applications(iter_catalog(catalog_path)))
+        wall = time.perf_counter() - start
+        results["stages"]["catalog"] = {"count": len(applications), "total_s": round(wall, 6), "throughput_per_s": round(len(applications) / wall, 2)}
+
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            # render
+            render_dir = tmp / "render"
+            render_dir.mkdir()
+            durations = []
+            for application in applications:
+                start = time.perf_counter()
+                copy_nary_file(INSTALLER_TEMPLATES_DIR / "README.template", render_dir / "README.md", [(WINGET_ID_TO_REPLACE, application["winget_id"])])
+                copy_nary_file(INSTALLER_TEMPLATES_DIR / "install.template", render_dir / "install.ps1", [(VERSION_TO_REPLACE, ""), (WINGET_ID_TO_REPLACE, application["winget_id"]), (INSTALL_OPTIONS_TO_REPLACE, DEFAULT_VARIANT.install_options())])
+                copy_nary_file(INSTALLER_TEMPLATES_DIR / "known_key_detect.template", render_dir / "detect.ps1", [(PATH_TO_REPLACE, application["winget_id"])])
+                copy_nary_file(INSTALLER_TEMPLATES_DIR / "known_key_uninstall.template", render_dir / "uninstall.ps1", [(PATH_TO_REPLACE, application["winget_id"])])
+                durations.append(time.perf_counter() - start)
+            results["stages"]["render"] = summarize(durations)
+
+            # winget_show
+            durations = [timed(get_winget_show_output, application["winget_id"]) for application in applications]
+            results["stages"]["winget_show"] = summarize(durations)
+
+            # package
+            durations = [timed(create_intunewin_file, "render", "install.ps1", cwd=tmp) for _ in applications]
+            results["stages"]["package"] = summarize(durations)
+
+            # generate, serially through the library function
+            generate_dir = tmp / "generate"
+            by_mode = {mode: [] for mode in DETECTION_MODES}
+            start = time.perf_counter()
+            for application in applications:
+                mode = next(m for m in DETECTION_MODES if m in application)
+                by_mode[mode].append(timed(
+                    generate_installer,
+                    winget_id=application["winget_id"],
+                    version=application.get("version"),
+                    output_parent_directory=generate_dir,
+                    **{mode: application[mode]},
+                ))
+            wall = time.perf_counter() - start
+            results["stages"]["generate"] = summarize([d for durations in by_mode.values() for d in durations], wall)
+            results["generate_by_detection_mode"] = {mode: summarize(durations) for mode, durations in by_mode.items()}
+
+            # bulk, cold then incremental
+            argv = sys.argv
+            bulk_args = ["-i", str(catalog_path), "-o", str(tmp / "bulk"), "--show", "--cache", str(tmp / "cache.sqlite3"), "--jobs", str(jobs), "--packager", packager]
+            try:
+                for name in ["bulk_cold", "bulk_incremental"]:
+                    sys.argv = ["bulk_application_installer_generator.py", *bulk_args]
+                    wall = timed(bulk_application_installer_generator.main)
+                    results["stages"][name] = {"jobs": jobs, "count": size, "total_s": round(wall, 6), "throughput_per_s": round(size / wall, 2)}
+            finally:
+                sys.argv = argv
+
+    return results
+
+
+def run_case_process(size: int, latency: float, jobs: int, packager: str) -> dict:
+    """Run one catalog size in a fresh worker process and return its results.
+
+    ru_maxrss only grows over the life of a process, so it is read per worker with os.wait4:
+    peak_rss_kb is the peak of the worker (or of the largest tool stand-in it ran, if larger),
+    and peak_rss_children_kb that of the largest tool stand-in, as the worker reports it.
+    A new process starts from the RSS of the one that spawned it, which is why this process
+    never runs a case itself.
+    """
+    worker = subprocess.Popen([
+        sys.executable, __file__, "--case", str(size),
+        "--latency", str(latency), "--jobs", str(jobs), "--packager", packager,
+    ], stdout=subprocess.PIPE)
+    with worker.stdout:
+        out = worker.stdout.read()
+    _, status, usage = os.wait4(worker.pid, 0)
+    worker.returncode = os.waitstatus_to_exitcode(status)
+    if worker.returncode:
+        raise subprocess.CalledProcessError(worker.returncode, worker.args, out)
+    results = json.loads(out)
+    results["peak_rss_kb"] = usage.ru_maxrss
+    return results
+
+
+def parse_args():
+    parser = ArgumentParser(description="Benchmark the intunify generation pipeline against stub external tools.")
+    parser.add_argument('--sizes', type=int, nargs="+", default=DEFAULT_SIZES, help=f"catalog sizes to benchmark. Defaults to {DEFAULT_SIZES}")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds each IntuneWinAppUtil.exe and winget.exe stand-in call takes. Defaults to 0")
+    parser.add_argument('-j', '--jobs', type=int, default=8, help="--jobs passed to the bulk generator. Defaults to 8")
+    parser.add_argument('--packager', choices=PACKAGER_BACKENDS, default="external", help="packager backend. 'external' uses the IntuneWinAppUtil.exe stand-in. Defaults to external")
+    parser.add_argument('-o', '--output', type=str, default=None, help="path to write JSON results to. Defaults to stdout")
+    parser.add_argument('--case', type=int, default=None, help=SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.environ["INTUNIFY_STUB_LATENCY"] = str(args.latency)
+
+    # Worker: run one catalog size and print its results
+    if args.case is not None:
+        results = run_case(args.case, args.jobs, args.packager)
+        results["peak_rss_children_kb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        print(json.dumps(results))
+        return
+
+    cases = []
+    for size in args.sizes:
+        cases.append(run_case_process(size, args.latency, args.jobs, args.packager))
+        print(f"Benchmarked {size} applications.", file=sys.stderr)
+
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "latency_s": args.latency,
+            "jobs": args.jobs,
+            "packager": args.packager,
+        },
+        "cases": cases,
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
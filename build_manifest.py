@@ -0,0 +1,85 @@
+"""build_manifest.py
+
+Keeps track of which applications in an output folder are up to date so that
+unchanged applications can be skipped on the next run.
+
+The manifest is stored as a JSON file in the output folder, mapping the slug
+of every successfully built application to a digest of its build inputs.
+"""
+
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Iterable
+
+
+MANIFEST_FILE_NAME = ".intunify_manifest.json"
+
+
+def hash_build_inputs(config: dict, template_paths: Iterable[Path], packager_version: str) -> str:
+    """Return a digest of everything that determines the contents of an application's output folder.
+
+    Args:
+        config (dict): the application's config entry (winget_id, detection method, version, ...)
+        template_paths (Iterable[Path]): template files used to render the application's scripts
+        packager_version (str): identifies the packager used to build the intunewin file
+
+    Returns:
+        str: hex digest
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(config, sort_keys=True).encode())
+    for template_path in template_paths:
+        digest.update(b"\0" + template_path.name.encode() + b"\0")
+        digest.update(template_path.read_bytes())
+    digest.update(b"\0" + packager_version.encode())
+    return digest.hexdigest()
+
+
+class BuildManifest:
+    """On-disk record of the build input digests of an output folder.
+
+    Safe to share between the threads of a parallel bulk run.
+
+    Args:
+        output_parent_directory (Path)
+        on_record (Callable[[str, str], None] or None): called with (slug, digest) for every
+            record, e.g. to journal it before the manifest is saved
+    """
+
+    def __init__(self, output_parent_directory: Path, on_record=None):
+        self.path = Path(output_parent_directory) / MANIFEST_FILE_NAME
+        self.on_record = on_record
+        self._lock = threading.Lock()
+        try:
+            with self.path.open("r") as f:
+                self._digests = json.load(f)
+        except FileNotFoundError:
+            self._digests = {}
+        except ValueError:
+            print(f"Ignoring unreadable build manifest {self.path}, all applications will be rebuilt.")
+            self._digests = {}
+
+    def is_current(self, slug: str, digest: str) -> bool:
+        """Return True if 'slug' was last built from inputs with the given digest."""
+        with self._lock:
+            return self._digests.get(slug) == digest
+
+    def record(self, slug: str, digest: str) -> None:
+        """Record that 'slug' was successfully built from inputs with the given digest."""
+        with self._lock:
+            self._digests[slug] = digest
+        if self.on_record is not None:
+            self.on_record(slug, digest)
+
+    def save(self) -> None:
+        """Write the manifest to disk, replacing the previous one atomically."""
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with tmp_path.open("w") as f:
+                json.dump(self._digests, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
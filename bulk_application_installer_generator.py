@@ -1,80 +1,411 @@
 from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import json
 from pathlib import Path
-from create_installer import generate_installer
+from build_manifest import BuildManifest
+from catalog import apply_locked_versions, exclude_applications, group_bundles, iter_applications, iter_catalog
+from create_installer import generate_bundle_installer, generate_installer, render_bundle_installer, render_installer
+from journal import BuildJournal
+from lock_catalog import read_lockfile
+from packages import ArchiveSink, archive_format
+from registry_index import DEFAULT_CUTOFF, RegistryIndex, resolve_detection
+from variants import ARCHITECTURES, SCOPES, application_variants, load_variant_matrix, variant_matrix
+import instrumentation
+import intunify
+from intunify import set_subprocess_limits, set_subprocess_timeouts, set_retry_policy, set_packager_backend, set_output_store, PACKAGER_BACKENDS, REGISTRY_VIEWS, SUBPROCESS_TIMEOUTS
+from winget_cache import DEFAULT_CACHE_PATH, DEFAULT_TTL_HOURS, WingetShowCache
+from winget_index import WingetIndex, validate_applications
 
-def parse_args():
+def parse_args(argv=None):
     parser = ArgumentParser()
-    parser.add_argument('-i', '--infile', type=str, required=True, help="path to JSON input file")
-    parser.add_argument('-o', '--outfolder', type=str, required=True, help="path to place intunewin apps")
+    parser.add_argument('-i', '--infile', type=str, required=True, help="path to JSON (array) or JSON Lines input file")
+    parser.add_argument('-o', '--outfolder', type=str, default=None, help="path to place intunewin apps")
+    parser.add_argument('--archive', type=str, default=None, help="instead of --outfolder, stream every package (with its intunewin file, built in memory) into this .zip, .tar, .tar.gz or .tgz archive, without writing package folders. Requires the cryptography package")
     parser.add_argument('-s', '--show', action="store_true", default=False)
     exclusion_group = parser.add_mutually_exclusive_group()
     exclusion_group.add_argument('-x', '--exclude', type=str, nargs="*", help="list of space-separated WingetId's to exclude. Case insensitive.")
     exclusion_group.add_argument('-X', '--excludefile', type=str, help="path to a json file containing an array of WingetIds to exclude. Exclusion is case insensitive.")
-    return parser.parse_args()
-
-
-def main():
-    args = parse_args()
-    infile_path = Path(args.infile)
-    with infile_path.open("r") as f:
-        applications = json.load(f)
-    
-    # Test for errors
-    for application in applications:
-        if "winget_id" not in application:
-            raise ValueError("All applications must supply a valid 'winget_id' key")
-        if not application["winget_id"]:
-            raise ValueError(f"All applications must supply a valid 'winget_id' value. Received: {application['winget']}")
-        matching_props = ["registry_key", "file_path", "display_name"]
-        count_matches = len([application.get(a, None) for a in matching_props if application.get(a, None) is not None])
-        if count_matches != 1:
-            raise ValueError(f"All applications must contain exactly one of a 'file_path', 'display_name' or a 'registry_key' property")
-    
+    parser.add_argument('-l', '--lockfile', type=str, default=None, help="path to a lockfile written by lock_catalog.py. Applications that don't pin a version are built at their locked version, so only applications whose locked version changed are rebuilt")
+    parser.add_argument('--registry-index', type=str, default=None, help="path to a registry index built with registry_index.py. Placeholder registry_key values (e.g. \"this_does_not_exist, yet.\") and blank display_name values are filled in from the Uninstall key best matching the application's name")
+    parser.add_argument('--registry-cutoff', type=float, default=DEFAULT_CUTOFF, help=f"minimum similarity (0 to 1) of fuzzy --registry-index matches. Defaults to {DEFAULT_CUTOFF}")
+    parser.add_argument('--fast-detection', action="store_true", default=False, help="for applications detected by display_name, generate detection and uninstall scripts that read only the DisplayName value of each Uninstall key and stop at the first match")
+    parser.add_argument('--registry-view', choices=REGISTRY_VIEWS, default="both", help="with --fast-detection, which bitness of the HKLM Uninstall keys to search. Defaults to both.")
+    parser.add_argument('--current-user', action="store_true", default=False, help="with --fast-detection, also search the HKCU Uninstall keys")
+    parser.add_argument('--match-version', action="store_true", default=False, help="with --fast-detection, only detect installations whose DisplayVersion equals the application's pinned version")
+    variant_group = parser.add_argument_group("variants", "generate every application once per combination of the given scopes, architectures and tenants, each into its own folder of --outfolder named after the variant, e.g. contoso-user-arm64. Catalog entries may list the \"scopes\" and \"architectures\" they are generated in")
+    variant_group.add_argument('--scopes', type=str, nargs="+", choices=SCOPES, default=None, help="winget install scopes. Defaults to machine")
+    variant_group.add_argument('--architectures', type=str, nargs="+", choices=ARCHITECTURES, default=None, help="winget install architectures. Defaults to letting winget choose")
+    variant_group.add_argument('--tenants', type=str, nargs="+", default=None, help="names of the tenants to generate for")
+    variant_group.add_argument('--variants', type=str, default=None, help="path to a JSON file declaring the matrix as {\"scopes\": [...], \"architectures\": [...], \"tenants\": [...]}, instead of --scopes, --architectures and --tenants")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="number of applications to build in parallel. Defaults to 1 (serial).")
+    parser.add_argument('--packager-jobs', type=int, default=None, help="maximum number of concurrent IntuneWinAppUtil.exe processes. Defaults to --jobs.")
+    parser.add_argument('--winget-jobs', type=int, default=None, help="maximum number of concurrent winget.exe processes. Defaults to --jobs.")
+    parser.add_argument('--refresh', action="store_true", default=False, help="ignore cached winget show output and query winget again")
+    parser.add_argument('--cache', type=str, default=str(DEFAULT_CACHE_PATH), help=f"path to the winget show cache. Defaults to {DEFAULT_CACHE_PATH}")
+    parser.add_argument('--cache-ttl', type=float, default=DEFAULT_TTL_HOURS, help=f"hours before cached winget show output expires. Defaults to {DEFAULT_TTL_HOURS}")
+    parser.add_argument('--winget-index', type=str, default=None, help="path to an index of the winget manifests repository built with winget_index.py. Applications whose winget id or pinned version isn't in the index are skipped, and --show writes package_details.yaml from the index instead of running winget")
+    parser.add_argument('--winget', type=str, default=None, help="path to the winget executable (or a stand-in). Defaults to winget.exe on the path")
+    parser.add_argument('--packager', choices=PACKAGER_BACKENDS, default=None, help="build intunewin files in-process (native), with IntuneWinAppUtil.exe (external) or native if available (auto). Defaults to auto.")
+    parser.add_argument('--store', type=str, default=None, help="path to a content-addressed store to write generated files into. Identical files are stored once and hardlinked into the application folders (copied where hardlinks aren't possible)")
+    parser.add_argument('--report', type=str, default=None, help="path to write a JSON report of per-stage timings, bytes written and subprocess outcomes, per application and in aggregate")
+    parser.add_argument('--profile', type=str, default=None, help="path to write a cProfile dump of the run to")
+    parser.add_argument('--force', action="store_true", default=False, help="rebuild every application, even those whose inputs are unchanged since the last build")
+    parser.add_argument('--resume', action="store_true", default=False, help="continue the interrupted run journaled in --outfolder, skipping the applications it finished (successfully or not)")
+    parser.add_argument('--failures', type=str, default=None, help="path to write the catalog entries of applications that failed, with their error, to retry them with -i. Defaults to .intunify_failures.jsonl in --outfolder")
+    parser.add_argument('--retries', type=int, default=2, help="times to retry a winget or IntuneWinAppUtil.exe process that timed out (or an IntuneWinAppUtil.exe process that failed). Defaults to 2")
+    parser.add_argument('--retry-backoff', type=float, default=2.0, help="seconds to wait before the first retry, doubled for every further retry. Defaults to 2")
+    parser.add_argument('--packager-timeout', type=float, default=SUBPROCESS_TIMEOUTS["packager"], help=f"seconds before a hung IntuneWinAppUtil.exe process is killed. Defaults to {SUBPROCESS_TIMEOUTS['packager']:g}")
+    parser.add_argument('--winget-timeout', type=float, default=SUBPROCESS_TIMEOUTS["winget"], help=f"seconds before a hung winget process is killed. Defaults to {SUBPROCESS_TIMEOUTS['winget']:g}")
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if bool(args.outfolder) == bool(args.archive):
+        parser.error("exactly one of --outfolder and --archive is required")
+    if args.archive and (args.resume or args.failures):
+        parser.error("--resume and --failures require --outfolder")
+    if args.retries < 0 or args.retry_backoff < 0:
+        parser.error("--retries and --retry-backoff can't be negative")
+    if args.packager_timeout <= 0 or args.winget_timeout <= 0:
+        parser.error("--packager-timeout and --winget-timeout must be positive")
+    if args.archive:
+        try:
+            archive_format(Path(args.archive))
+        except ValueError as exc:
+            parser.error(str(exc))
+    if args.variants and (args.scopes or args.architectures or args.tenants):
+        parser.error("--variants can't be combined with --scopes, --architectures or --tenants")
+    try:
+        variant_matrix(args.scopes, args.architectures, args.tenants)
+    except ValueError as exc:
+        parser.error(str(exc))
+    return args
+
+
+def installer_arguments(application):
+    """Return the keyword arguments of generate_installer and render_installer describing a single validated application config."""
+    winget_id = application["winget_id"]
+    registry_key = None
+    display_name = None
+    file_path = None
+    version = None
+    if "registry_key" in application:
+        registry_key = application["registry_key"]
+    elif "display_name" in application:
+        display_name = application["display_name"]
+    elif "file_path" in application:
+        file_path = application["file_path"]
+    if "version" in application:
+        version = application["version"]
+    else:
+        version = None
+    return dict(winget_id=winget_id, registry_key=registry_key, file_path=file_path, display_name=display_name, version=version)
+
+
+def build_application(application, output_parent_directory, include_show_output=False, manifest=None, force=False, show_cache=None, matrix=None, **options):
+    """Build the intunewin app for a single validated application config, or for a bundle as yielded by group_bundles.
+
+    With a list of Variants as matrix, the application is built in every variant of the matrix it
+    is available in (see application_variants). Further keyword arguments (e.g. fast_detection)
+    are passed on to generate_installer.
+
+    Returns:
+        bool: True if the intunewin file was generated
+    """
+    if matrix is not None:
+        options["variants"] = application_variants(application, matrix)
+    if "members" in application:
+        # Bundles always detect display names in a single registry pass
+        options.pop("fast_detection", None)
+        return generate_bundle_installer(bundle=application["bundle"], members=application["members"], output_parent_directory=output_parent_directory, include_show_output=include_show_output, manifest=manifest, force=force, show_cache=show_cache, **options)
+    return generate_installer(**installer_arguments(application), output_parent_directory=output_parent_directory, include_show_output=include_show_output, manifest=manifest, force=force, show_cache=show_cache, **options)
+
+
+def render_application(application, include_show_output=False, show_cache=None, matrix=None, **options):
+    """Render the packages of a single validated application config, or of a bundle, in memory.
+
+    Arguments are as for build_application.
+
+    Returns:
+        List[Package]: one package per variant
+    """
+    if matrix is not None:
+        options["variants"] = application_variants(application, matrix)
+    if "members" in application:
+        options.pop("fast_detection", None)
+        return render_bundle_installer(bundle=application["bundle"], members=application["members"], include_show_output=include_show_output, show_cache=show_cache, **options)
+    return render_installer(**installer_arguments(application), include_show_output=include_show_output, show_cache=show_cache, **options)
+
+
+def application_label(application):
+    """Return the name an application (its winget_id) or a bundle is reported under in the summary."""
+    if "members" in application:
+        return f"bundle {application['bundle']}"
+    return application["winget_id"]
+
+
+def map_in_order(function, items, jobs=1, window=None):
+    """Yield (item, function(item)) for every item, calling function on a pool of 'jobs' workers.
+
+    Items are pulled from 'items' only as workers free up (at most 'window' in flight,
+    2 * jobs by default), so the first call starts straight away and memory use doesn't
+    depend on the number of items. Results are yielded in input order.
+    """
+    window = window or 2 * jobs
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for item in items:
+            pending.append((item, executor.submit(function, item)))
+            if len(pending) >= window:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+
+def _map_results(function, applications, jobs=1, window=None, on_done=None):
+    # Yields (label, error) per application, error being None if function returned True
+    def call(application):
+        try:
+            error = None if function(application) else "intunewin file was not generated"
+        except Exception as exc:
+            error = f"{type(exc).__name__}: {exc}"
+        if on_done is not None:
+            error = on_done(application, error)
+        return error
+
+    for application, error in map_in_order(call, applications, jobs, window):
+        yield application_label(application), error
+
+
+def build_applications(applications, output_parent_directory, include_show_output=False, jobs=1, manifest=None, force=False, show_cache=None, window=None, on_done=None, **options):
+    """Build applications from an iterable on a pool of 'jobs' workers.
+
+    Applications are pulled from 'applications' only as workers free up (at most 'window'
+    in flight, 2 * jobs by default), so the first package starts building straight away
+    and memory use doesn't depend on the number of applications. Further keyword arguments
+    are passed on to generate_installer.
+
+    on_done, if given, is called from the worker with (application, error) as soon as an
+    application finishes, e.g. to journal it, and returns the error to report.
+
+    Yields:
+        Tuple[str, str or None]: (winget_id, error) per application or bundle, in input order.
+        error is None for applications that were built successfully.
+    """
+    def build(application):
+        return build_application(application, output_parent_directory, include_show_output, manifest, force, show_cache, **options)
+
+    return _map_results(build, applications, jobs, window, on_done)
+
+
+def journal_label(entry):
+    """Return the name a catalog entry is journaled under: its winget_id, or its bundle's application_label."""
+    if "bundle" in entry:
+        return f"bundle {entry['bundle']}"
+    return entry["winget_id"]
+
+
+def write_applications(applications, sink, include_show_output=False, jobs=1, show_cache=None, window=None, **options):
+    """Render applications on a pool of 'jobs' workers and write their packages to 'sink'
+    (e.g. an ArchiveSink), without build manifests or package folders.
+
+    Applications are pulled from 'applications' as for build_applications. Further keyword
+    arguments are passed on to render_installer.
+
+    Yields:
+        Tuple[str, str or None]: (winget_id, error) per application or bundle, in input order.
+    """
+    def write(application):
+        results = [sink.write(package) for package in render_application(application, include_show_output, show_cache, **options)]
+        return all(results)
+
+    return _map_results(write, applications, jobs, window)
+
+
+def print_summary(results, invalid=0, noun="applications", verb="Built"):
+    """Print an aggregated success/failure summary of a bulk run.
+
+    Args:
+        results (Iterable[Tuple[str, str or None]]): (winget_id, error) as yielded by build_applications
+        invalid (int or Callable[[], int]): number of invalid catalog records that were skipped
+        noun (str): what was built, e.g. "uninstallers"
+        verb (str): what was done to them, e.g. "Published"
+    """
+    total = 0
+    failures = []
+    for winget_id, error in results:
+        total += 1
+        if error is not None:
+            failures.append((winget_id, error))
+    if callable(invalid):
+        invalid = invalid()
+    print(f"{verb} {total - len(failures)} of {total} {noun}, {len(failures)} failed.")
+    for winget_id, error in failures:
+        print(f"  {winget_id}: {error}")
+    if invalid:
+        print(f"Skipped {invalid} invalid catalog records.")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = instrumentation.start_report() if args.report else None
+    profiler = None
+    if args.profile:
+        profiler = instrumentation.Profiler()
+        profiler.start()
+    try:
+        run(args)
+    finally:
+        if profiler is not None:
+            profiler.stop(Path(args.profile))
+        if report is not None:
+            instrumentation.stop_report()
+            report.write(Path(args.report))
+
+
+def run(args):
+    """Build the applications of the catalog given on the command line."""
+    set_subprocess_limits(
+        packager_jobs=args.packager_jobs or args.jobs,
+        winget_jobs=args.winget_jobs or args.jobs,
+    )
+    if args.winget:
+        intunify.WINGET_EXECUTABLE = args.winget
+    if args.packager:
+        set_packager_backend(args.packager)
+    if args.store:
+        set_output_store(Path(args.store))
+    set_subprocess_timeouts(packager=args.packager_timeout, winget=args.winget_timeout)
+    set_retry_policy(args.retries, args.retry_backoff)
+
+    # Stream, validate and filter the catalog one record at a time.
+    # Invalid records are reported with their line number and skipped.
+    invalid = []
+    def report_invalid(error):
+        invalid.append(error.line)
+        print(f"{args.infile}: {error}")
+    applications = iter_applications(iter_catalog(Path(args.infile)), on_error=report_invalid)
+
     # Remove excluded ids
     # parsed as command line arguments
     if args.exclude:
-        lower_cased_ids_to_exclude = [winget_id.lower() for winget_id in args.exclude]
-        applications = [
-            app
-            for app
-            in applications
-            if app["winget_id"].lower() not in lower_cased_ids_to_exclude
-        ]
+        applications = exclude_applications(applications, args.exclude)
 
     # ...or as a file path
     elif args.excludefile:
         p = Path(args.excludefile)
         with p.open('r') as f:
             exclusions = json.load(f)
-            lower_cased_ids_to_exclude = [winget_id.lower() for winget_id in exclusions]
-            applications = [
-                app
-                for app
-                in applications
-                if app["winget_id"].lower() not in lower_cased_ids_to_exclude
-            ]
-
-    # Build intunewin app
-    for application in applications:
-        winget_id = application["winget_id"]
-        registry_key = None
-        display_name = None
-        file_path = None
-        version = None
-        if "registry_key" in application:
-            registry_key = application["registry_key"]
-        elif "display_name" in application:
-            display_name = application["display_name"]
-        elif "file_path" in application:
-            file_path = application["file_path"]
-        if "version" in application:
-            version = application["version"]
+        applications = exclude_applications(applications, exclusions)
+
+    # Journal the run in the output folder and, with --resume, skip what the interrupted run finished
+    journal = None
+    resumed = []
+    if args.outfolder:
+        output_parent_directory = Path(args.outfolder).absolute()
+        journal = BuildJournal(output_parent_directory, resume=args.resume, failures_path=Path(args.failures) if args.failures else None)
+        if journal.finished:
+            def unfinished(applications):
+                for application in applications:
+                    if journal_label(application) in journal.finished:
+                        resumed.append(application)
+                    else:
+                        yield application
+            applications = unfinished(applications)
+
+    # Fill in placeholder detection values from the registry index
+    registry_index = None
+    if args.registry_index:
+        registry_index = RegistryIndex(Path(args.registry_index))
+        def report_unresolved(application):
+            print(f"{application['winget_id']}: no match for {application.get('name') or application['winget_id']!r} in {args.registry_index}, keeping the placeholder.")
+        applications = resolve_detection(applications, registry_index, cutoff=args.registry_cutoff, on_unresolved=report_unresolved)
+
+    # Pin unpinned applications to their locked version
+    if args.lockfile:
+        versions = read_lockfile(Path(args.lockfile))
+        def report_unlocked(application):
+            print(f"{application['winget_id']} is not in {args.lockfile}, building the latest version.")
+        applications = apply_locked_versions(applications, versions, on_missing=report_unlocked)
+
+    # Skip applications that can't be installed from the indexed winget repository
+    winget_index = None
+    unknown = []
+    if args.winget_index:
+        winget_index = WingetIndex(Path(args.winget_index))
+        def report_unknown(error):
+            unknown.append(error)
+            print(f"{args.infile}: {error}")
+        applications = validate_applications(applications, winget_index, on_error=report_unknown)
+
+    # Fetch winget show cache misses on the winget pool ahead of generation
+    show_cache = None
+    prefetcher = None
+    if args.show and winget_index is None:
+        show_cache = WingetShowCache(Path(args.cache), ttl=args.cache_ttl * 3600, refresh=args.refresh)
+        prefetcher = ThreadPoolExecutor(max_workers=args.winget_jobs or args.jobs)
+        applications = show_cache.iter_prefetched(applications, prefetcher)
+
+    # Hold back applications with a 'bundle' property and build each bundle as one package
+    applications = group_bundles(applications)
+
+    # Build every application once per variant of the matrix, if one is declared
+    matrix = None
+    if args.variants:
+        matrix = load_variant_matrix(Path(args.variants))
+    elif args.scopes or args.architectures or args.tenants:
+        matrix = variant_matrix(args.scopes, args.architectures, args.tenants)
+
+    # Build intunewin apps, or stream them into an archive
+    options = dict(winget_index=winget_index, matrix=matrix, fast_detection=args.fast_detection, registry_view=args.registry_view, include_current_user=args.current_user, match_version=args.match_version)
+    window = 2 * max(args.jobs, args.winget_jobs or 0)
+    manifest = None
+    sink = None
+    listener = None
+
+    def finish(application, error):
+        if "members" in application:
+            return journal.finish(application_label(application), error, application["members"], app=application["bundle"])
+        return journal.finish(application_label(application), error, [application])
+
+    try:
+        if args.archive:
+            sink = ArchiveSink(Path(args.archive))
+            results = write_applications(applications, sink, include_show_output=args.show, jobs=args.jobs, show_cache=show_cache, window=window, **options)
+            print_summary(results, invalid=lambda: len(invalid) + len(unknown), verb="Archived")
         else:
-            version = None
-        
-        generate_installer(winget_id=winget_id, registry_key=registry_key, file_path=file_path, display_name=display_name, version=version, output_parent_directory=Path(args.outfolder).absolute(), include_show_output=args.show)
+            manifest = BuildManifest(output_parent_directory)
+            journal.attach(manifest)
+            listener = journal.stage_finished
+            instrumentation.add_listener(listener)
+            results = build_applications(applications, output_parent_directory, include_show_output=args.show, jobs=args.jobs, manifest=manifest, force=args.force, show_cache=show_cache, window=window, on_done=finish, **options)
+            print_summary(results, invalid=lambda: len(invalid) + len(unknown))
+            if resumed:
+                print(f"Skipped {len(resumed)} catalog entries finished before the run was resumed.")
+            if journal.failures:
+                print(f"Wrote the failed applications to {journal.failures_path}. Retry them with -i {journal.failures_path}")
+        if show_cache is not None and (show_cache.fetched or show_cache.failed):
+            print(f"Fetched winget show output for {show_cache.fetched} applications, {show_cache.failed} failed.")
+    finally:
+        if manifest is not None:
+            manifest.save()
+        if listener is not None:
+            instrumentation.remove_listener(listener)
+        if journal is not None:
+            journal.close()
+        if sink is not None:
+            sink.close()
+        if prefetcher is not None:
+            prefetcher.shutdown()
+        if show_cache is not None:
+            show_cache.close()
+        if registry_index is not None:
+            registry_index.close()
+        if winget_index is not None:
+            winget_index.close()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,122 @@
+"""bulk_uninstaller_generator.py
+
+Generates uninstall packages for every entry of a JSON (array) or JSON Lines
+catalog of {"name": ..., "key": ...} entries, on a pool of workers, e.g.
+    python bulk_uninstaller_generator.py -i decommission.json -o out --jobs 8
+
+'name' is the DisplayName of the application to uninstall. 'key' (the
+registry key to uninstall from) and 'display_version' are optional.
+"""
+
+
+from argparse import ArgumentParser
+from pathlib import Path
+from build_manifest import BuildManifest
+from bulk_application_installer_generator import map_in_order, print_summary
+from catalog import iter_applications, iter_catalog, validate_uninstaller
+from create_uninstaller import generate_uninstaller
+import instrumentation
+from intunify import set_subprocess_limits, set_packager_backend, set_output_store, PACKAGER_BACKENDS, REGISTRY_VIEWS
+from templating import load_all_templates
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser()
+    parser.add_argument('-i', '--infile', type=str, required=True, help="path to JSON (array) or JSON Lines input file of {\"name\": ..., \"key\": ...} entries")
+    parser.add_argument('-o', '--outfolder', type=str, required=True, help="path to place intunewin apps")
+    parser.add_argument('--fast', action="store_true", default=False, help="for entries without a key, generate detection and uninstall scripts that read only the DisplayName value of each Uninstall key and stop at the first match")
+    parser.add_argument('--registry-view', choices=REGISTRY_VIEWS, default="both", help="with --fast, which bitness of the HKLM Uninstall keys to search. Defaults to both.")
+    parser.add_argument('--current-user', action="store_true", default=False, help="with --fast, also search the HKCU Uninstall keys")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="number of uninstallers to build in parallel. Defaults to 1 (serial).")
+    parser.add_argument('--packager-jobs', type=int, default=None, help="maximum number of concurrent IntuneWinAppUtil.exe processes. Defaults to --jobs.")
+    parser.add_argument('--packager', choices=PACKAGER_BACKENDS, default=None, help="build intunewin files in-process (native), with IntuneWinAppUtil.exe (external) or native if available (auto). Defaults to auto.")
+    parser.add_argument('--store', type=str, default=None, help="path to a content-addressed store to write generated files into")
+    parser.add_argument('--report', type=str, default=None, help="path to write a JSON report of per-stage timings, bytes written and subprocess outcomes")
+    parser.add_argument('--force', action="store_true", default=False, help="rebuild every uninstaller, even those whose inputs are unchanged since the last build")
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    return args
+
+
+def build_uninstaller(entry, output_parent_directory, manifest=None, force=False, fast=False, registry_view="both", include_current_user=False):
+    """Build the uninstall package for a single validated uninstaller config entry.
+
+    Entries with a key ignore fast, as their scripts target the key directly.
+
+    Returns:
+        bool: True if the intunewin file was generated
+    """
+    key = entry.get("key")
+    return generate_uninstaller(
+        name=entry["name"],
+        key=key,
+        output_parent_directory=output_parent_directory,
+        manifest=manifest,
+        force=force,
+        fast=fast and key is None,
+        registry_view=registry_view,
+        include_current_user=include_current_user,
+        display_version=entry.get("display_version"),
+    )
+
+
+def build_uninstallers(entries, output_parent_directory, jobs=1, manifest=None, force=False, window=None, **options):
+    """Build uninstallers from an iterable on a pool of 'jobs' workers. See build_applications.
+
+    Yields:
+        Tuple[str, str or None]: (name, error) per entry, in input order.
+        error is None for uninstallers that were built successfully.
+    """
+    def build(entry):
+        try:
+            if build_uninstaller(entry, output_parent_directory, manifest, force, **options):
+                return None
+            return "intunewin file was not generated"
+        except Exception as exc:
+            return f"{type(exc).__name__}: {exc}"
+
+    for entry, error in map_in_order(build, entries, jobs, window):
+        yield entry["name"], error
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = instrumentation.start_report() if args.report else None
+    try:
+        run(args)
+    finally:
+        if report is not None:
+            instrumentation.stop_report()
+            report.write(Path(args.report))
+
+
+def run(args):
+    """Build the uninstallers of the catalog given on the command line."""
+    set_subprocess_limits(packager_jobs=args.packager_jobs or args.jobs)
+    if args.packager:
+        set_packager_backend(args.packager)
+    if args.store:
+        set_output_store(Path(args.store))
+    # Load every template once up front; the workers share them
+    load_all_templates()
+
+    invalid = []
+    def report_invalid(error):
+        invalid.append(error.line)
+        print(f"{args.infile}: {error}")
+    entries = iter_applications(iter_catalog(Path(args.infile)), on_error=report_invalid, validate=validate_uninstaller)
+
+    output_parent_directory = Path(args.outfolder).absolute()
+    Path.mkdir(output_parent_directory, parents=True, exist_ok=True)
+    manifest = BuildManifest(output_parent_directory)
+    try:
+        results = build_uninstallers(entries, output_parent_directory, jobs=args.jobs, manifest=manifest, force=args.force,
+            fast=args.fast, registry_view=args.registry_view, include_current_user=args.current_user)
+        print_summary(results, invalid=lambda: len(invalid), noun="uninstallers")
+    finally:
+        manifest.save()
+
+
+if __name__ == '__main__':
+    main()
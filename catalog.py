@@ -0,0 +1,280 @@
+"""catalog.py
+
+Streams application config entries out of catalog files, one record at a time.
+
+Catalogs are either a JSON array of objects (like example.json) or JSON Lines
+(one object per line). The format is detected from the first non-whitespace
+character. Records are parsed incrementally, so memory use doesn't grow with
+the size of the catalog, and every record is reported with the line it
+starts on.
+"""
+
+
+import json
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Tuple
+
+from variants import ARCHITECTURES, SCOPES
+
+
+READ_SIZE = 64 * 1024
+
+MATCHING_PROPS = ["registry_key", "file_path", "display_name"]
+
+_decoder = json.JSONDecoder()
+_whitespace = " \t\r\n"
+
+
+class CatalogError(ValueError):
+    """An invalid catalog record.
+
+    Args:
+        message (str)
+        line (int): line of the catalog file the record starts on
+    """
+
+    def __init__(self, message: str, line: int):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+
+
+def _iter_json_lines(f, line: int = 1) -> Iterator[Tuple[int, object]]:
+    for text in f:
+        if text.strip():
+            try:
+                yield line, json.loads(text)
+            except ValueError as exc:
+                yield line, CatalogError(f"invalid JSON: {exc}", line)
+        line += 1
+
+
+def _iter_json_array(f) -> Iterator[Tuple[int, object]]:
+    buffer = ""
+    pos = 0
+    line = 1
+    eof = False
+
+    def read_more() -> bool:
+        # Appends the next chunk of the file to the unconsumed part of the buffer
+        nonlocal buffer, pos, eof
+        more = "" if eof else f.read(READ_SIZE)
+        eof = not more
+        buffer, pos = buffer[pos:] + more, 0
+        return not eof
+
+    def skip_whitespace() -> bool:
+        # Advances past whitespace, returning False at the end of the file
+        nonlocal pos, line
+        while True:
+            while pos < len(buffer) and buffer[pos] in _whitespace:
+                if buffer[pos] == "\n":
+                    line += 1
+                pos += 1
+            if pos < len(buffer):
+                return True
+            if not read_more():
+                return False
+
+    if not skip_whitespace() or buffer[pos] != "[":
+        yield line, CatalogError("expected a JSON array", line)
+        return
+    pos += 1
+    first = True
+    while True:
+        if not skip_whitespace():
+            yield line, CatalogError("unexpected end of file, expected ']'", line)
+            return
+        if buffer[pos] == "]" and first:
+            return
+        if not first:
+            if buffer[pos] == "]":
+                return
+            if buffer[pos] != ",":
+                yield line, CatalogError(f"expected ',' or ']', found {buffer[pos]!r}", line)
+                return
+            pos += 1
+            if not skip_whitespace():
+                yield line, CatalogError("unexpected end of file, expected a value", line)
+                return
+        first = False
+
+        # Parse the next value, reading more of the file until it is complete
+        while True:
+            try:
+                value, end = _decoder.raw_decode(buffer, pos)
+            except ValueError as exc:
+                if read_more():
+                    continue
+                yield line, CatalogError(f"invalid JSON: {exc.msg}", line)
+                return
+            # A number at the very end of the buffer may continue in the next chunk
+            if end == len(buffer) and read_more():
+                continue
+            break
+        yield line, value
+        line += buffer.count("\n", pos, end)
+        pos = end
+
+
+def iter_catalog(path: Path) -> Iterator[Tuple[int, object]]:
+    """Yield (line, record) for every record in a JSON array or JSON Lines catalog.
+
+    Records that can't be parsed are yielded as CatalogError instances. In JSON Lines
+    catalogs parsing continues with the next line; in JSON arrays it stops, as the
+    rest of the array can't be located reliably.
+
+    Args:
+        path (Path): catalog file path
+
+    Yields:
+        Tuple[int, object]: line the record starts on, parsed record or CatalogError
+    """
+    with Path(path).open("r") as f:
+        first = f.read(1)
+        line = 1
+        while first and first in _whitespace:
+            if first == "\n":
+                line += 1
+            first = f.read(1)
+        if first == "[":
+            f.seek(0)
+            yield from _iter_json_array(f)
+        elif first:
+            # Put back the character we read to sniff the format
+            yield from _iter_json_lines(_prepend(first, f), line)
+
+
+def _prepend(text: str, f) -> Iterator[str]:
+    lines = iter(f)
+    yield text + next(lines, "")
+    yield from lines
+
+
+def validate_application(application: object) -> None:
+    """Raise ValueError if 'application' is not a valid application config entry.
+
+    Args:
+        application (object): parsed catalog record
+    """
+    if not isinstance(application, dict):
+        raise ValueError(f"All applications must be JSON objects. Received: {application!r}")
+    if "winget_id" not in application:
+        raise ValueError("All applications must supply a valid 'winget_id' key")
+    if not application["winget_id"] or not isinstance(application["winget_id"], str):
+        raise ValueError(f"All applications must supply a valid 'winget_id' value. Received: {application['winget_id']!r}")
+    count_matches = len([application.get(a, None) for a in MATCHING_PROPS if application.get(a, None) is not None])
+    if count_matches != 1:
+        raise ValueError(f"All applications must contain exactly one of a 'file_path', 'display_name' or a 'registry_key' property")
+    if "bundle" in application and (not application["bundle"] or not isinstance(application["bundle"], str)):
+        raise ValueError(f"'bundle' must be a non-empty string. Received: {application['bundle']!r}")
+    for field, allowed in [("scopes", SCOPES), ("architectures", ARCHITECTURES)]:
+        values = application.get(field)
+        if values is not None and (not isinstance(values, list) or not values or any(value not in allowed for value in values)):
+            raise ValueError(f"'{field}' must be a non-empty list of {', '.join(allowed)}. Received: {values!r}")
+
+
+def validate_uninstaller(entry: object) -> None:
+    """Raise ValueError if 'entry' is not a valid uninstaller config entry.
+
+    Uninstaller entries have a 'name' (the DisplayName to uninstall) and optionally a 'key'
+    (the registry key to uninstall from) and a 'display_version' to match.
+
+    Args:
+        entry (object): parsed catalog record
+    """
+    if not isinstance(entry, dict):
+        raise ValueError(f"All uninstallers must be JSON objects. Received: {entry!r}")
+    if not entry.get("name") or not isinstance(entry["name"], str):
+        raise ValueError(f"All uninstallers must supply a valid 'name' value. Received: {entry.get('name')!r}")
+    key = entry.get("key")
+    if key is not None and (not isinstance(key, str) or not key.startswith("HKEY_LOCAL_MACHINE")):
+        raise ValueError(f"'key' must be a registry key path starting with HKEY_LOCAL_MACHINE. Received: {key!r}")
+    display_version = entry.get("display_version")
+    if display_version is not None and not isinstance(display_version, str):
+        raise ValueError(f"'display_version' must be a string. Received: {display_version!r}")
+
+
+def iter_applications(records: Iterable[Tuple[int, object]], on_error=print, validate=validate_application) -> Iterator[dict]:
+    """Yield the valid application config entries of a stream of catalog records.
+
+    Invalid records are passed to 'on_error' as CatalogError instances and skipped.
+
+    Args:
+        records (Iterable[Tuple[int, object]]): (line, record) pairs as yielded by iter_catalog
+        on_error (Callable[[CatalogError], None]): called for every invalid record. Defaults to print.
+        validate (Callable[[object], None]): raises ValueError for invalid records. Defaults to
+            validate_application; validate_uninstaller for uninstaller catalogs.
+
+    Yields:
+        dict: application config entry
+    """
+    for line, record in records:
+        if isinstance(record, CatalogError):
+            on_error(record)
+            continue
+        try:
+            validate(record)
+        except ValueError as exc:
+            on_error(CatalogError(str(exc), line))
+            continue
+        yield record
+
+
+def apply_locked_versions(applications: Iterable[dict], versions: Dict[str, str], on_missing=None) -> Iterator[dict]:
+    """Pin every application that doesn't pin a version itself to its locked version.
+
+    Args:
+        applications (Iterable[dict]): application config entries
+        versions (Dict[str, str]): lowercase winget id -> locked version
+        on_missing (Callable[[dict], None] or None): called for every unpinned application without a locked version
+
+    Yields:
+        dict: application config entry
+    """
+    for application in applications:
+        if not application.get("version"):
+            version = versions.get(application["winget_id"].lower())
+            if version is not None:
+                application = dict(application, version=version)
+            elif on_missing is not None:
+                on_missing(application)
+        yield application
+
+
+def group_bundles(applications: Iterable[dict]) -> Iterator[dict]:
+    """Pass applications without a 'bundle' property through and group the rest by bundle name.
+
+    Unbundled applications are yielded as they arrive. Bundled applications are held back
+    until 'applications' is exhausted, then every bundle is yielded, in the order it first
+    appeared, as {"bundle": name, "members": [application, ...]} with its members in catalog order.
+
+    Args:
+        applications (Iterable[dict]): application config entries
+
+    Yields:
+        dict: application config entry or bundle
+    """
+    bundles = {}
+    for application in applications:
+        if "bundle" in application:
+            bundles.setdefault(application["bundle"], []).append(application)
+        else:
+            yield application
+    for name, members in bundles.items():
+        yield {"bundle": name, "members": members}
+
+
+def exclude_applications(applications: Iterable[dict], winget_ids: Iterable[str]) -> Iterator[dict]:
+    """Yield the applications whose winget_id is not in 'winget_ids'. Case insensitive.
+
+    Args:
+        applications (Iterable[dict]): application config entries
+        winget_ids (Iterable[str]): winget ids to exclude
+
+    Yields:
+        dict: application config entry
+    """
+    excluded = {winget_id.lower() for winget_id in winget_ids}
+    for application in applications:
+        if application["winget_id"].lower() not in excluded:
+            yield application
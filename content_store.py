@@ -0,0 +1,95 @@
+"""content_store.py
+
+Content-addressed store for generated files, so that byte-identical files
+across applications (and tenants) are written to disk once.
+
+Every file is stored under the SHA256 of its text and hardlinked into the
+application folders that use it. Writing a file whose content is already in
+the store is a lookup and a link. Where hardlinks aren't possible (e.g. the
+store is on another volume) the file is copied instead.
+
+Application folders never write through a link: files are replaced by
+renaming a new link over them, so the stored copy can't be modified through
+an application folder.
+"""
+
+
+import hashlib
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Tuple
+
+
+class ContentStore:
+    """A directory of files keyed by the SHA256 of their content, safe to share between threads.
+
+    Args:
+        root (Path): store directory. Created if it doesn't exist.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.objects = self.root / "objects"
+        self.objects.mkdir(parents=True, exist_ok=True)
+
+    def object_path(self, digest: str) -> Path:
+        return self.objects / digest[:2] / digest[2:]
+
+    def put_text(self, text: str, encoding: str or None = None) -> Tuple[Path, int]:
+        """Store 'text' unless a file with the same content is already stored.
+
+        The file is written in text mode, as open(path, "w", encoding=encoding) would, so that it
+        is identical to the file that would have been written without the store.
+
+        Returns:
+            Tuple[Path, int]: path of the stored file, bytes written (0 if it was already stored)
+        """
+        digest = hashlib.sha256(f"{encoding or ''}\0{text}".encode("utf-8", "surrogatepass"))
+        path = self.object_path(digest.hexdigest())
+        if path.exists():
+            return path, 0
+        path.parent.mkdir(exist_ok=True)
+        # Concurrent writers of the same content each write their own file; the last rename wins
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with tmp_path.open("w", encoding=encoding) as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        return path, path.stat().st_size
+
+    def link(self, path: Path, destination: Path) -> None:
+        """Make 'destination' a hardlink to the stored file 'path', falling back to a copy.
+
+        Does nothing if 'destination' already is a link to 'path'.
+        """
+        destination = Path(destination)
+        try:
+            if os.path.samefile(path, destination):
+                return
+        except FileNotFoundError:
+            pass
+        tmp_path = destination.with_name(f"{destination.name}.{threading.get_ident()}.tmp")
+        try:
+            try:
+                os.link(path, tmp_path)
+            except OSError:
+                shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, destination)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def write_text(self, destination: Path, text: str, encoding: str or None = None) -> int:
+        """Store 'text' and link it to 'destination'.
+
+        Returns:
+            int: bytes written to the store (0 if the content was already stored)
+        """
+        path, written = self.put_text(text, encoding)
+        self.link(path, destination)
+        return written
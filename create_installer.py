@@ -31,11 +31,18 @@ package in the same directory e.g.
 
 from pathlib import Path
 from argparse import ArgumentParser, Namespace
-from intunify import copy_nary_file, slugify, create_intunewin_file, get_winget_show_output
+from intunify import render_nary_file, set_output_store, slugify, get_winget_show_output, get_packager_version, set_packager_backend, registry_locations, PACKAGER_BACKENDS, REGISTRY_VIEWS
+from build_manifest import BuildManifest, hash_build_inputs
+from winget_cache import WingetShowCache
+from winget_index import WingetIndex
+from variants import DEFAULT_VARIANT
+from packages import DirectorySink, Package
+import instrumentation
+from templating import get_template, INSTALLER_TEMPLATES_DIR, WINGET_ID_TO_REPLACE, PATH_TO_REPLACE, VERSION_TO_REPLACE, REGISTRY_DISPLAY_NAME_TO_REPLACE, REGISTRY_LOCATIONS_TO_REPLACE, DISPLAY_VERSION_TO_REPLACE, BUNDLE_NAME_TO_REPLACE, BUNDLE_MEMBERS_TO_REPLACE, BUNDLE_WINGET_IDS_TO_REPLACE, INSTALL_OPTIONS_TO_REPLACE
 
 
-def get_args() -> Namespace:
-    """Return the arguments parsed in from the command line
+def get_args(argv=None) -> Namespace:
+    """Return the arguments parsed in from the command line, or from argv if given
 
     Returns:
         Namespace: args
@@ -71,6 +78,30 @@ def get_args() -> Namespace:
         type=str,
         help=r'DisplayName property an exact match to a registry key will be used as evidence of successful installation. e.g. "Docker Desktop"',
     )
+    parser.add_argument(
+        "--fast-detection",
+        action="store_true",
+        default=False,
+        help="With --display_name, generate detection and uninstall scripts that read only the DisplayName value of each Uninstall key and stop at the first match.",
+    )
+    parser.add_argument(
+        "--registry-view",
+        choices=REGISTRY_VIEWS,
+        default="both",
+        help="With --fast-detection, which bitness of the HKLM Uninstall keys to search. Defaults to both.",
+    )
+    parser.add_argument(
+        "--current-user",
+        action="store_true",
+        default=False,
+        help="With --fast-detection, also search the HKCU Uninstall keys.",
+    )
+    parser.add_argument(
+        "--match-version",
+        action="store_true",
+        default=False,
+        help="With --fast-detection and --version, only detect installations whose DisplayVersion equals --version.",
+    )
     parser.add_argument(
         "-s",
         '--show', 
@@ -78,49 +109,289 @@ def get_args() -> Namespace:
         default=False,
         help=r'Save winget show output to "package_details.yaml" file.',
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        '--refresh',
+        action="store_true",
+        default=False,
+        help="Ignore cached winget show output and query winget again.",
+    )
+    parser.add_argument(
+        '--winget-index',
+        type=str,
+        default=None,
+        help="With --show, write package_details.yaml from an index of the winget manifests repository built with winget_index.py instead of running winget.",
+    )
+    parser.add_argument(
+        '--packager',
+        choices=PACKAGER_BACKENDS,
+        default=None,
+        help="How to build the intunewin file: in-process (native), with IntuneWinAppUtil.exe (external) or native if available (auto). Defaults to auto.",
+    )
+    parser.add_argument(
+        '--store',
+        type=str,
+        default=None,
+        help="Write generated files into a content-addressed store in this folder and hardlink them into the package folder.",
+    )
+    parser.add_argument(
+        '--report',
+        type=str,
+        default=None,
+        help="Write a JSON report of per-stage timings, bytes written and subprocess outcomes to this path.",
+    )
+    parser.add_argument(
+        '--profile',
+        type=str,
+        default=None,
+        help="Write a cProfile dump of the run to this path.",
+    )
+    parser.add_argument(
+        '--force',
+        action="store_true",
+        default=False,
+        help="Rebuild the package even if its inputs are unchanged since the last build.",
+    )
+    args = parser.parse_args(argv)
     if not (args.key or args.file or args.display_name):
         parser.error("Must supply either --key, --file, or --display_name arguments.")
+    if args.fast_detection and not args.display_name:
+        parser.error("--fast-detection requires --display_name.")
+    if args.winget_index and not args.show:
+        parser.error("--winget-index requires --show.")
     return args
 
 
-def main() -> None:
+def main(argv=None) -> None:
     """
     Generate an installer package from the command line. Run create_installer.py -h for usage.
     """
-    args = get_args()
+    args = get_args(argv)
     winget_id = args.winget_id
     version = args.version
     registry_key = args.key
     file_path = args.file
     display_name = args.display_name
+    detection_options = dict(
+        fast_detection=args.fast_detection,
+        registry_view=args.registry_view,
+        include_current_user=args.current_user,
+        match_version=args.match_version,
+    )
+    if args.packager:
+        set_packager_backend(args.packager)
+    if args.store:
+        set_output_store(Path(args.store))
+
+    report = instrumentation.start_report() if args.report else None
+    profiler = None
+    if args.profile:
+        profiler = instrumentation.Profiler()
+        profiler.start()
+    try:
+        if args.show and args.winget_index:
+            with WingetIndex(Path(args.winget_index)) as winget_index:
+                generate_installer(winget_id=winget_id, registry_key=registry_key, file_path=file_path, display_name=display_name, version=version, include_show_output=args.show, force=args.force, winget_index=winget_index, **detection_options)
+        elif args.show:
+            with WingetShowCache(refresh=args.refresh) as show_cache:
+                generate_installer(winget_id=winget_id, registry_key=registry_key, file_path=file_path, display_name=display_name, version=version, include_show_output=args.show, force=args.force, show_cache=show_cache, **detection_options)
+        else:
+            generate_installer(winget_id=winget_id, registry_key=registry_key, file_path=file_path, display_name=display_name, version=version, force=args.force, **detection_options)
+    finally:
+        if profiler is not None:
+            profiler.stop(Path(args.profile))
+        if report is not None:
+            instrumentation.stop_report()
+            report.write(Path(args.report))
+
+
+def get_package_details(winget_id, show_cache=None, winget_index=None, version=None) -> str:
+    """Return the winget show output for winget_id massaged into YAML.
+
+    If a WingetIndex is passed as winget_index, the details of version (the newest indexed
+    version by default) are taken from it instead. Otherwise output is taken from show_cache
+    if one is passed, or winget is run.
+    """
+    if winget_index is not None:
+        details = winget_index.package_details(winget_id, version)
+        if details is None:
+            raise ValueError(winget_index.check(winget_id, version))
+        return details
+
+    # Need to convert to LF for correct handling by Python
+    if show_cache is not None:
+        winget_show_output = show_cache.get(winget_id)
+    else:
+        winget_show_output = get_winget_show_output(winget_id)
+    if winget_show_output is None:
+        raise RuntimeError(f"winget show failed for {winget_id}")
+    winget_show_output = winget_show_output.replace('\r\n', '\n')
 
-    generate_installer(winget_id=winget_id, registry_key=registry_key, file_path=file_path, display_name=display_name, version=version, include_show_output=args.show)
+    return winget_show_output[winget_show_output.find('Found'):].replace('Found ', 'Found: ')
 
 
-def generate_installer(winget_id, registry_key=None, file_path=None, display_name=None, version=None, output_parent_directory = Path.cwd(), include_show_output=False):
-    """Given a winget_id value, a registry key or a file path as evidence of successful installation,
-    and optionally a version string, generates a folder containing an install script,
-    a detection script, an uninstall script and a README.md file.
+def render_package_details(packages, show_cache=None, winget_index=None) -> str or None:
+    """Return the winget show output of packages as the contents of package_details.yaml.
 
-    If IntuneWinAppUtil.exe exists on the PATH, it will also generate an intunewin file.
+    Args:
+        packages (List[Tuple[str, str or None]]): (winget_id, version) of every package. Several
+            packages are rendered as one YAML document each. version is only used with winget_index.
+
+    Returns:
+        str or None: None if the output can't be saved as UTF-8
+    """
+    with instrumentation.stage("show_output") as record:
+        winget_id = None
+        try:
+            documents = [get_package_details(winget_id, show_cache, winget_index, version) for winget_id, version in packages]
+            text = "---\n".join(documents)
+            record.bytes_written = len(text.encode("utf-8"))
+            return text
+        except UnicodeEncodeError as e:
+            print(f"Encounted a decoding error when parsing winget show output for {winget_id}. Skipping...")
+            print(e)
+            return None
+
+
+def show_main(argv=None) -> None:
+    """
+    Print the package details create_installer.py --show saves to package_details.yaml for a winget id.
+    """
+    parser = ArgumentParser(description="Print the package details of a winget id, as saved to package_details.yaml with --show.")
+    parser.add_argument('winget_id', type=str)
+    parser.add_argument('-v', '--version', type=str, default=None, help="With --winget-index, the version to show. Defaults to the newest indexed version.")
+    parser.add_argument('--winget-index', type=str, default=None, help="Take the details from an index of the winget manifests repository built with winget_index.py instead of running winget.")
+    parser.add_argument('--refresh', action="store_true", default=False, help="Ignore cached winget show output and query winget again.")
+    args = parser.parse_args(argv)
+    if args.version and not args.winget_index:
+        parser.error("--version requires --winget-index.")
+    try:
+        if args.winget_index:
+            with WingetIndex(Path(args.winget_index)) as winget_index:
+                details = get_package_details(args.winget_id, winget_index=winget_index, version=args.version)
+        else:
+            with WingetShowCache(refresh=args.refresh) as show_cache:
+                details = get_package_details(args.winget_id, show_cache=show_cache)
+    except (RuntimeError, ValueError) as e:
+        print(e)
+        raise SystemExit(1)
+    print(details, end="" if details.endswith("\n") else "\n")
+
+
+def _renderer():
+    """Return a render(template, replacements) function that renders each template once per distinct set
+    of values it uses, so that files shared by several variants are rendered once."""
+    cache = {}
+
+    def render(template, replacements):
+        placeholders = get_template(template).placeholders
+        key = (template, tuple((guid, value) for guid, value in replacements if guid in placeholders))
+        text = cache.get(key)
+        if text is None:
+            text = cache[key] = render_nary_file(template, key[1])
+        return text
+
+    return render
+
+
+def _variant_folders(slug, variants):
+    """Return (variant, package folder) for every variant of an application, the folder relative to the output directory.
+
+    Without variants, the default variant is generated in the output directory itself. Otherwise
+    every variant is generated in its own tree, named after the variant.
+    """
+    if variants is None:
+        return [(DEFAULT_VARIANT, slug)]
+    if not variants:
+        raise ValueError(f"{slug} is not built in any of the requested variants.")
+    return [(variant, f"{variant.name}/{slug}") for variant in variants]
+
+
+def _outdated_variants(folders, config, template_paths, output_parent_directory, manifest, force):
+    """Return (variant, package folder, digest) for every one of folders that needs building.
+
+    Packages are recorded in the manifest under their folder.
     """
+    packager_version = get_packager_version()
+    outdated = []
+    for variant, folder in folders:
+        digest = hash_build_inputs(dict(config, **variant.config()), template_paths, packager_version)
+        if force or not manifest.is_current(folder, digest) or not (output_parent_directory / folder / "install.intunewin").exists():
+            outdated.append((variant, folder, digest))
+    return outdated
+
+
+def _render_packages(folders, variant_files, metadata, details=None) -> list:
+    """Render the variants of an application in a single pass.
+
+    Package details are fetched once by the caller, however many variants there are.
+
+    Args:
+        folders (List[Tuple[Variant, str]]): as returned by _variant_folders
+        variant_files (Callable[[Variant], Dict[str, str]]): file name -> contents of a variant's package folder
+        metadata (dict): metadata shared by the packages
+        details (str or None): contents of package_details.yaml, as returned by render_package_details
+
+    Returns:
+        List[Package]
+    """
+    packages = []
+    for variant, folder in folders:
+        files = {} if details is None else {"package_details.yaml": details}
+        files.update(variant_files(variant))
+        packages.append(Package(
+            folder,
+            files,
+            metadata=dict(metadata, variant=variant.name),
+            encodings={"package_details.yaml": "utf-8"},
+        ))
+    return packages
+
+
+def _write_packages(sink, packages, digests, manifest) -> bool:
+    """Write and package the rendered variants of an application to a DirectorySink.
+
+    Variants whose files are identical (e.g. variants that differ only by tenant) are packaged
+    once and the package copied to the others.
+
+    Args:
+        sink (DirectorySink)
+        packages (List[Package])
+        digests (List[str]): build input digest of every package
+        manifest (BuildManifest): records the packages that were packaged
+
+    Returns:
+        bool: True if every package was packaged
+    """
+    packaged_sources = {}
+    all_packaged = True
+    for package, digest in zip(packages, digests):
+        sink.write_files(package)
+        contents = tuple(package.files.items())
+        source = packaged_sources.get(contents)
+        if source is not None:
+            packaged = sink.copy_intunewin(source, package)
+        else:
+            packaged = sink.write_intunewin(package)
+            if packaged:
+                packaged_sources[contents] = package
+        if packaged:
+            manifest.record(package.name, digest)
+        all_packaged = all_packaged and packaged
+    return all_packaged
+
+
+def _installer_spec(winget_id, registry_key=None, file_path=None, display_name=None, version=None, include_show_output=False, fast_detection=False, registry_view="both", include_current_user=False, match_version=False):
+    """Return (config, template paths, variant_files) for an installer, see generate_installer."""
     required_mutually_exclusive_args = [registry_key, file_path, display_name]
     supplied_mutually_exclusive_args = [a for a in required_mutually_exclusive_args if a is not None]
     if len(supplied_mutually_exclusive_args) != 1:
         raise ValueError("Must supply exactly one of a registry_key, a registry key's DisplayName value or a file_path as evidence of successful installation.")
 
-    
-    WINGET_ID_TO_REPLACE = "a369b91c-188f-4adc-899b-3a47d38c3ce7"
-    PATH_TO_REPLACE = "5e56c978-80c2-4369-aafb-037cab7dda93"
-    VERSION_TO_REPLACE = "de6a4f36-0b0c-46de-b491-36960cbcee2d"
-    REGISTRY_DISPLAY_NAME_TO_REPLACE = "188e7e89-6fe4-44f0-8302-08972f8a6a34"
 
-    slug = slugify(winget_id)
-    version_string = f"--version '{version}'" if version else ""
+    # Double quotes, as render_nary_file doubles single quotes for single-quoted PowerShell strings
+    version_string = f'--version "{version}"' if version else ""
 
-    script_dir = Path(__file__).parent
-    templates_dir = script_dir / "_installer_template"
+    templates_dir = INSTALLER_TEMPLATES_DIR
 
     # Template file paths
     readme_template = templates_dir / "README.template"
@@ -128,85 +399,275 @@ def generate_installer(winget_id, registry_key=None, file_path=None, display_nam
 
     detection_template = templates_dir / "detect.template"
     known_display_name_detection_template = templates_dir / "known_display_name_detect.template"
+    fast_display_name_detection_template = templates_dir / "fast_display_name_detect.template"
     known_key_detection_template = templates_dir / "known_key_detect.template"
 
     uninstallation_template = templates_dir / "uninstall.template"
     known_display_name_uninstallation_template = templates_dir / "known_display_name_uninstall.template"
+    fast_display_name_uninstallation_template = templates_dir / "fast_display_name_uninstall.template"
     known_key_uninstallation_template = templates_dir / "known_key_uninstall.template"
 
-    # Output file paths
-    Path.mkdir(output_parent_directory, exist_ok=True)
-    output_directory = output_parent_directory / slug
-    Path.mkdir(output_directory, exist_ok=True)
+    if registry_key:
+        detection_template, uninstallation_template = known_key_detection_template, known_key_uninstallation_template
+    elif display_name and fast_detection:
+        detection_template, uninstallation_template = fast_display_name_detection_template, fast_display_name_uninstallation_template
+    elif display_name:
+        detection_template, uninstallation_template = known_display_name_detection_template, known_display_name_uninstallation_template
+
+    config = {
+        "winget_id": winget_id,
+        "registry_key": registry_key,
+        "file_path": file_path,
+        "display_name": display_name,
+        "version": version,
+        "include_show_output": include_show_output,
+    }
+    if display_name and fast_detection:
+        config.update(registry_view=registry_view, include_current_user=include_current_user, match_version=match_version)
+
+    render = _renderer()
+
+    def variant_files(variant):
+        files = {
+            # Always copy the README and the installation file
+            "README.md": render(readme_template, [(WINGET_ID_TO_REPLACE, winget_id)]),
+            "install.ps1": render(
+                installation_template,
+                [(VERSION_TO_REPLACE, version_string), (WINGET_ID_TO_REPLACE, winget_id), (INSTALL_OPTIONS_TO_REPLACE, variant.install_options())],
+            ),
+        }
+        # We prefer args.key to args.displayname to args.file (and exit if other than one is supplied)
+        if registry_key:
+            detection_replacements = uninstallation_replacements = [(PATH_TO_REPLACE, registry_key)]
+        elif display_name and fast_detection:
+            detection_replacements = uninstallation_replacements = [
+                (REGISTRY_DISPLAY_NAME_TO_REPLACE, display_name),
+                (REGISTRY_LOCATIONS_TO_REPLACE, registry_locations(registry_view, include_current_user or variant.scope == "user")),
+                (DISPLAY_VERSION_TO_REPLACE, version if match_version and version else ""),
+            ]
+        elif display_name:
+            detection_replacements = uninstallation_replacements = [(REGISTRY_DISPLAY_NAME_TO_REPLACE, display_name)]
+        else:
+            # Detect based on file evidence
+            detection_replacements = [(WINGET_ID_TO_REPLACE, file_path)]
+            uninstallation_replacements = [(WINGET_ID_TO_REPLACE, winget_id)]
+        files["detect.ps1"] = render(detection_template, detection_replacements)
+        files["uninstall.ps1"] = render(uninstallation_template, uninstallation_replacements)
+        return files
+
+    return config, [readme_template, installation_template, detection_template, uninstallation_template], variant_files
+
+
+def render_installer(winget_id, registry_key=None, file_path=None, display_name=None, version=None, include_show_output=False, show_cache=None, winget_index=None, fast_detection=False, registry_view="both", include_current_user=False, match_version=False, variants=None):
+    """Render the installer package of an application in memory, without writing anything.
+
+    Arguments are as for generate_installer, which writes the same packages to disk.
+
+    Returns:
+        List[Package]: one package per variant, or the single package of the default variant without variants
+    """
+    config, _, variant_files = _installer_spec(winget_id, registry_key, file_path, display_name, version, include_show_output, fast_detection, registry_view, include_current_user, match_version)
+    return _render_packages(
+        _variant_folders(slugify(winget_id), variants),
+        variant_files,
+        {"winget_id": winget_id, "version": version},
+        render_package_details([(winget_id, version)], show_cache, winget_index) if include_show_output else None,
+    )
+
+
+@instrumentation.instrumented_application
+def generate_installer(winget_id, registry_key=None, file_path=None, display_name=None, version=None, output_parent_directory = Path.cwd(), include_show_output=False, manifest=None, force=False, show_cache=None, winget_index=None, fast_detection=False, registry_view="both", include_current_user=False, match_version=False, variants=None):
+    """Given a winget_id value, a registry key or a file path as evidence of successful installation,
+    and optionally a version string, generates a folder containing an install script,
+    a detection script, an uninstall script and a README.md file.
+
+    If IntuneWinAppUtil.exe exists on the PATH, it will also generate an intunewin file.
+
+    Applications whose config, templates, packager and (with include_show_output) package
+    details are unchanged since their last successful build (as recorded in the output
+    folder's build manifest) are skipped unless force is True. Pass a shared BuildManifest as manifest when building several
+    applications; it is then up to the caller to save it.
+
+    If a WingetShowCache is passed as show_cache, winget show output is taken from it
+    rather than by running winget for every call. If a WingetIndex is passed as winget_index,
+    package_details.yaml is written from the index, for the pinned version if there is one,
+    and winget isn't run at all.
 
-    readme_output_file_path = output_directory / "README.md"
-    install_output_file_path = output_directory / "install.ps1"
-    uninstall_output_file_path = output_directory / "uninstall.ps1"
-    detect_output_file_path = output_directory / "detect.ps1"
+    With fast_detection, applications detected by display_name get detection and uninstall
+    scripts that read only the DisplayName value of each Uninstall key and stop at the first
+    match. registry_view ("both", "64" or "32") and include_current_user choose the keys
+    searched, and match_version also requires DisplayVersion to equal version.
 
-    # Run winget show, massage output and save as package_details.yaml if run with --show.
+    With a list of Variants as variants, the application is generated once per variant, in
+    output_parent_directory / variant.name, from a single render pass. User scope variants
+    also search the HKCU Uninstall keys with fast_detection.
+
+    The packages are rendered as by render_installer and written with a DirectorySink.
+
+    Returns:
+        bool: True if the intunewin file was generated
+    """
+    config, template_paths, variant_files = _installer_spec(winget_id, registry_key, file_path, display_name, version, include_show_output, fast_detection, registry_view, include_current_user, match_version)
+
+    # Run winget show and massage its output for package_details.yaml if run with --show.
+    # It changes when a new version is published upstream, so it is a build input too.
+    details = None
     if include_show_output:
-        try:
-            winget_show_output_file_path = output_directory / "package_details.yaml"
+        details = render_package_details([(winget_id, version)], show_cache, winget_index)
+        config["package_details"] = details
+
+    # Skip the build if nothing has changed since the last successful one
+    owns_manifest = manifest is None
+    if owns_manifest:
+        manifest = BuildManifest(output_parent_directory)
+    outdated = _outdated_variants(_variant_folders(slugify(winget_id), variants), config, template_paths, output_parent_directory, manifest, force)
+    if not outdated:
+        instrumentation.mark_skipped()
+        return True
+
+    packages = _render_packages(
+        [(variant, folder) for variant, folder, _ in outdated],
+        variant_files,
+        {"winget_id": winget_id, "version": version},
+        details,
+    )
+    packaged = _write_packages(DirectorySink(output_parent_directory), packages, [digest for _, _, digest in outdated], manifest)
+    if owns_manifest:
+        manifest.save()
+    return packaged
 
-            # Need to convert to LF for correct handling by Python
-            winget_show_output = get_winget_show_output(winget_id).replace('\r\n', '\n')
 
-            winget_show_output = winget_show_output[winget_show_output.find('Found'):].replace('Found ', 'Found: ')
-            with winget_show_output_file_path.open('w', encoding='utf-8') as f:
-                f.write(winget_show_output)
-        except UnicodeEncodeError as e:
-            print(f"Encounted a decoding error when parsing winget show output for {winget_id}. Skipping...")
-            print(e)
+# Columns of the member data the bundle templates parse, one tab-separated line per member
+BUNDLE_MEMBER_FIELDS = ["winget_id", "version", "registry_key", "file_path", "display_name", "display_version"]
+
+
+def bundle_member_data(members, match_version=False) -> str:
+    """Return the member data substituted into the bundle templates.
+
+    Args:
+        members (List[dict]): application config entries, in installation order
+        match_version (bool): also require display_name members to be installed at their pinned version
 
-    # Always copy the README
-    copy_nary_file(
-        readme_template, readme_output_file_path, [(WINGET_ID_TO_REPLACE, winget_id)])
+    Returns:
+        str: one line per member with the fields of BUNDLE_MEMBER_FIELDS separated by tabs
+    """
+    lines = []
+    for member in members:
+        detections = [member.get(a) for a in ["registry_key", "file_path", "display_name"] if member.get(a) is not None]
+        if len(detections) != 1:
+            raise ValueError(f"Bundle member {member.get('winget_id')} must supply exactly one of a registry_key, a display_name or a file_path.")
+        values = dict(member, display_version=member.get("version") if match_version and member.get("display_name") else None)
+        fields = [str(values.get(field) or "") for field in BUNDLE_MEMBER_FIELDS]
+        if any("\t" in field or "\n" in field or "\r" in field for field in fields):
+            raise ValueError(f"Bundle member {member.get('winget_id')} contains a tab or line break.")
+        lines.append("\t".join(fields))
+    return "\n".join(lines)
+
+
+def _bundle_spec(bundle, members, include_show_output=False, registry_view="both", include_current_user=False, match_version=False):
+    """Return (config, template paths, variant_files) for a bundle, see generate_bundle_installer."""
+    if not members:
+        raise ValueError(f"Bundle {bundle} has no members.")
+
+    member_data = bundle_member_data(members, match_version)
+
+    templates_dir = INSTALLER_TEMPLATES_DIR
+    readme_template = templates_dir / "bundle_README.template"
+    installation_template = templates_dir / "bundle_install.template"
+    detection_template = templates_dir / "bundle_detect.template"
+    uninstallation_template = templates_dir / "bundle_uninstall.template"
+
+    config = {
+        "bundle": bundle,
+        "members": member_data,
+        "include_show_output": include_show_output,
+        "registry_locations": registry_locations(registry_view, include_current_user),
+    }
+
+    render = _renderer()
+
+    def variant_files(variant):
+        files = {
+            "README.md": render(
+                readme_template,
+                [(BUNDLE_NAME_TO_REPLACE, bundle), (BUNDLE_WINGET_IDS_TO_REPLACE, "\n".join(f"* {member['winget_id']}" for member in members))],
+            ),
+        }
+        for template, output_file_name in [(installation_template, "install.ps1"), (detection_template, "detect.ps1"), (uninstallation_template, "uninstall.ps1")]:
+            files[output_file_name] = render(
+                template,
+                [
+                    (BUNDLE_NAME_TO_REPLACE, bundle),
+                    (BUNDLE_MEMBERS_TO_REPLACE, member_data),
+                    (REGISTRY_LOCATIONS_TO_REPLACE, registry_locations(registry_view, include_current_user or variant.scope == "user")),
+                    (INSTALL_OPTIONS_TO_REPLACE, variant.install_options()),
+                ],
+            )
+        return files
+
+    return config, [readme_template, installation_template, detection_template, uninstallation_template], variant_files
+
+
+def render_bundle_installer(bundle, members, include_show_output=False, show_cache=None, winget_index=None, registry_view="both", include_current_user=False, match_version=False, variants=None):
+    """Render the package of a bundle in memory, without writing anything.
+
+    Arguments are as for generate_bundle_installer, which writes the same packages to disk.
 
-    # Always copy the installation file
-    copy_nary_file(
-        installation_template,
-        install_output_file_path,
-        [(VERSION_TO_REPLACE, version_string), (WINGET_ID_TO_REPLACE, winget_id)],
+    Returns:
+        List[Package]: one package per variant, or the single package of the default variant without variants
+    """
+    _, _, variant_files = _bundle_spec(bundle, members, include_show_output, registry_view, include_current_user, match_version)
+    return _render_packages(
+        _variant_folders(slugify(bundle), variants),
+        variant_files,
+        {"bundle": bundle, "winget_ids": [member["winget_id"] for member in members]},
+        render_package_details([(member["winget_id"], member.get("version")) for member in members], show_cache, winget_index) if include_show_output else None,
     )
 
-    # We prefer args.key to args.displayname to args.file (and exit if other than one is supplied)
 
-    if registry_key:
-        # Copy known_detection_template and known_uninstall template
-        copy_nary_file(
-            known_key_detection_template,
-            detect_output_file_path,
-            [(PATH_TO_REPLACE, registry_key)],
-        )
-        copy_nary_file(
-            known_key_uninstallation_template,
-            uninstall_output_file_path,
-            [(PATH_TO_REPLACE, registry_key)],
-        )
-    elif display_name:
-        copy_nary_file(
-            known_display_name_detection_template,
-            detect_output_file_path,
-            [(REGISTRY_DISPLAY_NAME_TO_REPLACE, display_name)],
-        )
-        copy_nary_file(
-            known_display_name_uninstallation_template,
-            uninstall_output_file_path,
-            [(REGISTRY_DISPLAY_NAME_TO_REPLACE, display_name)],
-        )
-    else:
-        # Detect based on file evidence
-        copy_nary_file(
-            detection_template,
-            detect_output_file_path,
-            [(WINGET_ID_TO_REPLACE, file_path)],
-        )
-        # File doesn't require any template replacements
-        copy_nary_file(uninstallation_template, uninstall_output_file_path)
+@instrumentation.instrumented_application
+def generate_bundle_installer(bundle, members, output_parent_directory=Path.cwd(), include_show_output=False, manifest=None, force=False, show_cache=None, winget_index=None, registry_view="both", include_current_user=False, match_version=False, variants=None):
+    """Generate a single package installing several applications, in the given order.
 
-    create_intunewin_file(winget_id, "install.ps1", cwd=output_parent_directory)
+    The install script resolves winget once, installs every member with its own log entry and
+    exit code and restarts Explorer once at the end. It exits with the first non-zero winget exit
+    code, if any. The detection script checks every member in a single pass over the registry
+    and detects the bundle only if all of them are installed.
 
+    Members are application config entries as in the bulk generator's input file. Skipping
+    unchanged bundles, show_cache, winget_index, registry_view, include_current_user, match_version
+    and variants work as for generate_installer.
+
+    Returns:
+        bool: True if the intunewin file was generated
+    """
+    config, template_paths, variant_files = _bundle_spec(bundle, members, include_show_output, registry_view, include_current_user, match_version)
+
+    # The members' package details are a build input, as for generate_installer
+    details = None
+    if include_show_output:
+        details = render_package_details([(member["winget_id"], member.get("version")) for member in members], show_cache, winget_index)
+        config["package_details"] = details
+
+    # Skip the build if nothing has changed since the last successful one
+    owns_manifest = manifest is None
+    if owns_manifest:
+        manifest = BuildManifest(output_parent_directory)
+    outdated = _outdated_variants(_variant_folders(slugify(bundle), variants), config, template_paths, output_parent_directory, manifest, force)
+    if not outdated:
+        instrumentation.mark_skipped()
+        return True
+
+    packages = _render_packages(
+        [(variant, folder) for variant, folder, _ in outdated],
+        variant_files,
+        {"bundle": bundle, "winget_ids": [member["winget_id"] for member in members]},
+        details,
+    )
+    packaged = _write_packages(DirectorySink(output_parent_directory), packages, [digest for _, _, digest in outdated], manifest)
+    if owns_manifest:
+        manifest.save()
+    return packaged
 
 if __name__ == "__main__":
     main()
@@ -10,6 +10,8 @@ Optional argument(s):
     -k, --key   If supplied, the generated powershell scripts will target this
                 registry key directly, rather than looping through all until
                 a match on the DisplayName property is found
+    -o, --outfolder
+                Folder to create the package folder in. Defaults to the current directory
 
 And creates a folder containin the following files:
     \path\to\current\directory\{name}
@@ -26,15 +28,19 @@ package in the same directory e.g.
 
 from pathlib import Path
 from argparse import ArgumentParser, Namespace
-from intunify import slugify, copy_file, copy_known_file, create_intunewin_file
+from intunify import slugify, render_file, render_known_file, render_nary_file, get_packager_version, set_packager_backend, registry_locations, PACKAGER_BACKENDS, REGISTRY_VIEWS
+from build_manifest import BuildManifest, hash_build_inputs
+from packages import DirectorySink, Package
+import instrumentation
+from templating import UNINSTALLER_TEMPLATES_DIR, DISPLAY_NAME_TO_REPLACE, PATH_TO_REPLACE, REGISTRY_LOCATIONS_TO_REPLACE, DISPLAY_VERSION_TO_REPLACE
 
 
 
 
 
 
-def get_args() -> Namespace:
-    """Return the arguments parsed in from the command line
+def get_args(argv=None) -> Namespace:
+    """Return the arguments parsed in from the command line, or from argv if given
 
     Returns:
         Namespace: args
@@ -42,7 +48,16 @@ def get_args() -> Namespace:
     parser = ArgumentParser()
     parser.add_argument('name', type=str, help="The value of the 'Display Name' registry key for the application to uninstall. Also used to name folder.")
     parser.add_argument('-k', '--key', type=str, help=r'Registry key path of application to uninstall (if known). e.g. "HKEY_LOCAL_MACHINE\SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall\{806133d5-0a8a-48d2-a337-3a97013d4f27}"')
-    args = parser.parse_args()
+    parser.add_argument('-o', '--outfolder', type=str, default=None, help="Folder to create the package folder in. Defaults to the current directory.")
+    parser.add_argument('--fast', action="store_true", default=False, help="Generate detection and uninstall scripts that read only the DisplayName value of each Uninstall key and stop at the first match.")
+    parser.add_argument('--registry-view', choices=REGISTRY_VIEWS, default="both", help="With --fast, which bitness of the HKLM Uninstall keys to search. Defaults to both.")
+    parser.add_argument('--current-user', action="store_true", default=False, help="With --fast, also search the HKCU Uninstall keys.")
+    parser.add_argument('--display-version', type=str, default=None, help="With --fast, only match installations whose DisplayVersion equals this value.")
+    parser.add_argument('--packager', choices=PACKAGER_BACKENDS, default=None, help="How to build the intunewin file: in-process (native), with IntuneWinAppUtil.exe (external) or native if available (auto). Defaults to auto.")
+    parser.add_argument('--force', action="store_true", default=False, help="Rebuild the package even if its inputs are unchanged since the last build.")
+    args = parser.parse_args(argv)
+    if args.fast and args.key:
+        parser.error("--fast can't be combined with --key.")
     return args
 
 
@@ -51,43 +66,120 @@ def get_args() -> Namespace:
 
 
 
-def main() -> None:
-    """Given a Display Name registry key value, generates a folder containing an uninstall script,
-    a detection script and a README.md file. If IntuneWinAppUtil.exe exists on the PATH, it will
-    also generate an intunewin file.
+def main(argv=None) -> None:
     """
-    DISPLAY_NAME_TO_REPLACE = "a369b91c-188f-4adc-899b-3a47d38c3ce7"
-    PATH_TO_REPLACE = "5e56c978-80c2-4369-aafb-037cab7dda93"
-    
-    args = get_args()
-    display_name = args.name
-    slug = slugify(display_name)
-
-    script_dir = Path(__file__).parent
-    templates_dir = script_dir / "_uninstaller_template"
+    Generate an uninstaller package from the command line. Run create_uninstaller.py -h for usage.
+    """
+    args = get_args(argv)
+    if args.packager:
+        set_packager_backend(args.packager)
+    generate_uninstaller(
+        name=args.name,
+        key=args.key,
+        output_parent_directory=Path(args.outfolder).absolute() if args.outfolder else Path.cwd(),
+        force=args.force,
+        fast=args.fast,
+        registry_view=args.registry_view,
+        include_current_user=args.current_user,
+        display_version=args.display_version,
+    )
+
+
+def _uninstaller_spec(name, key=None, fast=False, registry_view="both", include_current_user=False, display_version=None):
+    """Return (config, template paths, files) for an uninstaller, see generate_uninstaller."""
+    if key is not None and not key.startswith("HKEY_LOCAL_MACHINE"):
+        raise ValueError("key must start with HKEY_LOCAL_MACHINE")
+    if key is not None and fast:
+        raise ValueError("fast can't be combined with key")
+
+    templates_dir = UNINSTALLER_TEMPLATES_DIR
     detection_template = templates_dir / "detect.template"
     known_key_detection_template = templates_dir / "known_key_detect.template"
+    fast_detection_template = templates_dir / "fast_detect.template"
     uninstallation_template = templates_dir / "uninstall.template"
+    fast_uninstallation_template = templates_dir / "fast_uninstall.template"
     known_key_uninstallation_template = templates_dir / "known_key_uninstall.template"
     readme_template = templates_dir / "README.template"
 
-    output_directory = Path.cwd() / slug
-    Path.mkdir(output_directory, exist_ok=True)
+    if key:
+        detection_template, uninstallation_template = known_key_detection_template, known_key_uninstallation_template
+    elif fast:
+        detection_template, uninstallation_template = fast_detection_template, fast_uninstallation_template
+
+    config = {"type": "uninstaller", "name": name, "key": key}
+    if fast:
+        config.update(registry_view=registry_view, include_current_user=include_current_user, display_version=display_version)
+
+    files = {"README.md": render_file(readme_template, DISPLAY_NAME_TO_REPLACE, name)}
+    if key:
+        files["detect.ps1"] = render_known_file(detection_template, DISPLAY_NAME_TO_REPLACE, name, PATH_TO_REPLACE, key)
+        files["uninstall.ps1"] = render_known_file(uninstallation_template, DISPLAY_NAME_TO_REPLACE, name, PATH_TO_REPLACE, key)
+    elif fast:
+        replacements = [
+            (DISPLAY_NAME_TO_REPLACE, name),
+            (REGISTRY_LOCATIONS_TO_REPLACE, registry_locations(registry_view, include_current_user)),
+            (DISPLAY_VERSION_TO_REPLACE, display_version or ""),
+        ]
+        files["detect.ps1"] = render_nary_file(detection_template, replacements)
+        files["uninstall.ps1"] = render_nary_file(uninstallation_template, replacements)
+    else:
+        files["detect.ps1"] = render_file(detection_template, DISPLAY_NAME_TO_REPLACE, name)
+        files["uninstall.ps1"] = render_file(uninstallation_template, DISPLAY_NAME_TO_REPLACE, name)
+
+    return config, [readme_template, detection_template, uninstallation_template], files
 
-    readme = output_directory / "README.md"
-    uninstall = output_directory / "uninstall.ps1"
-    detect = output_directory / "detect.ps1"
 
-    copy_file(readme_template, readme, DISPLAY_NAME_TO_REPLACE, display_name)
-    if args.key:
-        copy_known_file(known_key_detection_template, detect, DISPLAY_NAME_TO_REPLACE, display_name, PATH_TO_REPLACE, args.key)
-        copy_known_file(known_key_uninstallation_template, uninstall, DISPLAY_NAME_TO_REPLACE, display_name, PATH_TO_REPLACE, args.key)
-    else:
-        copy_file(detection_template, detect, DISPLAY_NAME_TO_REPLACE, display_name)
-        copy_file(uninstallation_template, uninstall, DISPLAY_NAME_TO_REPLACE, display_name)
+def render_uninstaller(name, key=None, fast=False, registry_view="both", include_current_user=False, display_version=None) -> Package:
+    """Render an uninstaller package in memory, without writing anything.
+
+    Arguments are as for generate_uninstaller, which writes the same package to disk.
+
+    Returns:
+        Package
+    """
+    _, _, files = _uninstaller_spec(name, key, fast, registry_view, include_current_user, display_version)
+    return Package(slugify(name), files, setup_file="uninstall.ps1", metadata={"name": name, "key": key})
+
+
+@instrumentation.instrumented_application
+def generate_uninstaller(name, key=None, output_parent_directory=Path.cwd(), manifest=None, force=False, fast=False, registry_view="both", include_current_user=False, display_version=None):
+    """Given a Display Name registry key value, generates a folder containing an uninstall script,
+    a detection script and a README.md file. If IntuneWinAppUtil.exe exists on the PATH, it will
+    also generate an intunewin file.
+
+    If key is given, the scripts target that registry key directly instead of searching for
+    name. With fast, they read only the DisplayName value of each Uninstall key and stop at the
+    first match; registry_view, include_current_user and display_version work as for
+    generate_installer's fast detection.
+
+    Packages whose inputs are unchanged since their last successful build are skipped unless
+    force is True. Pass a shared BuildManifest as manifest when building several packages; it
+    is then up to the caller to save it.
 
+    The package is rendered as by render_uninstaller and written with a DirectorySink.
 
-    create_intunewin_file(display_name, "uninstall.ps1")
+    Returns:
+        bool: True if the intunewin file was generated
+    """
+    config, template_paths, files = _uninstaller_spec(name, key, fast, registry_view, include_current_user, display_version)
+    slug = slugify(name)
+
+    # Skip the build if nothing has changed since the last successful one
+    owns_manifest = manifest is None
+    if owns_manifest:
+        manifest = BuildManifest(output_parent_directory)
+    digest = hash_build_inputs(config, template_paths, get_packager_version())
+    if not force and manifest.is_current(slug, digest) and (output_parent_directory / slug / "uninstall.intunewin").exists():
+        instrumentation.mark_skipped()
+        return True
+
+    package = Package(slug, files, setup_file="uninstall.ps1", metadata={"name": name, "key": key})
+    packaged = DirectorySink(output_parent_directory).write(package)
+    if packaged:
+        manifest.record(slug, digest)
+        if owns_manifest:
+            manifest.save()
+    return packaged
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,252 @@
+"""instrumentation.py
+
+Records how long each stage of a build takes so that slow runs can be explained.
+
+Stages are timed with the stage() context manager, which records wall time and
+whatever the stage reports (bytes written, subprocess exit code, timeouts) against
+the application being built. Nothing is kept unless a RunReport has been started
+with start_report() or a listener added with add_listener(), so the hooks cost
+next to nothing in normal runs.
+
+Stages recorded:
+    generate_installer  one application, end to end (functions decorated with instrumented_application)
+    render              rendering one template to a file
+    show_output         getting winget show output (cache or winget) and saving package_details.yaml
+    winget_show         a winget.exe process (one record per attempt)
+    package             building an intunewin file (one record per IntuneWinAppUtil.exe attempt)
+"""
+
+
+import contextvars
+import functools
+import inspect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+
+# StageRecord of the application currently being built in this thread
+_current_application = contextvars.ContextVar("intunify_current_application", default=None)
+_report = None
+_listeners = ()
+
+
+class StageRecord:
+    """Timing and outcome of a single stage."""
+
+    __slots__ = ("stage", "app", "detail", "started", "wall_s", "bytes_written", "exit_code", "timed_out", "skipped", "error", "application", "attempt")
+
+    def __init__(self, stage: str, app: str or None, detail: str or None = None):
+        self.stage = stage
+        self.app = app
+        self.detail = detail
+        self.started = time.time()
+        self.wall_s = None
+        self.bytes_written = None
+        self.exit_code = None
+        self.timed_out = False
+        self.skipped = False
+        self.error = None
+        self.application = False
+        # Retries of the stage before this one, e.g. 1 for the second attempt at a subprocess
+        self.attempt = 0
+
+    @property
+    def failed(self) -> bool:
+        """True if the stage raised, timed out or its subprocess exited with an error."""
+        return bool(self.error or self.exit_code or self.timed_out)
+
+    def to_dict(self) -> dict:
+        return {
+            name: getattr(self, name)
+            for name in self.__slots__
+            if name in ("stage", "wall_s") or getattr(self, name) not in (None, False)
+        }
+
+
+class RunReport:
+    """Stage records of a run, safe to share between threads."""
+
+    def __init__(self):
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.records = []
+
+    def add(self, record: StageRecord) -> None:
+        with self._lock:
+            self.records.append(record)
+
+    def to_dict(self, slowest: int = 10) -> dict:
+        """Return the report per application and in aggregate, with the 'slowest' slowest applications."""
+        with self._lock:
+            records = list(self.records)
+
+        applications = {}
+        stages = {}
+        for record in records:
+            aggregate = stages.setdefault(record.stage, {"count": 0, "total_s": 0.0, "max_s": 0.0, "bytes_written": 0, "timeouts": 0, "failures": 0, "retries": 0})
+            aggregate["count"] += 1
+            aggregate["total_s"] += record.wall_s
+            aggregate["max_s"] = max(aggregate["max_s"], record.wall_s)
+            aggregate["bytes_written"] += record.bytes_written or 0
+            aggregate["timeouts"] += record.timed_out
+            aggregate["failures"] += bool(record.error or record.exit_code)
+            aggregate["retries"] += bool(record.attempt)
+
+            app = applications.setdefault(record.app, {"wall_s": 0.0, "bytes_written": 0, "stages": []})
+            if record.application:
+                app["wall_s"] += record.wall_s
+                app["skipped"] = record.skipped
+            app["bytes_written"] += record.bytes_written or 0
+            app["stages"].append(record.to_dict())
+
+        for aggregate in stages.values():
+            aggregate["mean_s"] = aggregate["total_s"] / aggregate["count"]
+
+        ranked = sorted(((name, app) for name, app in applications.items() if name is not None), key=lambda item: item[1]["wall_s"], reverse=True)
+        return {
+            "started": self.started,
+            "wall_s": time.perf_counter() - self._start,
+            "stages": stages,
+            "slowest_applications": [{"app": name, "wall_s": app["wall_s"]} for name, app in ranked[:slowest]],
+            "applications": {str(name): app for name, app in applications.items()},
+        }
+
+    def write(self, path: Path, slowest: int = 10) -> None:
+        """Write the report as JSON to 'path'."""
+        with Path(path).open("w") as f:
+            json.dump(self.to_dict(slowest), f, indent=2)
+
+
+def start_report() -> RunReport:
+    """Start recording stages into a new RunReport and return it."""
+    global _report
+    _report = RunReport()
+    return _report
+
+
+def stop_report() -> RunReport or None:
+    """Stop recording stages and return the report that was being recorded into."""
+    global _report
+    report, _report = _report, None
+    return report
+
+
+def add_listener(listener) -> None:
+    """Call 'listener' with the StageRecord of every stage as it finishes, from the thread that ran it.
+
+    Args:
+        listener (Callable[[StageRecord], None])
+    """
+    global _listeners
+    _listeners = _listeners + (listener,)
+
+
+def remove_listener(listener) -> None:
+    """Stop calling a listener added with add_listener.
+
+    Listeners are compared by equality rather than identity, as every access to a bound method
+    (e.g. journal.stage_finished) returns a new object.
+    """
+    global _listeners
+    _listeners = tuple(other for other in _listeners if other != listener)
+
+
+@contextmanager
+def stage(name: str, detail: str or None = None, app: str or None = None) -> Iterator[StageRecord]:
+    """Time the enclosed block as stage 'name' of the current application.
+
+    The yielded StageRecord can be annotated with bytes_written, exit_code and timed_out.
+    Exceptions are recorded and re-raised.
+
+    Args:
+        name (str): stage name
+        detail (str or None): e.g. the file being rendered
+        app (str or None): application to record against if no application is current
+    """
+    current = _current_application.get()
+    record = StageRecord(name, current.app if current is not None else app, detail)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as exc:
+        record.error = f"{type(exc).__name__}: {exc}"
+        raise
+    finally:
+        record.wall_s = time.perf_counter() - start
+        report = _report
+        if report is not None:
+            report.add(record)
+        for listener in _listeners:
+            listener(record)
+
+
+@contextmanager
+def application(app: str, name: str = "generate_installer") -> Iterator[StageRecord]:
+    """Time the enclosed block as the build of 'app' and record nested stages against it."""
+    with stage(name, app=app) as record:
+        record.application = True
+        token = _current_application.set(record)
+        try:
+            yield record
+        finally:
+            _current_application.reset(token)
+
+
+def instrumented_application(function):
+    """Decorator timing every call of 'function' as the build of the application named by its first argument."""
+    app_parameter = next(iter(inspect.signature(function).parameters))
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        app = args[0] if args else kwargs.get(app_parameter)
+        with application(app, function.__name__):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def mark_skipped() -> None:
+    """Record that the application currently being built was skipped as up to date."""
+    current = _current_application.get()
+    if current is not None:
+        current.skipped = True
+
+
+class Profiler:
+    """cProfile across the calling thread and every thread started while it is running.
+
+    cProfile only profiles the thread it is enabled in, so a separate profile is kept
+    per thread and the results are merged when the profiler is stopped.
+    """
+
+    def __init__(self):
+        self._profiles = []
+        self._lock = threading.Lock()
+
+    def _enable_in_thread(self, *args) -> None:
+        # cProfile and pstats are imported when profiling, as they are slow to import
+        import cProfile
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        profile.enable()
+
+    def start(self) -> None:
+        threading.setprofile(self._enable_in_thread)
+        self._enable_in_thread()
+
+    def stop(self, path: Path) -> None:
+        """Stop profiling and write the merged stats to 'path' (readable with pstats or snakeviz)."""
+        threading.setprofile(None)
+        with self._lock:
+            profiles = list(self._profiles)
+        profiles[0].disable()
+        import pstats
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(str(path))
@@ -0,0 +1,212 @@
+"""intunewin.py
+
+Builds .intunewin packages in-process, without IntuneWinAppUtil.exe.
+
+An .intunewin file is a zip archive containing:
+    IntuneWinPackage/Contents/IntunePackage.intunewin
+        The source folder, zipped and encrypted with AES-256-CBC. It is laid out as
+        HMAC-SHA256 (32 bytes) + IV (16 bytes) + ciphertext, the HMAC covering IV and ciphertext.
+    IntuneWinPackage/Metadata/Detection.xml
+        The setup file name, the unencrypted size and the keys and digests Intune needs to
+        decrypt and verify the content.
+
+Source folders are zipped, hashed and encrypted in fixed-size chunks via temporary
+files, so memory use doesn't grow with the size of the folder. Packages whose files
+are already in memory (see write_intunewin) are built without touching the disk.
+
+Requires the cryptography package.
+"""
+
+
+import base64
+import hashlib
+import hmac
+import io
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from html import escape
+from pathlib import Path
+from typing import BinaryIO, Dict
+
+try:
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:
+    Cipher = None
+
+
+# Bump when the produced package layout changes so incremental builds repackage
+FORMAT_VERSION = "1"
+
+# IntuneWinAppUtil.exe release whose Detection.xml layout is reproduced
+TOOL_VERSION = "1.8.4.0"
+
+CHUNK_SIZE = 1024 * 1024
+
+CONTENT_FILE_NAME = "IntunePackage.intunewin"
+CONTENT_ARCNAME = f"IntuneWinPackage/Contents/{CONTENT_FILE_NAME}"
+DETECTION_ARCNAME = "IntuneWinPackage/Metadata/Detection.xml"
+
+DETECTION_XML_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<ApplicationInfo xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" ToolVersion="{tool_version}">
+  <Name>{name}</Name>
+  <UnencryptedContentSize>{unencrypted_content_size}</UnencryptedContentSize>
+  <FileName>{file_name}</FileName>
+  <SetupFile>{setup_file}</SetupFile>
+  <EncryptionInfo>
+    <EncryptionKey>{encryption_key}</EncryptionKey>
+    <MacKey>{mac_key}</MacKey>
+    <InitializationVector>{initialization_vector}</InitializationVector>
+    <Mac>{mac}</Mac>
+    <ProfileIdentifier>ProfileVersion1</ProfileIdentifier>
+    <FileDigest>{file_digest}</FileDigest>
+    <FileDigestAlgorithm>SHA256</FileDigestAlgorithm>
+  </EncryptionInfo>
+</ApplicationInfo>
+"""
+
+
+def is_available() -> bool:
+    """Return True if the cryptography package needed by the native packager is installed."""
+    return Cipher is not None
+
+
+def _zip_folder(source_folder: Path, out, exclude_suffixes=(".intunewin",)) -> None:
+    """Write a deflated zip of every file under 'source_folder' to the open binary file 'out'."""
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
+        for path in sorted(source_folder.rglob("*")):
+            if path.is_file() and path.suffix.lower() not in exclude_suffixes:
+                zf.write(path, arcname=path.relative_to(source_folder).as_posix())
+
+
+def _zip_files(files: Dict[str, bytes], out, exclude_suffixes=(".intunewin",)) -> None:
+    """Write a deflated zip of the in-memory 'files' (relative POSIX path -> contents) to the open binary file 'out'."""
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name in sorted(files):
+            if Path(name).suffix.lower() not in exclude_suffixes:
+                zf.writestr(name, files[name])
+
+
+def _encrypt(source, out) -> dict:
+    """Encrypt the open binary file 'source' into 'out' and return the encryption info.
+
+    Returns:
+        dict: base64 encoded encryption_key, mac_key, initialization_vector, mac and
+        file_digest (SHA256 of the unencrypted content)
+    """
+    encryption_key = os.urandom(32)
+    mac_key = os.urandom(32)
+    iv = os.urandom(16)
+    encryptor = Cipher(algorithms.AES(encryption_key), modes.CBC(iv)).encryptor()
+    padder = padding.PKCS7(algorithms.AES.block_size).padder()
+    file_digest = hashlib.sha256()
+    mac = hmac.new(mac_key, iv, hashlib.sha256)
+
+    # Reserve room for the HMAC, which is only known once everything is encrypted
+    start = out.tell()
+    out.write(bytes(mac.digest_size))
+    out.write(iv)
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        file_digest.update(chunk)
+        ciphertext = encryptor.update(padder.update(chunk))
+        mac.update(ciphertext)
+        out.write(ciphertext)
+    ciphertext = encryptor.update(padder.finalize()) + encryptor.finalize()
+    mac.update(ciphertext)
+    out.write(ciphertext)
+    end = out.tell()
+    out.seek(start)
+    out.write(mac.digest())
+    out.seek(end)
+
+    return {
+        "encryption_key": base64.b64encode(encryption_key).decode(),
+        "mac_key": base64.b64encode(mac_key).decode(),
+        "initialization_vector": base64.b64encode(iv).decode(),
+        "mac": base64.b64encode(mac.digest()).decode(),
+        "file_digest": base64.b64encode(file_digest.digest()).decode(),
+    }
+
+
+def create_intunewin(source_folder: Path, setup_file: str, output_folder: Path) -> Path:
+    """Package 'source_folder' as an .intunewin file named after 'setup_file'.
+
+    Existing .intunewin files in 'source_folder' are not included in the package.
+
+    Args:
+        source_folder (Path): folder whose contents are packaged
+        setup_file (str): name of the setup file within 'source_folder' e.g. "install.ps1"
+        output_folder (Path): folder to write the .intunewin file to
+
+    Returns:
+        Path: path of the generated .intunewin file
+    """
+    if not is_available():
+        raise RuntimeError("The native .intunewin packager requires the cryptography package.")
+    source_folder = Path(source_folder)
+    output_folder = Path(output_folder)
+    if not (source_folder / setup_file).is_file():
+        raise FileNotFoundError(f"Setup file {setup_file} not found in {source_folder}")
+
+    output_path = output_folder / f"{Path(setup_file).stem}.intunewin"
+    with tempfile.TemporaryFile() as zipped, tempfile.TemporaryFile() as encrypted:
+        _zip_folder(source_folder, zipped)
+        # Write next to the final path and move into place so a failed run never leaves a partial package
+        tmp_output_path = output_path.with_suffix(".intunewin.tmp")
+        try:
+            with tmp_output_path.open("wb") as out:
+                _write_package(zipped, encrypted, setup_file, out)
+            os.replace(tmp_output_path, output_path)
+        finally:
+            if tmp_output_path.exists():
+                tmp_output_path.unlink()
+    return output_path
+
+
+def write_intunewin(files: Dict[str, bytes], setup_file: str, out: BinaryIO) -> None:
+    """Package in-memory files as an .intunewin file written to 'out'.
+
+    The package is built in memory, so this suits the small script packages intunify
+    generates rather than large installers.
+
+    Args:
+        files (Dict[str, bytes]): relative POSIX path -> contents of every packaged file
+        setup_file (str): name of the setup file among 'files' e.g. "install.ps1"
+        out (BinaryIO): open binary file, which needn't be seekable (e.g. an HTTP request body or archive member)
+    """
+    if not is_available():
+        raise RuntimeError("The native .intunewin packager requires the cryptography package.")
+    if setup_file not in files:
+        raise ValueError(f"Setup file {setup_file} is not one of the packaged files")
+    zipped = io.BytesIO()
+    _zip_files(files, zipped)
+    _write_package(zipped, io.BytesIO(), setup_file, out)
+
+
+def _write_package(zipped, encrypted, setup_file: str, out) -> None:
+    """Encrypt the zipped source 'zipped', positioned at its end, via the scratch file 'encrypted'
+    and write the .intunewin package to 'out'."""
+    unencrypted_content_size = zipped.tell()
+    zipped.seek(0)
+    encryption_info = _encrypt(zipped, encrypted)
+    encrypted.seek(0)
+
+    detection_xml = DETECTION_XML_TEMPLATE.format(
+        tool_version=TOOL_VERSION,
+        name=escape(setup_file, quote=False),
+        unencrypted_content_size=unencrypted_content_size,
+        file_name=CONTENT_FILE_NAME,
+        setup_file=escape(setup_file, quote=False),
+        **encryption_info,
+    )
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
+        # The encrypted content doesn't compress, so store it as is
+        with zf.open(zipfile.ZipInfo(CONTENT_ARCNAME, time.localtime()[:6]), "w", force_zip64=True) as f:
+            shutil.copyfileobj(encrypted, f, CHUNK_SIZE)
+        zf.writestr(DETECTION_ARCNAME, detection_xml)
@@ -1,7 +1,196 @@
+import importlib
+import io
+import json
+import os
+import shutil
 import subprocess
+import sys
+import threading
+import time
+import traceback
 from argparse import ArgumentParser
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Tuple
+from typing import Iterable, List, TextIO, Tuple
+
+# templating, content_store, instrumentation and intunewin (which loads the cryptography
+# package) are imported by the helpers that use them, so that commands such as show, lock
+# and index don't pay for them.
+
+
+# winget executable used by get_winget_show_output. Can be pointed at a local stub.
+WINGET_EXECUTABLE = os.environ.get("INTUNIFY_WINGET", "winget.exe")
+
+# How create_intunewin_file builds packages: "native" (in-process, see intunewin.py),
+# "external" (IntuneWinAppUtil.exe) or "auto" (native if available, else external).
+PACKAGER_BACKENDS = ("auto", "native", "external")
+PACKAGER_BACKEND = os.environ.get("INTUNIFY_PACKAGER", "auto")
+
+# Content-addressed store generated files are written to and hardlinked from.
+# Files are written directly unless set_output_store is called.
+_output_store = None
+
+# Caps on concurrently running IntuneWinAppUtil.exe and winget.exe processes.
+# Unbounded unless set_subprocess_limits is called.
+_packager_slots = None
+_winget_slots = None
+
+# Seconds before a hung IntuneWinAppUtil.exe ("packager") or winget.exe ("winget") process is killed
+SUBPROCESS_TIMEOUTS = {"packager": 15.0, "winget": 15.0}
+
+# Transient subprocess failures (timeouts, and IntuneWinAppUtil.exe errors such as locked
+# files) are retried this many times, SUBPROCESS_RETRY_BACKOFF seconds after the first
+# failure and twice as long after each further one, up to MAX_RETRY_BACKOFF seconds.
+SUBPROCESS_RETRIES = 0
+SUBPROCESS_RETRY_BACKOFF = 2.0
+MAX_RETRY_BACKOFF = 60.0
+
+
+class _Slot:
+    """Context manager acquiring 'semaphore' for the duration of a block, if one is set."""
+
+    def __init__(self, semaphore):
+        self.semaphore = semaphore
+
+    def __enter__(self):
+        if self.semaphore is not None:
+            self.semaphore.acquire()
+
+    def __exit__(self, *exc):
+        if self.semaphore is not None:
+            self.semaphore.release()
+
+
+def set_subprocess_limits(packager_jobs: int or None = None, winget_jobs: int or None = None) -> None:
+    """Cap the number of packager and winget subprocesses that may run at once.
+
+    Args:
+        packager_jobs (int or None): maximum concurrent IntuneWinAppUtil.exe processes. None for no limit.
+        winget_jobs (int or None): maximum concurrent winget.exe processes. None for no limit.
+    """
+    global _packager_slots, _winget_slots
+    _packager_slots = threading.BoundedSemaphore(packager_jobs) if packager_jobs else None
+    _winget_slots = threading.BoundedSemaphore(winget_jobs) if winget_jobs else None
+
+
+def set_subprocess_timeouts(packager: float or None = None, winget: float or None = None) -> None:
+    """Set the seconds before a hung subprocess is killed, per tool. None keeps the current timeout.
+
+    Args:
+        packager (float or None): timeout of IntuneWinAppUtil.exe
+        winget (float or None): timeout of winget.exe
+    """
+    for tool, timeout in [("packager", packager), ("winget", winget)]:
+        if timeout is not None:
+            if timeout <= 0:
+                raise ValueError(f"{tool} timeout must be positive. Received: {timeout}")
+            SUBPROCESS_TIMEOUTS[tool] = timeout
+
+
+def set_retry_policy(retries: int, backoff: float = 2.0) -> None:
+    """Retry transient subprocess failures 'retries' times with exponential backoff.
+
+    Args:
+        retries (int): retries after the first attempt. 0 to fail straight away.
+        backoff (float): seconds before the first retry, doubled for every further one
+    """
+    global SUBPROCESS_RETRIES, SUBPROCESS_RETRY_BACKOFF
+    if retries < 0 or backoff < 0:
+        raise ValueError(f"retries and backoff can't be negative. Received: {retries}, {backoff}")
+    SUBPROCESS_RETRIES = retries
+    SUBPROCESS_RETRY_BACKOFF = backoff
+
+
+def _backoff(attempt: int) -> None:
+    # Sleeps before retry number 'attempt' (1 for the first retry), reporting it
+    delay = min(SUBPROCESS_RETRY_BACKOFF * 2 ** (attempt - 1), MAX_RETRY_BACKOFF)
+    print(f"Retrying in {delay:g} seconds (retry {attempt} of {SUBPROCESS_RETRIES}).")
+    time.sleep(delay)
+
+
+def set_packager_backend(backend: str) -> None:
+    """Select the backend create_intunewin_file packages with.
+
+    Args:
+        backend (str): one of PACKAGER_BACKENDS
+    """
+    global PACKAGER_BACKEND
+    if backend not in PACKAGER_BACKENDS:
+        raise ValueError(f"backend must be one of {', '.join(PACKAGER_BACKENDS)}. Received: {backend}")
+    PACKAGER_BACKEND = backend
+    get_packager_version.cache_clear()
+
+
+def set_output_store(path: Path or None) -> None:
+    """Write generated files into a content-addressed store at 'path' and hardlink them into place.
+
+    Args:
+        path (Path or None): store directory. None to write files directly.
+    """
+    from content_store import ContentStore
+    global _output_store
+    _output_store = ContentStore(path) if path else None
+
+
+def write_text_file(path: Path, text: str, encoding: str or None = None) -> int:
+    """Write 'text' to 'path', through the output store if one is set.
+
+    Args:
+        path (Path): file path
+        text (str)
+        encoding (str or None): as for open(). Defaults to the platform's default encoding.
+
+    Returns:
+        int: bytes written to disk. With an output store, 0 if the content was already stored.
+    """
+    store = _output_store
+    if store is not None:
+        return store.write_text(path, text, encoding)
+    _unlink_if_shared(path)
+    with path.open("w", encoding=encoding) as f:
+        f.write(text)
+    return path.stat().st_size
+
+
+def _unlink_if_shared(path: Path) -> None:
+    # A file hardlinked from an output store must not be written through
+    try:
+        if path.stat().st_nlink > 1:
+            path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def use_native_packager() -> bool:
+    """Return True if create_intunewin_file will use the in-process packager."""
+    if PACKAGER_BACKEND == "native":
+        return True
+    import intunewin
+    return PACKAGER_BACKEND == "auto" and intunewin.is_available()
+
+
+# Registry views the fast detection scripts search, see registry_locations
+REGISTRY_VIEWS = {"both": ("Registry64", "Registry32"), "64": ("Registry64",), "32": ("Registry32",)}
+
+
+def registry_locations(registry_view: str = "both", include_current_user: bool = False) -> str:
+    """Return the comma-separated Hive:View list the fast detection and uninstall scripts search.
+
+    Args:
+        registry_view (str): "both", "64" or "32". Which bitness of HKLM to search.
+        include_current_user (bool): also search HKCU
+
+    Returns:
+        str: e.g. "LocalMachine:Registry64,LocalMachine:Registry32"
+    """
+    if registry_view not in REGISTRY_VIEWS:
+        raise ValueError(f"registry_view must be one of {', '.join(REGISTRY_VIEWS)}. Received: {registry_view}")
+    locations = [f"LocalMachine:{view}" for view in REGISTRY_VIEWS[registry_view]]
+    if include_current_user:
+        # HKCU\Software is not redirected for 32-bit processes, so one view covers it
+        locations.append("CurrentUser:Default")
+    return ",".join(locations)
 
 
 def slugify(string: str) -> str:
@@ -24,9 +213,7 @@ def copy_file(inf: Path, outf: Path, string_to_be_replaced: str, name: str) -> N
         replacement_string (str): GUID found in 'inf' to be replaced in 'outf' with 'name'
         name (str): user input string that should correspond to the DisplayName registry value
     """
-    with open(inf, "r") as f, outf.open("w") as g:
-        text = f.read().replace(string_to_be_replaced, name)
-        g.write(text)
+    _render_file(inf, outf, {string_to_be_replaced: name})
     
 
 def copy_known_file(inf: Path, outf: Path, guid: str, guid_replacement: str, path_to_replace: str, replacement_path: str) -> None:
@@ -41,12 +228,52 @@ def copy_known_file(inf: Path, outf: Path, guid: str, guid_replacement: str, pat
         replacement_path (str): path of the registry key, should take the format
         "HKEY_LOCAL_MACHINE\SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall\{F307E329-805A-4C79-BAEC-7FB35F3FE64B}"
     """
-    with open(inf, "r") as f, outf.open("w") as g:
-        if not replacement_path.startswith("HKEY_LOCAL_MACHINE"):
-            raise ValueError(f"replacement_path must start with HKEY_LOCAL_MACHINE")
-        replacement_path = replacement_path.replace("HKEY_LOCAL_MACHINE", "HKLM:")
-        text = f.read().replace(guid, guid_replacement).replace(path_to_replace, replacement_path)
-        g.write(text)
+    _render_file(inf, outf, _known_file_values(guid, guid_replacement, path_to_replace, replacement_path))
+
+
+def _known_file_values(guid: str, guid_replacement: str, path_to_replace: str, replacement_path: str) -> dict:
+    if not replacement_path.startswith("HKEY_LOCAL_MACHINE"):
+        raise ValueError(f"replacement_path must start with HKEY_LOCAL_MACHINE")
+    replacement_path = replacement_path.replace("HKEY_LOCAL_MACHINE", "HKLM:")
+    return {guid: guid_replacement, path_to_replace: replacement_path}
+
+
+def render_file(inf: Path, string_to_be_replaced: str, name: str) -> str:
+    """Return the contents copy_file would write to a file.
+
+    Args:
+        inf (Path): template file path
+        string_to_be_replaced (str): GUID found in 'inf' to be replaced with 'name'
+        name (str)
+
+    Returns:
+        str
+    """
+    from templating import get_template
+    return get_template(inf).render({string_to_be_replaced: name})
+
+
+def render_known_file(inf: Path, guid: str, guid_replacement: str, path_to_replace: str, replacement_path: str) -> str:
+    """Return the contents copy_known_file would write to a file.
+
+    Returns:
+        str
+    """
+    from templating import get_template
+    return get_template(inf).render(_known_file_values(guid, guid_replacement, path_to_replace, replacement_path))
+
+
+def escape_replacement(replacement: str) -> str:
+    r"""Return 'replacement' with HKEY_LOCAL_MACHINE shortened to the HKLM: drive and single quotes doubled.
+
+    Args:
+        replacement (str)
+
+    Returns:
+        str
+    """
+    return replacement.replace(r"Computer\"HKEY_LOCAL_MACHINE", "HKEY_LOCAL_MACHINE").replace("HKEY_LOCAL_MACHINE", "HKLM:").replace("'", "''")
+
 
 def copy_nary_file(inf: Path, outf: Path, replacements: List[Tuple[str, str]] or None = None, affixment=None) -> None:
     r"""Copies the contents of 'inf' to 'outf' replacing 'replacement_string' with 'name'
@@ -56,82 +283,197 @@ def copy_nary_file(inf: Path, outf: Path, replacements: List[Tuple[str, str]] or
         outf (Path): out file path
         replacements: List[Tuple[str, str]] or None (to_replace, replacer)
     """
-    with open(inf, "r") as f, outf.open("w") as g:
-        text = f.read()
-        if replacements:
-            for guid, replacement in replacements:
-                replacement = replacement.replace(r"Computer\"HKEY_LOCAL_MACHINE", "HKEY_LOCAL_MACHINE").replace("HKEY_LOCAL_MACHINE", "HKLM:").replace("'", "''")
-                text = text.replace(guid, replacement)
-        if affixment:
-            text += affixment
-        g.write(text)
+    values = {guid: escape_replacement(replacement) for guid, replacement in replacements or []}
+    _render_file(inf, outf, values, affixment)
+
+
+def render_nary_file(inf: Path, replacements: List[Tuple[str, str]] or None = None) -> str:
+    """Return the contents copy_nary_file would write to a file, with the same escaping of the replacements.
+
+    Args:
+        inf (Path): template file path
+        replacements: List[Tuple[str, str]] or None (to_replace, replacer)
+
+    Returns:
+        str
+    """
+    from templating import get_template
+    values = {guid: escape_replacement(replacement) for guid, replacement in replacements or []}
+    return get_template(inf).render(values)
+
+
+def _render_file(inf: Path, outf: Path, values: dict, affixment: str or None = None) -> None:
+    import instrumentation
+    from templating import get_template
+    template = get_template(inf)
+    with instrumentation.stage("render", outf.name) as record:
+        store = _output_store
+        if store is not None:
+            record.bytes_written = store.write_text(outf, template.render(values) + (affixment or ""))
+            return
+        _unlink_if_shared(outf)
+        with outf.open("w") as g:
+            template.render_to(g, values)
+            if affixment:
+                g.write(affixment)
+        record.bytes_written = outf.stat().st_size
+
+
 
 
+@lru_cache(maxsize=None)
+def get_packager_version() -> str:
+    """Return a string identifying the packager create_intunewin_file will use.
 
+    IntuneWinAppUtil.exe has no version switch, so the executable's path, size and
+    modification time are used instead. Empty if it is not on the path.
 
-def create_intunewin_file(slug: str, source_file: str, cwd=Path.cwd()) -> None:
+    Returns:
+        str
+    """
+    if use_native_packager():
+        import intunewin
+        return f"native:{intunewin.FORMAT_VERSION}"
+    executable = shutil.which("IntuneWinAppUtil.exe")
+    if not executable:
+        return ""
+    stat = Path(executable).stat()
+    return f"{executable}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def create_intunewin_file(slug: str, source_file: str, cwd=Path.cwd()) -> bool:
     """Generate an .intunewin file from the folder contents.
 
-    Requires IntuneWinAppUtil.exe to be installed and on the path.
+    Uses the in-process packager if selected (see PACKAGER_BACKEND), otherwise requires
+    IntuneWinAppUtil.exe to be installed and on the path. IntuneWinAppUtil.exe runs that
+    fail or time out (see SUBPROCESS_TIMEOUTS) are retried as set with set_retry_policy.
 
     Args:
         slug (str): slug of the folder name
+
+    Returns:
+        bool: True if the .intunewin file was generated
     """
-    try:
-        subprocess.run(
-            [
-                f"IntuneWinAppUtil.exe", 
-                f"-c", 
-                f".\{slug}\\", 
-                f"-s", 
-                f".\{slug}\\{source_file}",
-                f"-o", 
-                f".\{slug}\\",
-                f"-q"
-            ], 
-            timeout=15,
-            cwd=cwd
-        )
-    except FileNotFoundError as exc:
-        print(f"Unable to generate {slug}.intunewin file because the IntuneWinAppUtil executable could not be found.")
-    except subprocess.CalledProcessError as exc:
-        print(
-            f"Process failed because did not return a successful return code. "
-            f"Returned {exc.returncode}\n{exc}"
-        )
-    except subprocess.TimeoutExpired as exc:
-        print(f"Process timed out.\n{exc}")
-
-
-def get_winget_show_output(winget_id):
+    import instrumentation
+    output_path = Path(cwd) / slug / f"{Path(source_file).stem}.intunewin"
+    if use_native_packager():
+        import intunewin
+        try:
+            with _Slot(_packager_slots), instrumentation.stage("package", "native", app=slug) as record:
+                folder = Path(cwd) / slug
+                output_path = intunewin.create_intunewin(folder, source_file, folder)
+                record.bytes_written = output_path.stat().st_size
+            return True
+        except (OSError, RuntimeError) as exc:
+            print(f"Unable to generate {slug}.intunewin file.\n{exc}")
+            return False
+
+    for attempt in range(SUBPROCESS_RETRIES + 1):
+        if attempt:
+            _backoff(attempt)
+        with _Slot(_packager_slots), instrumentation.stage("package", "external", app=slug) as record:
+            record.attempt = attempt
+            try:
+                subprocess.run(
+                    [
+                        f"IntuneWinAppUtil.exe",
+                        f"-c",
+                        f".\{slug}\\",
+                        f"-s",
+                        f".\{slug}\\{source_file}",
+                        f"-o",
+                        f".\{slug}\\",
+                        f"-q"
+                    ],
+                    timeout=SUBPROCESS_TIMEOUTS["packager"],
+                    check=True,
+                    cwd=cwd
+                )
+                record.exit_code = 0
+                if output_path.exists():
+                    record.bytes_written = output_path.stat().st_size
+                return True
+            except FileNotFoundError as exc:
+                record.error = "IntuneWinAppUtil executable not found"
+                print(f"Unable to generate {slug}.intunewin file because the IntuneWinAppUtil executable could not be found.")
+                # Retrying won't help
+                return False
+            except subprocess.CalledProcessError as exc:
+                record.exit_code = exc.returncode
+                print(
+                    f"Process failed because did not return a successful return code. "
+                    f"Returned {exc.returncode}\n{exc}"
+                )
+            except subprocess.TimeoutExpired as exc:
+                record.timed_out = True
+                print(f"Process timed out.\n{exc}")
+    return False
+
+
+def get_winget_show_output(winget_id, source=None):
     """Generate a "package_details.yaml" file using the winget show command.
 
-    Requires IntuneWinAppUtil.exe to be installed and on the path.
+    Requires winget.exe (or the executable WINGET_EXECUTABLE points to) to be installed and on the path.
+    Runs that time out (see SUBPROCESS_TIMEOUTS) are retried as set with set_retry_policy.
 
     Args:
         winget_id (str): --id of the application.
+        source (str or None): --source to query. Defaults to all configured sources.
     """
-    try:
-        out = subprocess.check_output(
-            [
-                f"winget.exe",
-                f"show",
-                f"--exact", 
-                f"--id", 
-                f"{winget_id}"
-            ], 
-            timeout=15
-        )
-        return out.decode()
-    except FileNotFoundError as exc:
-        print(f"Unable to generate {winget_id}.package_details file because the winget executable could not be found.")
-    except subprocess.CalledProcessError as exc:
-        print(
-            f"Process failed because did not return a successful return code. "
-            f"Returned {exc.returncode}\n{exc}"
-        )
-    except subprocess.TimeoutExpired as exc:
-        print(f"Process timed out.\n{exc}")
+    import instrumentation
+    source_args = ["--source", source] if source else []
+    for attempt in range(SUBPROCESS_RETRIES + 1):
+        if attempt:
+            _backoff(attempt)
+        with _Slot(_winget_slots), instrumentation.stage("winget_show", app=winget_id) as record:
+            record.attempt = attempt
+            try:
+                out = subprocess.check_output(
+                    [
+                        WINGET_EXECUTABLE,
+                        f"show",
+                        f"--exact",
+                        f"--id",
+                        f"{winget_id}",
+                        *source_args
+                    ],
+                    timeout=SUBPROCESS_TIMEOUTS["winget"]
+                )
+                record.exit_code = 0
+                return out.decode()
+            except FileNotFoundError as exc:
+                record.error = "winget executable not found"
+                print(f"Unable to generate {winget_id}.package_details file because the winget executable could not be found.")
+                return None
+            except subprocess.CalledProcessError as exc:
+                record.exit_code = exc.returncode
+                print(
+                    f"Process failed because did not return a successful return code. "
+                    f"Returned {exc.returncode}\n{exc}"
+                )
+                # e.g. no package with this id. Retrying won't help.
+                return None
+            except subprocess.TimeoutExpired as exc:
+                record.timed_out = True
+                print(f"Process timed out.\n{exc}")
+    return None
+
+
+def parse_winget_version(winget_show_output: str) -> str or None:
+    """Return the package version from `winget show` output.
+
+    Args:
+        winget_show_output (str): output of get_winget_show_output
+
+    Returns:
+        str or None: e.g. "2.37.3". None if the output has no Version line.
+    """
+    found = winget_show_output.find("Found")
+    for line in winget_show_output[max(found, 0):].splitlines():
+        key, _, value = line.partition(":")
+        if key.strip() == "Version" and value.strip():
+            return value.strip()
+    return None
 
 
 # TODO: Confirm if this is still used
@@ -145,3 +487,146 @@ def get_display_name() -> str:
     parser.add_argument('name', type=str, help="The value of the 'Display Name' registry key for the application to uninstall")
     args = parser.parse_args()
     return args.name
+
+
+# Subcommands of the intunify command line: name -> (module, function, help). The module of a
+# command is only imported when it runs, so that starting a command doesn't load the others.
+COMMANDS = {
+    "install": ("create_installer", "main", "generate an installer package (see create_installer.py)"),
+    "uninstall": ("create_uninstaller", "main", "generate an uninstaller package (see create_uninstaller.py)"),
+    "bulk": ("bulk_application_installer_generator", "main", "generate the installers of a catalog (see bulk_application_installer_generator.py)"),
+    "bulk-uninstall": ("bulk_uninstaller_generator", "main", "generate the uninstallers of a catalog (see bulk_uninstaller_generator.py)"),
+    "show": ("create_installer", "show_main", "print the package details of a winget id"),
+    "lock": ("lock_catalog", "main", "lock the versions of a catalog (see lock_catalog.py)"),
+    "publish": ("publish", "main", "upload packages to Intune (see publish.py)"),
+    "index": ("winget_index", "main", "index the winget manifests repository (see winget_index.py)"),
+    "registry": ("registry_index", "main", "index registry snapshots (see registry_index.py)"),
+    "serve": ("serve", "main", "run the generation server (see serve.py)"),
+}
+
+# Commands that don't return, and so can't be run in --batch mode
+_SERVER_COMMANDS = ("serve",)
+
+# Module settings the commands change, restored after every command of a batch
+_SETTINGS = ("WINGET_EXECUTABLE", "PACKAGER_BACKEND", "_output_store", "_packager_slots", "_winget_slots", "SUBPROCESS_RETRIES", "SUBPROCESS_RETRY_BACKOFF")
+
+
+@contextmanager
+def preserved_settings():
+    """Restore this module's settings (winget executable, packager backend, output store, subprocess
+    limits, timeouts and retries) when the block exits."""
+    settings = {name: globals()[name] for name in _SETTINGS}
+    timeouts = dict(SUBPROCESS_TIMEOUTS)
+    try:
+        yield
+    finally:
+        globals().update(settings)
+        SUBPROCESS_TIMEOUTS.clear()
+        SUBPROCESS_TIMEOUTS.update(timeouts)
+        get_packager_version.cache_clear()
+
+
+def run_command(command: str, argv: List[str]) -> None:
+    """Run an intunify command with the command line arguments 'argv'.
+
+    Args:
+        command (str): one of COMMANDS
+        argv (List[str]): the arguments following the command name
+    """
+    module_name, function_name, _ = COMMANDS[command]
+    getattr(importlib.import_module(module_name), function_name)(argv)
+
+
+def _exit_code(exit: SystemExit) -> int:
+    # The status a process exiting with 'exit' returns, printing a message passed instead of a status
+    if exit.code is None:
+        return 0
+    if isinstance(exit.code, int):
+        return exit.code
+    print(exit.code, file=sys.stderr)
+    return 1
+
+
+def run_batch(lines: Iterable[str], out: TextIO) -> int:
+    """Run the commands in 'lines', one JSON object per line, and write one JSON result line per command to 'out'.
+
+    Commands are objects such as {"id": "git", "command": "install", "args": ["Git.Git", "-k", "Git_is1"]},
+    where "id" is optional and echoed back. Each command runs in this process, with templates, modules
+    and caches left warm, and its output is captured into the result, e.g.
+        {"id": "git", "command": "install", "exit_code": 0, "ok": true, "wall_s": 0.412, "output": "..."}
+    Blank lines are skipped.
+
+    Returns:
+        int: the number of commands that failed
+    """
+    failed = 0
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        start = time.perf_counter()
+        captured = io.StringIO()
+        result = {"id": None, "command": None}
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("a command must be a JSON object")
+            result["id"] = request.get("id")
+            command = result["command"] = request.get("command")
+            args = request.get("args", [])
+            if command not in COMMANDS or command in _SERVER_COMMANDS:
+                raise ValueError(f"command must be one of {', '.join(name for name in COMMANDS if name not in _SERVER_COMMANDS)}. Received: {command!r}")
+            if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+                raise ValueError("args must be a list of strings")
+        except ValueError as e:
+            exit_code = 2
+            captured.write(f"Line {line_number}: {e}\n")
+        else:
+            with redirect_stdout(captured), redirect_stderr(captured), preserved_settings():
+                try:
+                    run_command(command, args)
+                    exit_code = 0
+                except SystemExit as e:
+                    exit_code = _exit_code(e)
+                except Exception:
+                    traceback.print_exc()
+                    exit_code = 1
+        failed += exit_code != 0
+        result.update(exit_code=exit_code, ok=exit_code == 0, wall_s=round(time.perf_counter() - start, 3), output=captured.getvalue())
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+    return failed
+
+
+def main(argv=None) -> None:
+    """Run an intunify command, e.g. `python intunify.py install Git.Git -k Git_is1`, or with --batch
+    the commands read from stdin (see run_batch)."""
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        run_command(argv[0], argv[1:])
+        return
+
+    parser = ArgumentParser(prog="intunify", description="Generate and publish Intune packages of winget applications.")
+    parser.add_argument('--batch', action="store_true", default=False, help="Run the newline-delimited JSON commands read from stdin in this process, writing one JSON result line per command to stdout.")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    for name, (_, _, help) in COMMANDS.items():
+        commands.add_parser(name, help=help, add_help=False)
+    args = parser.parse_args(argv)
+    if not args.batch:
+        parser.error("a command or --batch is required")
+    if args.command:
+        parser.error("--batch reads its commands from stdin")
+    # Results are written to a copy of stdout, and stdout is pointed at stderr: subprocesses such
+    # as IntuneWinAppUtil.exe write to the stdout they inherit, which would corrupt the results.
+    sys.stdout.flush()
+    with os.fdopen(os.dup(sys.stdout.fileno()), "w") as out:
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        failed = run_batch(sys.stdin, out)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    # The commands import this module as 'intunify'. Register it under that name so that they
+    # share its settings rather than executing it a second time.
+    sys.modules["intunify"] = sys.modules[__name__]
+    main()
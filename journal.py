@@ -0,0 +1,197 @@
+"""journal.py
+
+Append-only journal of a bulk run, so that a run that crashed or was killed can
+be resumed where it stopped.
+
+The journal (.intunify_journal.jsonl in the output folder) has one JSON object
+per line:
+    {"event": "run", "started": 1700000000.0, "resumed": false}
+    {"event": "stage", "app": "Git.Git", "stage": "package", "detail": "native", "ok": true, "wall_s": 0.81}
+    {"event": "record", "key": "Git.Git", "digest": "3f2a..."}
+    {"event": "done", "app": "Git.Git", "error": null}
+"stage" lines record every stage an application completes, "record" lines the
+packages built (the build manifest itself is only saved at the end of a run) and
+"done" lines every application, or "bundle <name>", that finished. error is null
+for applications built successfully.
+
+Lines are flushed as they are written, so a crash loses at most the line being
+written, and an incomplete last line is ignored when the journal is read.
+
+Applications that fail are also appended to a failures file
+(.intunify_failures.jsonl by default) as their catalog entries with an added
+"error", so that they can be retried by passing the file to the bulk generator
+with -i. The file is written as FAILURES_FILE_NAME + ".partial" and only replaces
+the previous failures file when the run ends, so it can be retried into the same
+output folder.
+"""
+
+
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Tuple
+
+from build_manifest import BuildManifest
+from instrumentation import StageRecord
+
+
+JOURNAL_FILE_NAME = ".intunify_journal.jsonl"
+FAILURES_FILE_NAME = ".intunify_failures.jsonl"
+
+
+def read_journal(path: Path) -> Tuple[Dict[str, str or None], Dict[str, str]]:
+    """Return what the journal at 'path' records, or nothing if there is no journal.
+
+    Returns:
+        Tuple[Dict[str, str or None], Dict[str, str]]: the error (None on success) of every
+        finished application, and the digest of every package recorded in the build manifest
+    """
+    finished = {}
+    records = {}
+    try:
+        with Path(path).open("r") as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # The line being written when the run stopped
+                    continue
+                if event.get("event") == "done":
+                    finished[event["app"]] = event.get("error")
+                elif event.get("event") == "record":
+                    records[event["key"]] = event["digest"]
+    except FileNotFoundError:
+        pass
+    return finished, records
+
+
+def _describe_failure(record: StageRecord) -> str:
+    if record.timed_out:
+        return f"{record.stage} timed out"
+    if record.exit_code:
+        return f"{record.stage} exited with {record.exit_code}"
+    return f"{record.stage}: {record.error}"
+
+
+class BuildJournal:
+    """Journal and failures file of a bulk run, safe to share between threads.
+
+    Packages recorded by an earlier journal of the output folder are always carried over, so
+    that a crashed run's builds aren't lost. With resume, the earlier journal is continued and
+    the applications it finished are listed in 'finished'; otherwise it is started afresh.
+
+    Args:
+        output_parent_directory (Path): output folder of the run
+        resume (bool): continue the journal of an interrupted run
+        failures_path (Path or None): failures file. Defaults to FAILURES_FILE_NAME in the output folder.
+    """
+
+    def __init__(self, output_parent_directory: Path, resume: bool = False, failures_path: Path or None = None):
+        self.path = Path(output_parent_directory) / JOURNAL_FILE_NAME
+        self.failures_path = Path(failures_path) if failures_path else Path(output_parent_directory) / FAILURES_FILE_NAME
+        finished, self.records = read_journal(self.path)
+        self.finished = finished if resume else {}
+        self.failures = 0
+        self._stage_failures = {}
+        self._lock = threading.Lock()
+
+        mode = "a" if resume else "w"
+        self._file = self._open(self.path, mode)
+        self._partial_failures_path = self.failures_path.with_name(self.failures_path.name + ".partial")
+        if resume and not self._partial_failures_path.exists() and self.failures_path.exists():
+            # Keep the failures of the run being resumed
+            shutil.copyfile(self.failures_path, self._partial_failures_path)
+        self._failures_file = self._open(self._partial_failures_path, mode)
+        self._write({"event": "run", "started": time.time(), "resumed": resume})
+        if not resume:
+            for key, digest in self.records.items():
+                self._write({"event": "record", "key": key, "digest": digest})
+
+    @staticmethod
+    def _open(path: Path, mode: str):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if mode == "a" and path.exists() and path.stat().st_size:
+            with path.open("rb") as f:
+                f.seek(-1, 2)
+                complete = f.read(1) == b"\n"
+            f = path.open(mode)
+            if not complete:
+                # Don't run on from a line cut short by a crash
+                f.write("\n")
+            return f
+        return path.open(mode)
+
+    def _write(self, event: dict, f=None) -> None:
+        line = json.dumps(event) + "\n"
+        f = f or self._file
+        with self._lock:
+            f.write(line)
+            f.flush()
+
+    def attach(self, manifest: BuildManifest) -> None:
+        """Restore the journaled packages into 'manifest' and journal its records from now on."""
+        for key, digest in self.records.items():
+            manifest.record(key, digest)
+        manifest.on_record = self.record
+
+    def record(self, key: str, digest: str) -> None:
+        """Journal a package recorded in the build manifest."""
+        self._write({"event": "record", "key": key, "digest": digest})
+
+    def stage_finished(self, record: StageRecord) -> None:
+        """Journal a finished stage. Pass to instrumentation.add_listener."""
+        if record.app is None or record.application:
+            return
+        event = {"event": "stage", "app": record.app, "stage": record.stage, "detail": record.detail, "ok": not record.failed, "wall_s": round(record.wall_s, 3)}
+        if record.attempt:
+            event["attempt"] = record.attempt
+        if record.failed:
+            # Remembered to explain why the application failed
+            with self._lock:
+                self._stage_failures[record.app] = _describe_failure(record)
+        self._write(event)
+
+    def finish(self, label: str, error: str or None, entries: Iterable[dict] = (), app: str or None = None) -> str or None:
+        """Journal that an application finished, and add it to the failures file if it failed.
+
+        Args:
+            label (str): the application's name in the summary and journal, e.g. "bundle Dev tools"
+            error (str or None): None if the application was built successfully
+            entries (Iterable[dict]): its catalog entries (every member of a bundle)
+            app (str or None): the name its stages are recorded under, if not 'label'
+
+        Returns:
+            str or None: error, with the stage that failed last if there was one
+        """
+        with self._lock:
+            detail = self._stage_failures.pop(app or label, None)
+        if error is not None and detail is not None and detail not in error:
+            error = f"{error} ({detail})"
+        self._write({"event": "done", "app": label, "error": error})
+        if error is not None:
+            with self._lock:
+                self.failures += 1
+            for entry in entries:
+                self._write(dict(entry, error=error), self._failures_file)
+        return error
+
+    def close(self) -> None:
+        """Close the journal and replace the failures file with this run's, removing it if nothing failed."""
+        with self._lock:
+            self._file.close()
+            self._failures_file.close()
+        if self._partial_failures_path.stat().st_size:
+            os.replace(self._partial_failures_path, self.failures_path)
+        else:
+            self._partial_failures_path.unlink()
+            if self.failures_path.exists():
+                self.failures_path.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,178 @@
+r"""lock_catalog.py
+
+Resolves the version winget currently considers latest for every entry of a
+catalog and records it in a lockfile, e.g.
+    python lock_catalog.py -i example.json -o example.lock.json --jobs 8
+
+The bulk generator builds against the locked versions when given
+--lockfile, so builds are reproducible and only entries whose locked version
+changed since the last run are regenerated. Entries that pin a version in the
+catalog keep their pin and are not looked up.
+
+Lookups run `winget show` on a bounded pool of workers. --winget (or the
+INTUNIFY_WINGET environment variable) points them at a different winget
+executable, e.g. a local stub. With --winget-index, versions are resolved
+from an index of the winget manifests repository (see winget_index.py)
+instead, without running winget.
+"""
+
+
+import json
+import os
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Tuple
+
+import intunify
+from catalog import iter_applications, iter_catalog
+from intunify import get_winget_show_output, parse_winget_version, set_subprocess_limits
+from winget_index import WingetIndex
+
+
+LOCKFILE_FORMAT_VERSION = 1
+
+
+def read_lockfile(path: Path) -> Dict[str, str]:
+    """Return the locked versions of a lockfile.
+
+    Args:
+        path (Path): lockfile written by write_lockfile
+
+    Returns:
+        Dict[str, str]: lowercase winget id -> version
+    """
+    with Path(path).open("r") as f:
+        lock = json.load(f)
+    if lock.get("format_version") != LOCKFILE_FORMAT_VERSION:
+        raise ValueError(f"{path} is not a lockfile of format version {LOCKFILE_FORMAT_VERSION}")
+    return {winget_id.lower(): package["version"] for winget_id, package in lock["packages"].items()}
+
+
+def write_lockfile(path: Path, versions: Dict[str, str], catalog: Path) -> None:
+    """Write 'versions' to the lockfile 'path', replacing it atomically.
+
+    Args:
+        path (Path): lockfile path
+        versions (Dict[str, str]): winget id -> version
+        catalog (Path): catalog the versions were resolved for, recorded for reference
+    """
+    path = Path(path)
+    lock = {
+        "format_version": LOCKFILE_FORMAT_VERSION,
+        "catalog": str(catalog),
+        "locked_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "packages": {winget_id: {"version": version} for winget_id, version in sorted(versions.items(), key=lambda item: item[0].lower())},
+    }
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("w") as f:
+        json.dump(lock, f, indent=2)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+
+def resolve_version(winget_id: str) -> str or None:
+    """Return the version winget currently resolves 'winget_id' to, or None if it can't be resolved."""
+    output = get_winget_show_output(winget_id)
+    if output is None:
+        return None
+    return parse_winget_version(output.replace("\r\n", "\n"))
+
+
+def resolve_versions(winget_ids: Iterable[str], jobs: int = 4, winget_index: WingetIndex or None = None) -> Iterable[Tuple[str, str or None]]:
+    """Resolve the current version of every id on a pool of 'jobs' workers.
+
+    If a WingetIndex is passed as winget_index, ids are resolved to their newest indexed version instead.
+
+    Yields:
+        Tuple[str, str or None]: (winget_id, version) in input order. version is None if it couldn't be resolved.
+    """
+    if winget_index is not None:
+        for winget_id in winget_ids:
+            yield winget_id, winget_index.latest_version(winget_id)
+        return
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        winget_ids = list(winget_ids)
+        yield from zip(winget_ids, executor.map(resolve_version, winget_ids))
+
+
+def lock_catalog(catalog: Path, previous: Dict[str, str] or None = None, jobs: int = 4, winget_index: WingetIndex or None = None) -> Tuple[Dict[str, str], list]:
+    """Resolve a version for every entry of 'catalog'.
+
+    Entries that pin a version keep it. Entries winget can't resolve keep their version
+    from 'previous', if there is one, and are reported as failures otherwise.
+
+    Args:
+        catalog (Path): JSON or JSON Lines catalog
+        previous (Dict[str, str] or None): lowercase winget id -> version, as returned by read_lockfile
+        jobs (int): maximum number of concurrent winget lookups
+        winget_index (WingetIndex or None): resolve versions from this index instead of running winget
+
+    Returns:
+        Tuple[Dict[str, str], list]: winget id -> version, winget ids that couldn't be resolved
+    """
+    previous = previous or {}
+    versions = {}
+    to_resolve = {}
+    for application in iter_applications(iter_catalog(catalog)):
+        winget_id = application["winget_id"]
+        if application.get("version"):
+            versions[winget_id] = application["version"]
+        else:
+            to_resolve.setdefault(winget_id.lower(), winget_id)
+
+    failures = []
+    for winget_id, version in resolve_versions(to_resolve.values(), jobs, winget_index):
+        if version is None:
+            version = previous.get(winget_id.lower())
+            if version is None:
+                failures.append(winget_id)
+                continue
+            print(f"Unable to resolve {winget_id}, keeping locked version {version}.")
+        versions[winget_id] = version
+    return versions, failures
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(description="Resolve the current version of every catalog entry into a lockfile.")
+    parser.add_argument('-i', '--infile', type=str, required=True, help="path to JSON (array) or JSON Lines input file")
+    parser.add_argument('-o', '--lockfile', type=str, default=None, help="path to write the lockfile to. Defaults to the input file with a .lock.json suffix")
+    parser.add_argument('-j', '--jobs', type=int, default=4, help="maximum number of concurrent winget lookups. Defaults to 4")
+    parser.add_argument('--winget-index', type=str, default=None, help="path to an index of the winget manifests repository built with winget_index.py to resolve versions from instead of running winget")
+    parser.add_argument('--winget', type=str, default=None, help="path to the winget executable (or a stand-in). Defaults to winget.exe on the path")
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.winget:
+        intunify.WINGET_EXECUTABLE = args.winget
+    set_subprocess_limits(winget_jobs=args.jobs)
+
+    catalog = Path(args.infile)
+    lockfile = Path(args.lockfile) if args.lockfile else catalog.with_suffix(".lock.json")
+    previous = read_lockfile(lockfile) if lockfile.exists() else {}
+
+    if args.winget_index:
+        with WingetIndex(Path(args.winget_index)) as winget_index:
+            versions, failures = lock_catalog(catalog, previous, args.jobs, winget_index)
+    else:
+        versions, failures = lock_catalog(catalog, previous, args.jobs)
+    write_lockfile(lockfile, versions, catalog)
+
+    changed = [winget_id for winget_id, version in versions.items() if previous.get(winget_id.lower()) != version]
+    print(f"Locked {len(versions)} applications, {len(changed)} changed, {len(failures)} could not be resolved.")
+    for winget_id in changed:
+        print(f"  {winget_id}: {previous.get(winget_id.lower(), '(new)')} -> {versions[winget_id]}")
+    for winget_id in failures:
+        print(f"  {winget_id}: could not be resolved")
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""packages.py
+
+Generated packages held in memory, and the sinks they are written to.
+
+render_installer, render_bundle_installer and render_uninstaller return Package
+objects holding the rendered files and what they were generated from, without
+writing anything. A sink then decides where they go:
+
+    DirectorySink   package folders under an output directory, packaged with the
+                    selected packager. This is what the command line tools write.
+    ArchiveSink     members of a single zip or tar stream, each package with its
+                    .intunewin file built in memory
+    CallbackSink    any function, e.g. one uploading the package
+
+e.g. to stream a catalog into an archive:
+
+    with ArchiveSink(Path("packages.zip")) as sink:
+        for winget_id, display_name in applications:
+            for package in render_installer(winget_id, display_name=display_name):
+                sink.write(package)
+
+Sinks are safe to share between threads.
+"""
+
+
+import io
+import locale
+import os
+import shutil
+import tarfile
+import threading
+import time
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Callable, Dict
+
+import instrumentation
+import intunewin
+from intunify import create_intunewin_file, write_text_file
+
+
+ARCHIVE_FORMATS = ("zip", "tar", "tar.gz")
+
+
+class Package:
+    """A generated package: its files and metadata, in memory.
+
+    Args:
+        name (str): relative POSIX path of the package folder, e.g. "Git.Git", or "contoso-user-x64/Git.Git" for a variant
+        files (Dict[str, str]): file name -> contents
+        setup_file (str): name of the file Intune runs, e.g. "install.ps1"
+        metadata (dict or None): what the package was generated from, e.g. its winget_id and version
+        encodings (Dict[str, str] or None): encoding of the files not written in the platform's default encoding
+    """
+
+    __slots__ = ("name", "files", "setup_file", "metadata", "encodings")
+
+    def __init__(self, name: str, files: Dict[str, str], setup_file: str = "install.ps1", metadata: dict or None = None, encodings: Dict[str, str] or None = None):
+        if setup_file not in files:
+            raise ValueError(f"Setup file {setup_file} is not one of the files of {name}")
+        self.name = name
+        self.files = files
+        self.setup_file = setup_file
+        self.metadata = metadata or {}
+        self.encodings = encodings or {}
+
+    @property
+    def slug(self) -> str:
+        """Name of the package folder, e.g. "Git.Git"."""
+        return PurePosixPath(self.name).name
+
+    @property
+    def intunewin_name(self) -> str:
+        """Name of the package's .intunewin file, e.g. "install.intunewin"."""
+        return f"{PurePosixPath(self.setup_file).stem}.intunewin"
+
+    def encoding(self, file_name: str) -> str or None:
+        """Return the encoding 'file_name' is written in. None for the platform's default encoding."""
+        return self.encodings.get(file_name)
+
+    def data(self, file_name: str) -> bytes:
+        """Return the bytes write_text_file writes for 'file_name' on this platform."""
+        text = self.files[file_name]
+        if os.linesep != "\n":
+            text = text.replace("\n", os.linesep)
+        return text.encode(self.encoding(file_name) or locale.getpreferredencoding(False))
+
+    def write_intunewin(self, out: BinaryIO) -> None:
+        """Build the package's .intunewin file in memory with the native packager and write it to 'out'."""
+        intunewin.write_intunewin({file_name: self.data(file_name) for file_name in self.files}, self.setup_file, out)
+
+    def intunewin(self) -> bytes:
+        """Return the package's .intunewin file, built in memory with the native packager."""
+        out = io.BytesIO()
+        self.write_intunewin(out)
+        return out.getvalue()
+
+    def __repr__(self) -> str:
+        return f"Package({self.name})"
+
+
+class DirectorySink:
+    """Writes packages to their folders under 'root' and packages them with the selected packager
+    (see create_intunewin_file).
+
+    Args:
+        root (Path): output directory
+        package (bool): also generate the .intunewin files
+    """
+
+    def __init__(self, root: Path, package: bool = True):
+        self.root = Path(root)
+        self.build_intunewin = package
+
+    def folder(self, package: Package) -> Path:
+        """Return the folder 'package' is written to."""
+        return self.root / package.name
+
+    def write_files(self, package: Package) -> None:
+        """Write the files of 'package', without packaging it."""
+        folder = self.folder(package)
+        Path.mkdir(folder, parents=True, exist_ok=True)
+        for file_name, text in package.files.items():
+            with instrumentation.stage("render", file_name) as record:
+                record.bytes_written = write_text_file(folder / file_name, text, package.encoding(file_name))
+
+    def write_intunewin(self, package: Package) -> bool:
+        """Generate the .intunewin file of 'package' from its written files.
+
+        Returns:
+            bool: True if the .intunewin file was generated
+        """
+        name = PurePosixPath(package.name)
+        return create_intunewin_file(name.name, package.setup_file, cwd=self.root / name.parent)
+
+    def copy_intunewin(self, source: Package, package: Package) -> bool:
+        """Copy the .intunewin file of 'source' to 'package', whose files are the same.
+
+        Returns:
+            bool: True
+        """
+        with instrumentation.stage("package", "copy", app=package.slug) as record:
+            destination = self.folder(package) / package.intunewin_name
+            shutil.copyfile(self.folder(source) / source.intunewin_name, destination)
+            record.bytes_written = destination.stat().st_size
+        return True
+
+    def write(self, package: Package) -> bool:
+        """Write 'package' and, unless the sink was created with package=False, package it.
+
+        Returns:
+            bool: True if the package was written (and packaged)
+        """
+        self.write_files(package)
+        return self.write_intunewin(package) if self.build_intunewin else True
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def archive_format(path: Path) -> str:
+    """Return the ArchiveSink format matching the suffix of 'path': "zip", "tar" or "tar.gz"."""
+    name = Path(path).name.lower()
+    if name.endswith(".zip"):
+        return "zip"
+    if name.endswith(".tar"):
+        return "tar"
+    if name.endswith((".tar.gz", ".tgz")):
+        return "tar.gz"
+    raise ValueError(f"Unknown archive format for {path}. Use a .zip, .tar, .tar.gz or .tgz file.")
+
+
+class ArchiveSink:
+    """Streams packages into a zip or tar archive, each under a folder named after the package.
+
+    The archive is written sequentially, so 'out' may be a pipe or an upload stream. Each
+    package's .intunewin file is built in memory with the native packager, which requires
+    the cryptography package.
+
+    Args:
+        out (Path or BinaryIO): archive file to create, or an open binary file the caller closes
+        format (str or None): one of ARCHIVE_FORMATS. Defaults to the one matching the suffix of 'out'.
+        package (bool): also add the .intunewin files
+    """
+
+    def __init__(self, out: Path or BinaryIO, format: str or None = None, package: bool = True):
+        if format is None:
+            if not isinstance(out, (str, Path)):
+                raise ValueError("format is required when writing to a file object")
+            format = archive_format(out)
+        if format not in ARCHIVE_FORMATS:
+            raise ValueError(f"format must be one of {', '.join(ARCHIVE_FORMATS)}. Received: {format!r}")
+        if package and not intunewin.is_available():
+            raise RuntimeError("Archiving .intunewin files requires the cryptography package.")
+        self.build_intunewin = package
+        self._lock = threading.Lock()
+        self._file = Path(out).open("wb") if isinstance(out, (str, Path)) else None
+        fileobj = self._file or out
+        if format == "zip":
+            self._zip, self._tar = zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED), None
+        else:
+            self._zip, self._tar = None, tarfile.open(fileobj=fileobj, mode="w|gz" if format == "tar.gz" else "w|")
+
+    def _add(self, name: str, data: bytes, compress: bool = True) -> None:
+        # Called with the lock held
+        if self._zip is not None:
+            self._zip.writestr(name, data, zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            info.mode = 0o644
+            self._tar.addfile(info, io.BytesIO(data))
+
+    def write(self, package: Package) -> bool:
+        """Add the files of 'package' and its .intunewin file to the archive.
+
+        Returns:
+            bool: True
+        """
+        members = [(f"{package.name}/{file_name}", package.data(file_name), True) for file_name in package.files]
+        if self.build_intunewin:
+            # Built outside the lock so that several threads package at once
+            with instrumentation.stage("package", "memory", app=package.slug) as record:
+                data = package.intunewin()
+                record.bytes_written = len(data)
+            # The encrypted content doesn't compress
+            members.append((f"{package.name}/{package.intunewin_name}", data, False))
+        with instrumentation.stage("archive", package.name) as record, self._lock:
+            for name, data, compress in members:
+                self._add(name, data, compress)
+            record.bytes_written = sum(len(data) for _, data, _ in members)
+        return True
+
+    def close(self) -> None:
+        """Finish the archive, and close its file if the sink opened it."""
+        with self._lock:
+            if self._zip is not None:
+                self._zip.close()
+            else:
+                self._tar.close()
+            if self._file is not None:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CallbackSink:
+    """Passes every package to 'callback', e.g. to upload it.
+
+    Args:
+        callback (Callable[[Package], bool or None]): called from the writing thread. Returning
+            False reports the package as failed; package.intunewin() builds its .intunewin file.
+    """
+
+    def __init__(self, callback: Callable[[Package], bool or None]):
+        self.callback = callback
+
+    def write(self, package: Package) -> bool:
+        return self.callback(package) is not False
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
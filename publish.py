@@ -0,0 +1,665 @@
+r"""publish.py
+
+Publishes the packages of an output folder to Intune as Win32 apps through the
+Microsoft Graph API, e.g.
+    python publish.py -o out --tenant contoso.onmicrosoft.com --client-id <app id> --jobs 4
+
+The client secret is read from the INTUNIFY_CLIENT_SECRET environment
+variable. Alternatively pass an access token with --token (or
+INTUNIFY_GRAPH_TOKEN).
+
+Every folder of the output folder holding an install.intunewin file (as
+written by generate_installer and generate_bundle_installer) is published as
+one app: the app record is created, or updated if it was published before,
+and the encrypted content is uploaded to the Azure storage URL Intune hands
+out in blocks on a pool of pooled HTTP connections, then committed with the
+encryption info from the package's Detection.xml. Several apps are published
+at once (--jobs), each uploading several blocks at once (--upload-jobs).
+
+Progress is recorded in .intunify_publish.json in the output folder after
+every step. An interrupted run picks up where it stopped: existing app
+records and content versions are reused and only the blocks Azure storage
+doesn't have yet are uploaded. Apps whose package is unchanged since it was
+last committed are skipped unless --force is passed.
+
+--graph-url and --login-url point the stage at other endpoints, e.g. a
+national cloud or a local mock server.
+"""
+
+
+import base64
+import http.client
+import json
+import os
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+import zipfile
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple
+from urllib.parse import quote, urlencode, urlsplit
+
+from bulk_application_installer_generator import map_in_order, print_summary
+
+
+DEFAULT_GRAPH_URL = "https://graph.microsoft.com/beta"
+DEFAULT_LOGIN_URL = "https://login.microsoftonline.com"
+GRAPH_SCOPE = "https://graph.microsoft.com/.default"
+
+STATE_FILE_NAME = ".intunify_publish.json"
+PACKAGE_FILE_NAME = "install.intunewin"
+
+DEFAULT_BLOCK_SIZE = 6 * 1024 * 1024
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_TIMEOUT = 600.0
+MAX_RETRIES = 5
+
+INSTALL_COMMAND_LINE = r"%SystemRoot%\sysnative\WindowsPowerShell\v1.0\PowerShell.exe -ExecutionPolicy Bypass .\install.ps1"
+UNINSTALL_COMMAND_LINE = r"%SystemRoot%\sysnative\WindowsPowerShell\v1.0\PowerShell.exe -ExecutionPolicy Bypass .\uninstall.ps1"
+
+RETURN_CODES = [
+    {"returnCode": 0, "type": "success"},
+    {"returnCode": 1707, "type": "success"},
+    {"returnCode": 3010, "type": "softReboot"},
+    {"returnCode": 1641, "type": "hardReboot"},
+    {"returnCode": 1618, "type": "retry"},
+]
+
+# Status codes worth retrying after a pause (Retry-After if the server sends one). A POST that
+# failed otherwise may have been carried out, so it is only retried when it was turned away.
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+_POST_RETRY_STATUSES = (429, 503)
+
+_CONTENT_ARCNAME = "IntuneWinPackage/Contents/"
+_DETECTION_ARCNAME = "IntuneWinPackage/Metadata/Detection.xml"
+
+
+class PublishError(RuntimeError):
+    """A request to Graph or Azure storage failed.
+
+    Args:
+        message (str)
+        status (int or None): HTTP status of the failed request
+    """
+
+    def __init__(self, message: str, status: int or None = None):
+        super().__init__(message)
+        self.status = status
+
+
+class ConnectionPool:
+    """Keeps HTTP(S) connections open between requests, per host, safe to share between threads.
+
+    Args:
+        size (int): maximum number of idle connections kept per host
+        timeout (float): socket timeout in seconds
+    """
+
+    def __init__(self, size: int = 16, timeout: float = 120.0):
+        self.size = size
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop()
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def _release(self, scheme: str, netloc: str, connection: http.client.HTTPConnection) -> None:
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def request(self, method: str, url: str, body: bytes or None = None, headers: dict or None = None) -> Tuple[int, http.client.HTTPMessage, bytes]:
+        """Send a request on an idle connection to the host of 'url', or a new one.
+
+        A request that fails on a reused connection before a response arrives is sent again on a
+        new connection, as the server may have closed the idle connection in the meantime.
+
+        Returns:
+            Tuple[int, HTTPMessage, bytes]: status, response headers, response body
+        """
+        parts = urlsplit(url)
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        while True:
+            connection = self._connection(parts.scheme, parts.netloc)
+            reused = connection.sock is not None
+            try:
+                connection.request(method, target, body=body, headers=headers or {})
+                response = connection.getresponse()
+                data = response.read()
+            except (ConnectionError, http.client.RemoteDisconnected, http.client.BadStatusLine):
+                connection.close()
+                if reused:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(parts.scheme, parts.netloc, connection)
+            return response.status, response.headers, data
+
+    def close(self) -> None:
+        with self._lock:
+            for idle in self._idle.values():
+                for connection in idle:
+                    connection.close()
+            self._idle = {}
+
+
+def request_with_retries(pool: ConnectionPool, method: str, url: str, body: bytes or None = None, headers: dict or None = None, retries: int = MAX_RETRIES) -> Tuple[int, http.client.HTTPMessage, bytes]:
+    """Send a request, retrying throttled (429) and failed (5xx) requests and connection errors with backoff."""
+    retry_statuses = _POST_RETRY_STATUSES if method == "POST" else _RETRY_STATUSES
+    for attempt in range(retries + 1):
+        try:
+            status, response_headers, data = pool.request(method, url, body, headers)
+        except OSError:
+            if attempt == retries or method == "POST":
+                raise
+            time.sleep(2 ** attempt)
+            continue
+        if status not in retry_statuses or attempt == retries:
+            return status, response_headers, data
+        retry_after = response_headers.get("Retry-After")
+        time.sleep(float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt)
+
+
+class TokenProvider:
+    """Supplies Graph access tokens, from a fixed token or with the client credentials flow.
+
+    Args:
+        pool (ConnectionPool)
+        token (str or None): access token to use as is
+        tenant (str or None): tenant id or domain, with client_id and client_secret
+        client_id (str or None)
+        client_secret (str or None)
+        login_url (str): Azure AD endpoint
+    """
+
+    def __init__(self, pool: ConnectionPool, token: str or None = None, tenant: str or None = None, client_id: str or None = None, client_secret: str or None = None, login_url: str = DEFAULT_LOGIN_URL):
+        if not token and not (tenant and client_id and client_secret):
+            raise ValueError("Must supply an access token, or a tenant, client id and client secret.")
+        self.pool = pool
+        self.tenant = tenant
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.login_url = login_url.rstrip("/")
+        self._token = token
+        self._fixed = bool(token)
+        self._expires_at = float("inf") if token else 0
+        self._lock = threading.Lock()
+
+    def get(self, refresh: bool = False) -> str:
+        """Return a valid access token, requesting a new one if it expires within 5 minutes or 'refresh' is True."""
+        with self._lock:
+            if self._fixed or (not refresh and time.time() < self._expires_at - 300):
+                return self._token
+            body = urlencode({
+                "grant_type": "client_credentials",
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+                "scope": GRAPH_SCOPE,
+            }).encode()
+            url = f"{self.login_url}/{quote(self.tenant)}/oauth2/v2.0/token"
+            status, _, data = request_with_retries(self.pool, "POST", url, body, {"Content-Type": "application/x-www-form-urlencoded"})
+            if status != 200:
+                raise PublishError(f"Token request failed with {status}: {data[:500].decode(errors='replace')}", status)
+            response = json.loads(data)
+            self._token = response["access_token"]
+            self._expires_at = time.time() + float(response.get("expires_in", 3600))
+            return self._token
+
+
+class GraphClient:
+    """Minimal Microsoft Graph client for the calls publishing needs.
+
+    Args:
+        pool (ConnectionPool)
+        tokens (TokenProvider)
+        graph_url (str): Graph endpoint including the API version, e.g. https://graph.microsoft.com/beta
+    """
+
+    def __init__(self, pool: ConnectionPool, tokens: TokenProvider, graph_url: str = DEFAULT_GRAPH_URL):
+        self.pool = pool
+        self.tokens = tokens
+        self.graph_url = graph_url.rstrip("/")
+
+    def call(self, method: str, path: str, body: dict or None = None, allow_not_found: bool = False) -> dict or None:
+        """Send a Graph request and return its JSON response.
+
+        Args:
+            path (str): path relative to graph_url, e.g. "deviceAppManagement/mobileApps"
+            body (dict or None): JSON request body
+            allow_not_found (bool): return None rather than raise on 404
+
+        Raises:
+            PublishError: if Graph responds with an error status
+        """
+        data = json.dumps(body).encode() if body is not None else None
+        url = f"{self.graph_url}/{path}"
+        for refresh in (False, True):
+            headers = {"Authorization": f"Bearer {self.tokens.get(refresh)}", "Accept": "application/json"}
+            if data is not None:
+                headers["Content-Type"] = "application/json"
+            status, _, response = request_with_retries(self.pool, method, url, data, headers)
+            if status != 401:
+                break
+        if status == 404 and allow_not_found:
+            return None
+        if status >= 400:
+            raise PublishError(f"{method} {path} failed with {status}: {response[:500].decode(errors='replace')}", status)
+        return json.loads(response) if response else {}
+
+
+class PublishState:
+    """On-disk record of the publishing progress of an output folder, saved after every change.
+
+    Safe to share between the threads of a parallel run.
+    """
+
+    def __init__(self, output_parent_directory: Path):
+        self.path = Path(output_parent_directory) / STATE_FILE_NAME
+        self._lock = threading.Lock()
+        try:
+            with self.path.open("r") as f:
+                self._apps = json.load(f)
+        except FileNotFoundError:
+            self._apps = {}
+        except ValueError:
+            print(f"Ignoring unreadable publish state {self.path}, all applications will be published as new apps.")
+            self._apps = {}
+
+    def get(self, slug: str) -> dict:
+        with self._lock:
+            return dict(self._apps.get(slug, {}))
+
+    def update(self, slug: str, **values) -> None:
+        """Set (or with None, remove) fields of the state of 'slug' and save the state."""
+        with self._lock:
+            app = self._apps.setdefault(slug, {})
+            for key, value in values.items():
+                if value is None:
+                    app.pop(key, None)
+                else:
+                    app[key] = value
+            tmp_path = self.path.with_suffix(".tmp")
+            with tmp_path.open("w") as f:
+                json.dump(self._apps, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+def read_package(path: Path) -> dict:
+    """Return what publishing needs from an .intunewin file.
+
+    Returns:
+        dict: file_name and setup_file, size (of the unencrypted content), encryption_info as
+        Graph expects it, and content_offset and content_size, the location of the encrypted
+        content within 'path'. content_offset is None if the content is compressed.
+    """
+    with zipfile.ZipFile(path) as zf:
+        detection = ElementTree.fromstring(zf.read(_DETECTION_ARCNAME))
+        file_name = detection.findtext("FileName")
+        info = zf.getinfo(_CONTENT_ARCNAME + file_name)
+    encryption = detection.find("EncryptionInfo")
+    content_offset = None
+    if info.compress_type == zipfile.ZIP_STORED:
+        # The stored content starts after its local file header, whose extra field may differ from the central directory's
+        with open(path, "rb") as f:
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = int.from_bytes(f.read(2), "little"), int.from_bytes(f.read(2), "little")
+        content_offset = info.header_offset + 30 + name_length + extra_length
+    return {
+        "file_name": file_name,
+        "setup_file": detection.findtext("SetupFile"),
+        "size": int(detection.findtext("UnencryptedContentSize")),
+        "content_offset": content_offset,
+        "content_size": info.file_size,
+        "encryption_info": {
+            "encryptionKey": encryption.findtext("EncryptionKey"),
+            "macKey": encryption.findtext("MacKey"),
+            "initializationVector": encryption.findtext("InitializationVector"),
+            "mac": encryption.findtext("Mac"),
+            "profileIdentifier": encryption.findtext("ProfileIdentifier"),
+            "fileDigest": encryption.findtext("FileDigest"),
+            "fileDigestAlgorithm": encryption.findtext("FileDigestAlgorithm"),
+        },
+    }
+
+
+def read_block(path: Path, package: dict, offset: int, size: int) -> bytes:
+    """Return 'size' bytes of the encrypted content of the .intunewin file 'path', from 'offset'."""
+    if package["content_offset"] is not None:
+        with open(path, "rb") as f:
+            f.seek(package["content_offset"] + offset)
+            return f.read(size)
+    with zipfile.ZipFile(path) as zf, zf.open(_CONTENT_ARCNAME + package["file_name"]) as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def package_metadata(folder: Path) -> dict:
+    """Return the display name, publisher and description of the package in 'folder'.
+
+    They are taken from package_details.yaml if the folder has one for a single package, and
+    default to the folder name (and its first dot-separated part as the publisher).
+    """
+    metadata = {"displayName": folder.name, "publisher": folder.name.split(".")[0], "description": folder.name}
+    details_path = folder / "package_details.yaml"
+    if not details_path.exists():
+        return metadata
+    text = details_path.read_text(encoding="utf-8")
+    # Bundles have one document per member
+    if "\n---\n" in text:
+        return metadata
+    details = {}
+    for line in text.splitlines():
+        key, separator, value = line.partition(":")
+        if not separator or line.startswith(" ") or key in details:
+            continue
+        value = value.strip()
+        if value.startswith('"'):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        details[key.strip()] = value
+    if details.get("Found"):
+        metadata["displayName"] = details["Found"].rsplit(" [", 1)[0]
+    for key, field in [("Publisher", "publisher"), ("Description", "description")]:
+        if details.get(key):
+            metadata[field] = details[key]
+    return metadata
+
+
+def app_body(folder: Path, package: dict) -> dict:
+    """Return the Graph win32LobApp record of the package in 'folder'."""
+    detection_script = (folder / "detect.ps1").read_bytes()
+    return {
+        "@odata.type": "#microsoft.graph.win32LobApp",
+        **package_metadata(folder),
+        "fileName": PACKAGE_FILE_NAME,
+        "setupFilePath": package["setup_file"],
+        "installCommandLine": INSTALL_COMMAND_LINE,
+        "uninstallCommandLine": UNINSTALL_COMMAND_LINE,
+        "installExperience": {"runAsAccount": "system", "deviceRestartBehavior": "suppress"},
+        "applicableArchitectures": "x64,x86",
+        "minimumSupportedOperatingSystem": {"v10_1607": True},
+        "returnCodes": RETURN_CODES,
+        "rules": [
+            {
+                "@odata.type": "#microsoft.graph.win32LobAppPowerShellScriptRule",
+                "ruleType": "detection",
+                "enforceSignatureCheck": False,
+                "runAs32Bit": False,
+                "scriptContent": base64.b64encode(detection_script).decode(),
+            }
+        ],
+    }
+
+
+def block_id(index: int) -> str:
+    """Return the Azure storage block id of the index'th block. All block ids of a blob have the same length."""
+    return base64.b64encode(f"block-{index:08d}".encode()).decode()
+
+
+def _storage_url(sas_uri: str, **query) -> str:
+    return f"{sas_uri}&{urlencode(query)}" if "?" in sas_uri else f"{sas_uri}?{urlencode(query)}"
+
+
+def uncommitted_blocks(pool: ConnectionPool, sas_uri: str) -> dict:
+    """Return the blocks already uploaded to the blob at 'sas_uri' but not committed yet.
+
+    Returns:
+        dict: block id -> size
+    """
+    status, _, data = request_with_retries(pool, "GET", _storage_url(sas_uri, comp="blocklist", blocklisttype="uncommitted"), headers={"x-ms-version": "2019-12-12"})
+    if status == 404:
+        return {}
+    if status >= 400:
+        raise PublishError(f"Listing uploaded blocks failed with {status}", status)
+    blocks = {}
+    for block in ElementTree.fromstring(data).iter("Block"):
+        blocks[block.findtext("Name")] = int(block.findtext("Size"))
+    return blocks
+
+
+def upload_content(pool: ConnectionPool, sas_uri: str, path: Path, package: dict, block_size: int = DEFAULT_BLOCK_SIZE, jobs: int = 4) -> int:
+    """Upload the encrypted content of an .intunewin file to Azure storage in blocks, 'jobs' blocks at a time,
+    and commit the block list.
+
+    Blocks Azure storage already has (from an interrupted upload) aren't uploaded again.
+
+    Returns:
+        int: bytes uploaded
+    """
+    size = package["content_size"]
+    count = max(1, -(-size // block_size))
+    uploaded = uncommitted_blocks(pool, sas_uri)
+    missing = [
+        index for index in range(count)
+        if uploaded.get(block_id(index)) != min(block_size, size - index * block_size)
+    ]
+
+    def put_block(index):
+        data = read_block(path, package, index * block_size, min(block_size, size - index * block_size))
+        url = _storage_url(sas_uri, comp="block", blockid=block_id(index))
+        status, _, response = request_with_retries(pool, "PUT", url, data, {"x-ms-version": "2019-12-12", "Content-Length": str(len(data))})
+        if status >= 400:
+            raise PublishError(f"Uploading block {index} failed with {status}: {response[:300].decode(errors='replace')}", status)
+        return len(data)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        written = sum(executor.map(put_block, missing))
+
+    block_list = "".join(f"<Latest>{block_id(index)}</Latest>" for index in range(count))
+    body = f'<?xml version="1.0" encoding="utf-8"?><BlockList>{block_list}</BlockList>'.encode()
+    status, _, response = request_with_retries(pool, "PUT", _storage_url(sas_uri, comp="blocklist"), body, {"x-ms-version": "2019-12-12", "Content-Type": "application/xml"})
+    if status >= 400:
+        raise PublishError(f"Committing the block list failed with {status}: {response[:300].decode(errors='replace')}", status)
+    return written
+
+
+class Publisher:
+    """Publishes the packages of an output folder, safe to share between threads.
+
+    Args:
+        client (GraphClient)
+        state (PublishState)
+        block_size (int): bytes per uploaded block
+        upload_jobs (int): blocks uploaded at once per package
+        poll_interval (float): seconds between polls of the upload state
+        timeout (float): seconds to wait for Intune to hand out an upload URL or commit a file
+    """
+
+    def __init__(self, client: GraphClient, state: PublishState, block_size: int = DEFAULT_BLOCK_SIZE, upload_jobs: int = 4, poll_interval: float = DEFAULT_POLL_INTERVAL, timeout: float = DEFAULT_TIMEOUT):
+        self.client = client
+        self.state = state
+        self.block_size = block_size
+        self.upload_jobs = upload_jobs
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def _app_path(self, app_id: str) -> str:
+        return f"deviceAppManagement/mobileApps/{app_id}"
+
+    def _file_path(self, app_id: str, content_version_id: str, file_id: str) -> str:
+        return f"{self._app_path(app_id)}/microsoft.graph.win32LobApp/contentVersions/{content_version_id}/files/{file_id}"
+
+    def _wait_for(self, path: str, states: Iterable[str]) -> dict:
+        """Poll the content file at 'path' until its uploadState is one of 'states'."""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            content_file = self.client.call("GET", path)
+            upload_state = content_file.get("uploadState") or ""
+            if upload_state in states:
+                return content_file
+            if upload_state.endswith(("Failed", "TimedOut")) or upload_state == "error":
+                raise PublishError(f"Intune reported {upload_state} for {path}")
+            if time.monotonic() > deadline:
+                raise PublishError(f"Timed out waiting for {path} to reach {' or '.join(states)}, last state {upload_state}")
+            time.sleep(self.poll_interval)
+
+    def publish(self, folder: Path, force: bool = False) -> bool:
+        """Create or update the Intune app of the package in 'folder' and upload its content.
+
+        Returns:
+            bool: True if the app was published, False if its package was already committed
+        """
+        folder = Path(folder)
+        slug = folder.name
+        package_path = folder / PACKAGE_FILE_NAME
+        package = read_package(package_path)
+        # The MAC is unique to every build of a package
+        package_id = package["encryption_info"]["mac"]
+        state = self.state.get(slug)
+        if not force and state.get("app_id") and state.get("committed") == package_id:
+            return False
+
+        # Create the app record, or update it if it was published before
+        body = app_body(folder, package)
+        app_id = state.get("app_id")
+        if app_id and self.client.call("GET", self._app_path(app_id), allow_not_found=True) is None:
+            print(f"{slug}: app {app_id} no longer exists, creating a new one.")
+            app_id = None
+            self.state.update(slug, app_id=None, pending=None, content_version_id=None, file_id=None)
+            state = {}
+        if app_id:
+            self.client.call("PATCH", self._app_path(app_id), {key: value for key, value in body.items() if key != "fileName"})
+        else:
+            app_id = self.client.call("POST", "deviceAppManagement/mobileApps", body)["id"]
+            self.state.update(slug, app_id=app_id)
+
+        # Reuse the content version of an interrupted upload of the same package
+        content_version_id, file_id = None, None
+        if state.get("pending") == package_id and state.get("content_version_id") and state.get("file_id"):
+            content_version_id, file_id = state["content_version_id"], state["file_id"]
+            file_path = self._file_path(app_id, content_version_id, file_id)
+            if self.client.call("GET", file_path, allow_not_found=True) is None:
+                content_version_id, file_id = None, None
+        if content_version_id is None:
+            content_version_id = self.client.call("POST", f"{self._app_path(app_id)}/microsoft.graph.win32LobApp/contentVersions", {})["id"]
+            file_id = self.client.call("POST", f"{self._app_path(app_id)}/microsoft.graph.win32LobApp/contentVersions/{content_version_id}/files", {
+                "@odata.type": "#microsoft.graph.mobileAppContentFile",
+                "name": package["file_name"],
+                "size": package["size"],
+                "sizeEncrypted": package["content_size"],
+                "manifest": None,
+                "isDependency": False,
+            })["id"]
+            self.state.update(slug, pending=package_id, content_version_id=content_version_id, file_id=file_id)
+        file_path = self._file_path(app_id, content_version_id, file_id)
+
+        content_file = self._wait_for(file_path, ["azureStorageUriRequestSuccess", "azureStorageUriRenewalSuccess", "commitFilePending", "commitFileSuccess"])
+        if content_file["uploadState"].startswith("azureStorageUri"):
+            try:
+                upload_content(self.client.pool, content_file["azureStorageUri"], package_path, package, self.block_size, self.upload_jobs)
+            except PublishError as exc:
+                # The upload URL expires after a while; a resumed upload may need a new one
+                if exc.status != 403:
+                    raise
+                self.client.call("POST", f"{file_path}/renewUpload", {})
+                content_file = self._wait_for(file_path, ["azureStorageUriRenewalSuccess"])
+                upload_content(self.client.pool, content_file["azureStorageUri"], package_path, package, self.block_size, self.upload_jobs)
+            self.client.call("POST", f"{file_path}/commit", {"fileEncryptionInfo": package["encryption_info"]})
+        self._wait_for(file_path, ["commitFileSuccess"])
+
+        self.client.call("PATCH", self._app_path(app_id), {"@odata.type": "#microsoft.graph.win32LobApp", "committedContentVersion": content_version_id})
+        self.state.update(slug, committed=package_id, pending=None, content_version_id=None, file_id=None)
+        return True
+
+
+def iter_package_folders(output_parent_directory: Path, names: List[str] or None = None) -> Iterator[Path]:
+    """Yield the folders of 'output_parent_directory' holding an install.intunewin file, by name,
+    or only those named in 'names'."""
+    output_parent_directory = Path(output_parent_directory)
+    if names:
+        folders = (output_parent_directory / name for name in names)
+    else:
+        folders = sorted(path for path in output_parent_directory.iterdir() if path.is_dir())
+    for folder in folders:
+        if (folder / PACKAGE_FILE_NAME).is_file():
+            yield folder
+        elif names:
+            print(f"{folder} has no {PACKAGE_FILE_NAME}, skipping.")
+
+
+def publish_folders(publisher: Publisher, folders: Iterable[Path], jobs: int = 4, force: bool = False) -> Iterator[Tuple[str, str or None]]:
+    """Publish package folders on a pool of 'jobs' workers.
+
+    Yields:
+        Tuple[str, str or None]: (folder name, error) per folder, in input order. error is None for
+        folders that were published or were already up to date.
+    """
+    def publish(folder):
+        try:
+            publisher.publish(folder, force)
+            return None
+        except Exception as exc:
+            return f"{type(exc).__name__}: {exc}"
+
+    for folder, error in map_in_order(publish, folders, jobs):
+        yield folder.name, error
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(description="Publish the packages of an output folder to Intune as Win32 apps.")
+    parser.add_argument('-o', '--outfolder', type=str, required=True, help="output folder of create_installer.py or the bulk generator")
+    parser.add_argument('folders', type=str, nargs="*", help="names of the package folders to publish. Defaults to every folder with an install.intunewin file")
+    parser.add_argument('--tenant', type=str, default=None, help="tenant id or domain to request a token for with --client-id and the INTUNIFY_CLIENT_SECRET environment variable")
+    parser.add_argument('--client-id', type=str, default=None, help="application (client) id of an app registration with the DeviceManagementApps.ReadWrite.All permission")
+    parser.add_argument('--token', type=str, default=os.environ.get("INTUNIFY_GRAPH_TOKEN"), help="Graph access token to use instead of --tenant and --client-id. Defaults to the INTUNIFY_GRAPH_TOKEN environment variable")
+    parser.add_argument('--graph-url', type=str, default=DEFAULT_GRAPH_URL, help=f"Graph endpoint. Defaults to {DEFAULT_GRAPH_URL}")
+    parser.add_argument('--login-url', type=str, default=DEFAULT_LOGIN_URL, help=f"Azure AD endpoint. Defaults to {DEFAULT_LOGIN_URL}")
+    parser.add_argument('-j', '--jobs', type=int, default=4, help="number of apps to publish at once. Defaults to 4")
+    parser.add_argument('--upload-jobs', type=int, default=4, help="number of blocks to upload at once per app. Defaults to 4")
+    parser.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE // (1024 * 1024), help=f"size of uploaded blocks in MiB. Defaults to {DEFAULT_BLOCK_SIZE // (1024 * 1024)}")
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL, help=f"seconds between checks of an upload's state. Defaults to {DEFAULT_POLL_INTERVAL}")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help=f"seconds to wait for Intune to process an upload. Defaults to {DEFAULT_TIMEOUT}")
+    parser.add_argument('--force', action="store_true", default=False, help="upload every package, even those already committed")
+    args = parser.parse_args(argv)
+    if args.jobs < 1 or args.upload_jobs < 1:
+        parser.error("--jobs and --upload-jobs must be at least 1")
+    if args.block_size < 1 or args.block_size > 100:
+        parser.error("--block-size must be between 1 and 100 MiB")
+    if not args.token and not (args.tenant and args.client_id):
+        parser.error("Must supply --token (or INTUNIFY_GRAPH_TOKEN), or --tenant and --client-id")
+    if not args.token and not os.environ.get("INTUNIFY_CLIENT_SECRET"):
+        parser.error("--tenant and --client-id require the INTUNIFY_CLIENT_SECRET environment variable")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    output_parent_directory = Path(args.outfolder).absolute()
+    pool = ConnectionPool(size=args.jobs * args.upload_jobs)
+    try:
+        tokens = TokenProvider(pool, token=args.token, tenant=args.tenant, client_id=args.client_id, client_secret=os.environ.get("INTUNIFY_CLIENT_SECRET"), login_url=args.login_url)
+        publisher = Publisher(
+            GraphClient(pool, tokens, args.graph_url),
+            PublishState(output_parent_directory),
+            block_size=args.block_size * 1024 * 1024,
+            upload_jobs=args.upload_jobs,
+            poll_interval=args.poll_interval,
+            timeout=args.timeout,
+        )
+        results = publish_folders(publisher, iter_package_folders(output_parent_directory, args.folders), args.jobs, args.force)
+        print_summary(results, verb="Published")
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
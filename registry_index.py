@@ -0,0 +1,423 @@
+r"""registry_index.py
+
+Index of the Uninstall registry keys of reference machines, used to fill in
+the detection values of catalog entries instead of searching regedit by hand.
+
+Snapshots are imported from .reg files exported with regedit (or
+`reg export`) and from JSON registry dumps, e.g. the output of
+    Get-ItemProperty HKLM:\SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall\* | ConvertTo-Json
+JSON dumps may also be an array of {"key": ..., "values": {...}} objects or an
+object mapping key paths to their values.
+
+    python registry_index.py import reference-pc.reg uninstall.json
+    python registry_index.py lookup "Notepad++"
+
+Every subkey of an Uninstall key with a DisplayName is stored in a SQLite
+database with its DisplayName, Publisher and DisplayVersion. Lookups match a
+name after normalization (case, punctuation, versions and architecture
+markers are ignored) and then fuzzily against the names sharing the most
+character trigrams with it, so they stay fast for thousands of keys.
+"""
+
+
+import difflib
+import json
+import re
+import sqlite3
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+
+DEFAULT_INDEX_PATH = Path.home() / ".intunify" / "registry_index.sqlite3"
+DEFAULT_CUTOFF = 0.85
+
+# Fuzzy lookups compare against at most this many entries, those sharing the most trigrams with the name
+FUZZY_CANDIDATE_LIMIT = 500
+
+UNINSTALL_SUBKEY_PATTERN = re.compile(r"\\Uninstall\\[^\\]+$", re.IGNORECASE)
+
+# Words that say nothing about which application a DisplayName belongs to
+_NOISE_PATTERN = re.compile(r"\b(?:x64|x86|amd64|arm64|64-bit|32-bit|64 bit|32 bit|\d+(?:\.\d+)+)\b")
+_NON_WORD_PATTERN = re.compile(r"[^0-9a-z]+")
+
+_HIVE_ABBREVIATIONS = {"HKLM": "HKEY_LOCAL_MACHINE", "HKCU": "HKEY_CURRENT_USER", "HKU": "HKEY_USERS"}
+
+
+def normalize_name(name: str) -> str:
+    """Return 'name' lowercased, without versions, architecture markers and punctuation.
+
+    e.g. "Notepad++ (64-bit x64)" -> "notepad", "Python 3.10.11 (64-bit)" -> "python"
+    """
+    name = _NOISE_PATTERN.sub(" ", name.lower())
+    return " ".join(_NON_WORD_PATTERN.sub(" ", name).split())
+
+
+def name_trigrams(normalized_name: str) -> set:
+    """Return the character trigrams of a normalized name with its spaces removed, so that a
+    word split in two (e.g. "win scp") shares them with the joined word ("winscp").
+
+    Names shorter than three characters are their own single trigram.
+    """
+    compact = normalized_name.replace(" ", "")
+    if len(compact) < 3:
+        return {compact}
+    return {compact[i:i + 3] for i in range(len(compact) - 2)}
+
+
+def normalize_key(key: str) -> str:
+    r"""Return a registry key path with the regedit "Computer\" prefix and hive abbreviations expanded."""
+    if "::" in key:
+        # PowerShell provider paths, e.g. Microsoft.PowerShell.Core\Registry::HKEY_LOCAL_MACHINE\...
+        key = key.split("::", 1)[1]
+    if key.lower().startswith("computer\\"):
+        key = key[len("computer\\"):]
+    hive, sep, rest = key.partition("\\")
+    hive = _HIVE_ABBREVIATIONS.get(hive.rstrip(":").upper(), hive)
+    return hive + sep + rest
+
+
+def _parse_reg_string(text: str, start: int) -> Tuple[str, int]:
+    # Parses the quoted string starting at text[start], returning it and the index after its closing quote
+    chars = []
+    i = start + 1
+    while i < len(text):
+        c = text[i]
+        if c == "\\" and i + 1 < len(text):
+            chars.append(text[i + 1])
+            i += 2
+            continue
+        if c == '"':
+            return "".join(chars), i + 1
+        chars.append(c)
+        i += 1
+    raise ValueError("unterminated string")
+
+
+def _reg_encoding(path: Path) -> str:
+    with open(path, "rb") as f:
+        bom = f.read(2)
+    if bom in (b"\xff\xfe", b"\xfe\xff"):
+        # regedit exports UTF-16 with a byte order mark
+        return "utf-16"
+    # REGEDIT4 exports are ANSI
+    return "utf-8-sig"
+
+
+def _iter_logical_lines(f) -> Iterator[str]:
+    # Joins lines continued with a trailing backslash (used by hex values)
+    buffer = ""
+    for line in f:
+        line = line.rstrip("\r\n")
+        if line.endswith("\\") and not line.lstrip().startswith("["):
+            buffer += line[:-1]
+            continue
+        yield buffer + line
+        buffer = ""
+    if buffer:
+        yield buffer
+
+
+def iter_reg_file(path: Path) -> Iterator[Tuple[str, Dict[str, str]]]:
+    """Yield (key, string values) for every Uninstall subkey in a .reg file.
+
+    Only REG_SZ values are kept. The file is read line by line, so large exports
+    (e.g. all of HKLM\\SOFTWARE) don't need to fit in memory.
+    """
+    key = None
+    values = {}
+    with open(path, "r", encoding=_reg_encoding(path), errors="replace") as f:
+        for line in _iter_logical_lines(f):
+            line = line.strip()
+            if line.startswith("["):
+                if key is not None:
+                    yield key, values
+                key = None
+                values = {}
+                path_text = line[1:line.rfind("]")]
+                # [-KEY] deletes a key
+                if not path_text.startswith("-") and UNINSTALL_SUBKEY_PATTERN.search(path_text):
+                    key = normalize_key(path_text)
+            elif key is not None and line.startswith('"'):
+                try:
+                    name, end = _parse_reg_string(line, 0)
+                    if line[end:end + 2] == '="':
+                        values[name], _ = _parse_reg_string(line, end + 1)
+                except ValueError:
+                    continue
+    if key is not None:
+        yield key, values
+
+
+def iter_json_dump(path: Path) -> Iterator[Tuple[str, Dict[str, str]]]:
+    """Yield (key, string values) for every Uninstall subkey in a JSON registry dump.
+
+    Accepts Get-ItemProperty | ConvertTo-Json output (objects with a PSPath), arrays of
+    {"key": ..., "values": {...}} objects and objects mapping key paths to their values.
+    """
+    # PowerShell writes UTF-8 with a byte order mark, or UTF-16 with Out-File in Windows PowerShell
+    with open(path, "r", encoding=_reg_encoding(path)) as f:
+        dump = json.load(f)
+    if isinstance(dump, dict) and not ("PSPath" in dump or "key" in dump):
+        records = [{"key": key, "values": values} for key, values in dump.items()]
+    elif isinstance(dump, dict):
+        records = [dump]
+    else:
+        records = dump
+    for record in records:
+        if not isinstance(record, dict):
+            continue
+        if "PSPath" in record:
+            key, values = record["PSPath"], record
+        else:
+            key, values = record.get("key"), record.get("values") or {}
+        if not isinstance(key, str) or not UNINSTALL_SUBKEY_PATTERN.search(key):
+            continue
+        yield normalize_key(key), {name: value for name, value in values.items() if isinstance(value, str)}
+
+
+def iter_snapshot(path: Path) -> Iterator[Tuple[str, Dict[str, str]]]:
+    """Yield (key, string values) for every Uninstall subkey of a .reg file or JSON dump."""
+    path = Path(path)
+    if path.suffix.lower() == ".json":
+        return iter_json_dump(path)
+    return iter_reg_file(path)
+
+
+class UninstallEntry:
+    """An indexed Uninstall subkey."""
+
+    __slots__ = ("key", "display_name", "publisher", "display_version", "normalized_name", "source")
+
+    def __init__(self, key: str, display_name: str, publisher: str or None, display_version: str or None, normalized_name: str, source: str):
+        self.key = key
+        self.display_name = display_name
+        self.publisher = publisher
+        self.display_version = display_version
+        self.normalized_name = normalized_name
+        self.source = source
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class RegistryIndex:
+    """Persistent index of Uninstall subkeys, safe to share between threads.
+
+    Args:
+        path (Path): SQLite database file. Created if it doesn't exist.
+    """
+
+    def __init__(self, path: Path = DEFAULT_INDEX_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS uninstall_keys ("
+                "key TEXT NOT NULL, source TEXT NOT NULL, display_name TEXT NOT NULL, normalized_name TEXT NOT NULL, "
+                "publisher TEXT, display_version TEXT, imported_at REAL NOT NULL, "
+                "PRIMARY KEY (key, source))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS uninstall_keys_normalized_name ON uninstall_keys (normalized_name)")
+        self._entries = None
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def import_snapshot(self, path: Path) -> int:
+        """Replace the entries previously imported from snapshot 'path' with its current contents.
+
+        Returns:
+            int: number of Uninstall subkeys with a DisplayName imported
+        """
+        source = str(Path(path).resolve())
+        now = time.time()
+        rows = (
+            (key, source, values["DisplayName"], normalize_name(values["DisplayName"]), values.get("Publisher"), values.get("DisplayVersion"), now)
+            for key, values in iter_snapshot(path)
+            if values.get("DisplayName")
+        )
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM uninstall_keys WHERE source = ?", (source,))
+            count = self._db.executemany("INSERT OR REPLACE INTO uninstall_keys VALUES (?, ?, ?, ?, ?, ?, ?)", rows).rowcount
+            self._entries = None
+        return count
+
+    def _load(self) -> Tuple[Dict[str, List[UninstallEntry]], Dict[str, set], Dict[str, set], List[UninstallEntry]]:
+        # Loads every entry once, indexed by normalized name, by word and by trigram
+        with self._lock:
+            if self._entries is None:
+                rows = self._db.execute(
+                    "SELECT key, display_name, publisher, display_version, normalized_name, source FROM uninstall_keys ORDER BY imported_at DESC"
+                ).fetchall()
+                entries = [UninstallEntry(*row) for row in rows]
+                by_name = {}
+                by_word = {}
+                by_trigram = {}
+                for i, entry in enumerate(entries):
+                    by_name.setdefault(entry.normalized_name, []).append(entry)
+                    for word in entry.normalized_name.split():
+                        by_word.setdefault(word, set()).add(i)
+                    for trigram in name_trigrams(entry.normalized_name):
+                        by_trigram.setdefault(trigram, set()).add(i)
+                self._entries = (by_name, by_word, by_trigram, entries)
+            return self._entries
+
+    def lookup(self, name: str, publisher: str or None = None, cutoff: float = DEFAULT_CUTOFF, hive: str or None = None) -> List[UninstallEntry]:
+        """Return the entries best matching 'name', best first.
+
+        Exact matches after normalize_name are returned if there are any, then entries
+        containing every word of 'name' (fewest extra words first). Failing those, among the
+        entries sharing the most character trigrams with 'name', those at least 'cutoff' similar
+        to it (difflib ratio, ignoring spaces) are returned, so that typos ("Notpad++") and split
+        or joined words ("Win SCP", "WinSCP") still match. Among equally good matches, entries whose Publisher
+        contains 'publisher' come first.
+
+        Args:
+            name (str): application name, e.g. the catalog entry's name or DisplayName
+            publisher (str or None): e.g. the first part of the winget id
+            cutoff (float): minimum similarity of fuzzy matches, between 0 and 1
+            hive (str or None): only return keys in this hive, e.g. "HKEY_LOCAL_MACHINE"
+
+        Returns:
+            List[UninstallEntry]
+        """
+        by_name, by_word, by_trigram, entries = self._load()
+        normalized = normalize_name(name)
+        if not normalized:
+            return []
+        publisher = normalize_name(publisher) if publisher else None
+
+        def allowed(entry):
+            return hive is None or entry.key.startswith(hive + "\\")
+
+        def publisher_rank(entry):
+            return 0 if publisher and entry.publisher and publisher in normalize_name(entry.publisher) else 1
+
+        exact = [entry for entry in by_name.get(normalized, []) if allowed(entry)]
+        if exact:
+            return sorted(exact, key=publisher_rank)
+
+        words = set(normalized.split())
+        postings = sorted((by_word.get(word, set()) for word in words), key=len)
+
+        # Entries containing every word of the name, e.g. "putty" in "putty release".
+        # Intersecting from the rarest word keeps this cheap however common the other words are.
+        containing = set(postings[0])
+        for posting in postings[1:]:
+            containing &= posting
+        scored = []
+        for i in containing:
+            entry = entries[i]
+            if allowed(entry):
+                # Scores above any partial match, higher the fewer extra words there are
+                score = 1 + len(words) / len(entry.normalized_name.split())
+                scored.append((-score, publisher_rank(entry), entry.display_name, entry))
+
+        # Otherwise entries similar to the name, among those sharing the most trigrams with it
+        if not scored:
+            shared = Counter()
+            for trigram in name_trigrams(normalized):
+                shared.update(by_trigram.get(trigram, ()))
+            matcher = difflib.SequenceMatcher(b=normalized.replace(" ", ""))
+            for i, _ in shared.most_common(FUZZY_CANDIDATE_LIMIT):
+                entry = entries[i]
+                if not allowed(entry):
+                    continue
+                matcher.set_seq1(entry.normalized_name.replace(" ", ""))
+                if matcher.real_quick_ratio() < cutoff or matcher.quick_ratio() < cutoff:
+                    continue
+                score = matcher.ratio()
+                if score >= cutoff:
+                    scored.append((-score, publisher_rank(entry), entry.display_name, entry))
+        scored.sort(key=lambda item: item[:3])
+        return [entry for *_, entry in scored]
+
+
+def is_placeholder(value: str or None) -> bool:
+    """Return True if a catalog entry's display_name is missing or blank."""
+    return not value or not value.strip()
+
+
+def is_placeholder_key(value: str or None) -> bool:
+    """Return True if a catalog entry's registry_key is missing or not a HKEY_LOCAL_MACHINE key path,
+    like "this_does_not_exist, yet."."""
+    return is_placeholder(value) or not normalize_key(value.strip()).startswith("HKEY_LOCAL_MACHINE\\")
+
+
+def resolve_detection(applications: Iterable[dict], index: RegistryIndex, cutoff: float = DEFAULT_CUTOFF, on_unresolved=None) -> Iterator[dict]:
+    """Fill in placeholder registry_key and display_name values from 'index'.
+
+    Applications are looked up by their 'name' (or their winget id if they have none), with
+    the first part of the winget id as the preferred publisher. registry_key placeholders are
+    only filled with HKEY_LOCAL_MACHINE keys, which is what the detection scripts support.
+
+    Args:
+        applications (Iterable[dict]): application config entries
+        index (RegistryIndex)
+        cutoff (float): minimum similarity of fuzzy matches
+        on_unresolved (Callable[[dict], None] or None): called for every application with a
+            placeholder that couldn't be resolved. It is passed on unchanged.
+
+    Yields:
+        dict: application config entry
+    """
+    for application in applications:
+        if "registry_key" in application and is_placeholder_key(application["registry_key"]):
+            field, hive = "registry_key", "HKEY_LOCAL_MACHINE"
+        elif "display_name" in application and is_placeholder(application["display_name"]):
+            field, hive = "display_name", None
+        else:
+            yield application
+            continue
+
+        winget_id = application["winget_id"]
+        matches = index.lookup(application.get("name") or winget_id, publisher=winget_id.split(".")[0], cutoff=cutoff, hive=hive)
+        if not matches:
+            if on_unresolved is not None:
+                on_unresolved(application)
+            yield application
+            continue
+        match = matches[0]
+        yield dict(application, **{field: match.key if field == "registry_key" else match.display_name})
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(description="Import registry snapshots of reference machines into an index of Uninstall keys, and query it.")
+    parser.add_argument('--index', type=str, default=str(DEFAULT_INDEX_PATH), help=f"path to the index. Defaults to {DEFAULT_INDEX_PATH}")
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="import .reg files or JSON registry dumps, replacing earlier imports of the same files")
+    import_parser.add_argument('snapshots', type=str, nargs="+", help=".reg or .json files")
+    lookup_parser = commands.add_parser("lookup", help="print the Uninstall keys best matching a name")
+    lookup_parser.add_argument('name', type=str)
+    lookup_parser.add_argument('--publisher', type=str, default=None, help="prefer keys whose Publisher contains this")
+    lookup_parser.add_argument('--cutoff', type=float, default=DEFAULT_CUTOFF, help=f"minimum similarity of fuzzy matches. Defaults to {DEFAULT_CUTOFF}")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with RegistryIndex(Path(args.index)) as index:
+        if args.command == "import":
+            for snapshot in args.snapshots:
+                print(f"Imported {index.import_snapshot(Path(snapshot))} Uninstall keys from {snapshot}.")
+        else:
+            matches = index.lookup(args.name, publisher=args.publisher, cutoff=args.cutoff)
+            json.dump([match.to_dict() for match in matches], sys.stdout, indent=2)
+            print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+r"""serve.py
+
+Long-running generation server with a local job API, e.g.
+    python serve.py -o out --jobs 4
+    python intunify.py serve -o out --socket /run/intunify.sock
+
+Templates, the winget show cache, the build manifest and the packager are
+loaded once at startup and stay warm, so a job costs only the work of
+building its package.
+
+Jobs are submitted over HTTP on localhost (or a Unix socket with --socket)
+and run on a pool of --jobs workers:
+    POST /jobs              submit a job, returns 202 with the job. ?wait=SECONDS waits for it to finish first.
+    GET  /jobs              list jobs, oldest first
+    GET  /jobs/<id>         job status, timings, error and artifact paths
+    GET  /health            server status and queue depth
+
+A job is a catalog entry as accepted by the bulk generator, or a bundle, plus
+optional "show" and "force" flags, e.g.
+    {"winget_id": "Git.Git", "registry_key": "HKEY_LOCAL_MACHINE\\...\\Git_is1", "version": "2.37.3"}
+    {"bundle": "Developer tools", "members": [{"winget_id": "Git.Git", ...}, ...], "show": true}
+Uninstaller jobs take an entry as accepted by the bulk uninstaller generator, e.g.
+    {"type": "uninstaller", "name": "Google Chrome"}
+"""
+
+
+import itertools
+import json
+import os
+import socketserver
+import threading
+import time
+from argparse import ArgumentParser
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import intunify
+from build_manifest import BuildManifest
+from bulk_application_installer_generator import application_label, build_application
+from bulk_uninstaller_generator import build_uninstaller
+from catalog import validate_application, validate_uninstaller
+from intunify import get_packager_version, set_output_store, set_packager_backend, set_subprocess_limits, slugify, PACKAGER_BACKENDS, REGISTRY_VIEWS
+from templating import load_all_templates
+from winget_cache import DEFAULT_CACHE_PATH, DEFAULT_TTL_HOURS, WingetShowCache
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_HISTORY = 1000
+MAX_REQUEST_BYTES = 1024 * 1024
+
+JOB_TYPES = ("installer", "uninstaller")
+
+
+class Job:
+    """A generation request and its outcome."""
+
+    __slots__ = ("id", "type", "request", "status", "submitted_at", "started_at", "finished_at", "error", "artifacts", "future")
+
+    def __init__(self, id: str, type: str, request: dict):
+        self.id = id
+        self.type = type
+        self.request = request
+        self.status = "queued"
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.artifacts = []
+        self.future = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "type": self.type,
+            "status": self.status,
+            "request": self.request,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "wall_s": self.finished_at - self.started_at if self.finished else None,
+            "error": self.error,
+            "artifacts": self.artifacts,
+        }
+
+
+class JobQueue:
+    """Runs generation jobs on a pool of workers, keeping the status of the last 'history' finished jobs.
+
+    Jobs for the same package folder run one at a time; everything else runs concurrently. Workers
+    update job records under the queue's lock, so read them through describe and describe_all.
+
+    Args:
+        output_parent_directory (Path): folder packages are generated in
+        jobs (int): number of jobs to run at once
+        show_cache (WingetShowCache or None): cache for jobs requesting winget show output
+        options (dict or None): further keyword arguments passed on to generate_installer (e.g. fast_detection)
+        history (int): number of finished jobs to keep the status of
+    """
+
+    def __init__(self, output_parent_directory: Path, jobs: int = 4, show_cache=None, options: dict or None = None, history: int = DEFAULT_HISTORY):
+        self.output_parent_directory = Path(output_parent_directory).absolute()
+        self.output_parent_directory.mkdir(parents=True, exist_ok=True)
+        self.manifest = BuildManifest(self.output_parent_directory)
+        self.show_cache = show_cache
+        self.options = options or {}
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="intunify-job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._folder_locks = {}
+        self._ids = itertools.count(1)
+
+    def submit(self, request: dict) -> Job:
+        """Validate and queue a job request.
+
+        Raises:
+            ValueError: if the request is invalid
+        """
+        if not isinstance(request, dict):
+            raise ValueError("A job must be a JSON object.")
+        request = dict(request)
+        job_type = request.pop("type", "installer")
+        if job_type not in JOB_TYPES:
+            raise ValueError(f"'type' must be one of {', '.join(JOB_TYPES)}. Received: {job_type!r}")
+        for flag in ("show", "force"):
+            if not isinstance(request.get(flag, False), bool):
+                raise ValueError(f"'{flag}' must be true or false.")
+        application = {key: value for key, value in request.items() if key not in ("show", "force")}
+        if job_type == "uninstaller":
+            validate_uninstaller(application)
+        elif "members" in application:
+            if not application.get("bundle") or not isinstance(application["bundle"], str):
+                raise ValueError("A bundle must supply a 'bundle' name.")
+            if not isinstance(application["members"], list) or not application["members"]:
+                raise ValueError("A bundle must supply a non-empty 'members' array.")
+            for member in application["members"]:
+                validate_application(member)
+        else:
+            validate_application(application)
+
+        with self._lock:
+            job = Job(str(next(self._ids)), job_type, request)
+            self._jobs[job.id] = job
+            self._evict()
+        job.future = self._executor.submit(self._run, job, application)
+        return job
+
+    def _evict(self) -> None:
+        # Forget the oldest finished jobs beyond the history limit
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    @contextmanager
+    def _folder_lock(self, folder: Path):
+        # Holds the lock of 'folder', forgetting it once no job holds or waits for it
+        with self._lock:
+            entry = self._folder_locks.setdefault(folder, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._folder_locks[folder]
+
+    def _update(self, job: Job, **fields) -> None:
+        # Job records are read by the request handler threads, so they only change under the lock
+        with self._lock:
+            for name, value in fields.items():
+                setattr(job, name, value)
+
+    def _run(self, job: Job, application: dict) -> None:
+        if job.type == "uninstaller":
+            folder = self.output_parent_directory / slugify(application["name"])
+        elif "members" in application:
+            folder = self.output_parent_directory / slugify(application["bundle"])
+        else:
+            folder = self.output_parent_directory / slugify(application["winget_id"])
+        with self._folder_lock(folder):
+            started_at = time.time()
+            self._update(job, status="running", started_at=started_at)
+            error = None
+            artifacts = []
+            try:
+                if job.type == "uninstaller":
+                    built = build_uninstaller(
+                        application,
+                        self.output_parent_directory,
+                        manifest=self.manifest,
+                        force=job.request.get("force", False),
+                        fast=self.options.get("fast_detection", False),
+                        registry_view=self.options.get("registry_view", "both"),
+                        include_current_user=self.options.get("include_current_user", False),
+                    )
+                else:
+                    built = build_application(
+                        application,
+                        self.output_parent_directory,
+                        include_show_output=job.request.get("show", False),
+                        manifest=self.manifest,
+                        force=job.request.get("force", False),
+                        show_cache=self.show_cache,
+                        **self.options,
+                    )
+                if built:
+                    self.manifest.save()
+                else:
+                    error = "intunewin file was not generated"
+            except Exception as exc:
+                error = f"{type(exc).__name__}: {exc}"
+            if folder.is_dir():
+                artifacts = sorted(str(path) for path in folder.iterdir() if path.is_file())
+            finished_at = time.time()
+            status = "failed" if error else "succeeded"
+            self._update(job, status=status, finished_at=finished_at, error=error, artifacts=artifacts)
+        label = application["name"] if job.type == "uninstaller" else application_label(application)
+        print(f"Job {job.id} ({label}) {status} in {finished_at - started_at:.3f}s")
+
+    def get(self, job_id: str) -> Job or None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def describe(self, job: Job) -> dict:
+        """Return job.to_dict(), taken while no worker is updating the job."""
+        with self._lock:
+            return job.to_dict()
+
+    def describe_all(self) -> list:
+        """Return to_dict() of every job, oldest first."""
+        with self._lock:
+            return [job.to_dict() for job in self._jobs.values()]
+
+    def counts(self) -> dict:
+        counts = {"queued": 0, "running": 0, "succeeded": 0, "failed": 0}
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return counts
+
+    def shutdown(self) -> None:
+        """Wait for queued jobs to finish and save the build manifest."""
+        self._executor.shutdown(wait=True)
+        self.manifest.save()
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """Serves the job API of the JobQueue at self.server.job_queue."""
+
+    server_version = "intunify"
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def _send_json(self, status: int, body) -> None:
+        data = json.dumps(body, indent=2).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        queue = self.server.job_queue
+        path = urlsplit(self.path).path.rstrip("/")
+        if path == "/health":
+            self._send_json(200, {"status": "ok", "output_directory": str(queue.output_parent_directory), "jobs": queue.counts()})
+        elif path == "/jobs":
+            self._send_json(200, queue.describe_all())
+        elif path.startswith("/jobs/"):
+            job = queue.get(path[len("/jobs/"):])
+            if job is None:
+                self._send_json(404, {"error": "no such job"})
+            else:
+                self._send_json(200, queue.describe(job))
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path.rstrip("/") != "/jobs":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length > MAX_REQUEST_BYTES:
+                raise ValueError(f"Request body is larger than {MAX_REQUEST_BYTES} bytes.")
+            request = json.loads(self.rfile.read(length) or b"null")
+            wait = float(parse_qs(url.query).get("wait", ["0"])[0])
+            job = self.server.job_queue.submit(request)
+        except ValueError as exc:
+            self._send_json(400, {"error": str(exc)})
+            return
+        if wait > 0:
+            try:
+                job.future.result(timeout=wait)
+            except TimeoutError:
+                pass
+        job_status = self.server.job_queue.describe(job)
+        self._send_json(202 if job_status["finished_at"] is None else 200, job_status)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(job_queue: JobQueue, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, socket_path: str or None = None):
+    """Return a server for 'job_queue' on host:port, or on the Unix socket 'socket_path' if given."""
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, JobRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), JobRequestHandler)
+    server.job_queue = job_queue
+    return server
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(description="Serve a local job API generating intunewin apps, with templates and caches kept warm.")
+    parser.add_argument('-o', '--outfolder', type=str, required=True, help="path to place intunewin apps")
+    parser.add_argument('--host', type=str, default=DEFAULT_HOST, help=f"address to listen on. Defaults to {DEFAULT_HOST}")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"port to listen on. Defaults to {DEFAULT_PORT}")
+    parser.add_argument('--socket', type=str, default=None, help="listen on this Unix socket instead of host:port")
+    parser.add_argument('-j', '--jobs', type=int, default=4, help="number of jobs to run at once. Defaults to 4")
+    parser.add_argument('--packager-jobs', type=int, default=None, help="maximum number of concurrent IntuneWinAppUtil.exe processes. Defaults to --jobs.")
+    parser.add_argument('--winget-jobs', type=int, default=None, help="maximum number of concurrent winget.exe processes. Defaults to --jobs.")
+    parser.add_argument('--history', type=int, default=DEFAULT_HISTORY, help=f"number of finished jobs to keep the status of. Defaults to {DEFAULT_HISTORY}")
+    parser.add_argument('--fast-detection', action="store_true", default=False, help="for applications detected by display_name, generate detection and uninstall scripts that read only the DisplayName value of each Uninstall key and stop at the first match")
+    parser.add_argument('--registry-view', choices=REGISTRY_VIEWS, default="both", help="with --fast-detection, which bitness of the HKLM Uninstall keys to search. Defaults to both.")
+    parser.add_argument('--current-user', action="store_true", default=False, help="with --fast-detection, also search the HKCU Uninstall keys")
+    parser.add_argument('--match-version', action="store_true", default=False, help="with --fast-detection, only detect installations whose DisplayVersion equals the application's pinned version")
+    parser.add_argument('--cache', type=str, default=str(DEFAULT_CACHE_PATH), help=f"path to the winget show cache. Defaults to {DEFAULT_CACHE_PATH}")
+    parser.add_argument('--cache-ttl', type=float, default=DEFAULT_TTL_HOURS, help=f"hours before cached winget show output expires. Defaults to {DEFAULT_TTL_HOURS}")
+    parser.add_argument('--winget', type=str, default=None, help="path to the winget executable (or a stand-in). Defaults to winget.exe on the path")
+    parser.add_argument('--packager', choices=PACKAGER_BACKENDS, default=None, help="build intunewin files in-process (native), with IntuneWinAppUtil.exe (external) or native if available (auto). Defaults to auto.")
+    parser.add_argument('--store', type=str, default=None, help="path to a content-addressed store to write generated files into")
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    set_subprocess_limits(
+        packager_jobs=args.packager_jobs or args.jobs,
+        winget_jobs=args.winget_jobs or args.jobs,
+    )
+    if args.winget:
+        intunify.WINGET_EXECUTABLE = args.winget
+    if args.packager:
+        set_packager_backend(args.packager)
+    if args.store:
+        set_output_store(Path(args.store))
+
+    # Warm up everything a job would otherwise load on first use
+    load_all_templates()
+    get_packager_version()
+
+    show_cache = WingetShowCache(Path(args.cache), ttl=args.cache_ttl * 3600)
+    job_queue = JobQueue(
+        Path(args.outfolder),
+        jobs=args.jobs,
+        show_cache=show_cache,
+        options=dict(fast_detection=args.fast_detection, registry_view=args.registry_view, include_current_user=args.current_user, match_version=args.match_version),
+        history=args.history,
+    )
+    server = make_server(job_queue, args.host, args.port, args.socket)
+    print(f"Serving jobs on {args.socket or f'http://{args.host}:{server.server_address[1]}'}, writing to {job_queue.output_parent_directory}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        job_queue.shutdown()
+        show_cache.close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
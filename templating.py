@@ -0,0 +1,171 @@
+"""templating.py
+
+Loads the script templates in _installer_template and _uninstaller_template.
+
+Templates mark the values to fill in with placeholder GUIDs. Each template is
+read from disk once per process, checked against the placeholders it is
+declared to contain and split into literal and placeholder segments, so that
+rendering is a single pass over the template regardless of how many values
+are substituted.
+"""
+
+
+import re
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, TextIO
+
+
+# Placeholder GUIDs used by the bundled templates
+WINGET_ID_TO_REPLACE = "a369b91c-188f-4adc-899b-3a47d38c3ce7"
+PATH_TO_REPLACE = "5e56c978-80c2-4369-aafb-037cab7dda93"
+VERSION_TO_REPLACE = "de6a4f36-0b0c-46de-b491-36960cbcee2d"
+REGISTRY_DISPLAY_NAME_TO_REPLACE = "188e7e89-6fe4-44f0-8302-08972f8a6a34"
+REGISTRY_LOCATIONS_TO_REPLACE = "ece58068-a5f8-4155-b74a-a07cbf205748"
+DISPLAY_VERSION_TO_REPLACE = "9600098c-4df9-4bd2-88d6-206903935d59"
+BUNDLE_NAME_TO_REPLACE = "8240412e-b589-4849-89ea-f3bae2aaf524"
+BUNDLE_MEMBERS_TO_REPLACE = "bf2271ea-7351-482f-a286-c805e9349db6"
+BUNDLE_WINGET_IDS_TO_REPLACE = "f59a2b7e-921f-486d-9095-27bfbd9c1256"
+INSTALL_OPTIONS_TO_REPLACE = "2b8a6e44-a476-4ce5-ac24-8136578a43de"
+
+# The uninstaller templates use the installer's winget id GUID for the DisplayName
+DISPLAY_NAME_TO_REPLACE = WINGET_ID_TO_REPLACE
+
+PLACEHOLDER_PATTERN = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+INSTALLER_TEMPLATES_DIR = SCRIPT_DIR / "_installer_template"
+UNINSTALLER_TEMPLATES_DIR = SCRIPT_DIR / "_uninstaller_template"
+
+# The placeholders each bundled template is expected to contain, checked when it is loaded
+DECLARED_PLACEHOLDERS = {
+    INSTALLER_TEMPLATES_DIR: {
+        "README.template": {WINGET_ID_TO_REPLACE},
+        "install.template": {WINGET_ID_TO_REPLACE, VERSION_TO_REPLACE, INSTALL_OPTIONS_TO_REPLACE},
+        "detect.template": {WINGET_ID_TO_REPLACE},
+        "uninstall.template": {WINGET_ID_TO_REPLACE},
+        "known_display_name_detect.template": {REGISTRY_DISPLAY_NAME_TO_REPLACE},
+        "known_display_name_uninstall.template": {REGISTRY_DISPLAY_NAME_TO_REPLACE},
+        "fast_display_name_detect.template": {REGISTRY_DISPLAY_NAME_TO_REPLACE, REGISTRY_LOCATIONS_TO_REPLACE, DISPLAY_VERSION_TO_REPLACE},
+        "fast_display_name_uninstall.template": {REGISTRY_DISPLAY_NAME_TO_REPLACE, REGISTRY_LOCATIONS_TO_REPLACE, DISPLAY_VERSION_TO_REPLACE},
+        "known_key_detect.template": {PATH_TO_REPLACE},
+        "known_key_uninstall.template": {PATH_TO_REPLACE},
+        "bundle_README.template": {BUNDLE_NAME_TO_REPLACE, BUNDLE_WINGET_IDS_TO_REPLACE},
+        "bundle_install.template": {BUNDLE_NAME_TO_REPLACE, BUNDLE_MEMBERS_TO_REPLACE, INSTALL_OPTIONS_TO_REPLACE},
+        "bundle_detect.template": {BUNDLE_NAME_TO_REPLACE, BUNDLE_MEMBERS_TO_REPLACE, REGISTRY_LOCATIONS_TO_REPLACE},
+        "bundle_uninstall.template": {BUNDLE_NAME_TO_REPLACE, BUNDLE_MEMBERS_TO_REPLACE},
+    },
+    UNINSTALLER_TEMPLATES_DIR: {
+        "README.template": {DISPLAY_NAME_TO_REPLACE},
+        "detect.template": {DISPLAY_NAME_TO_REPLACE},
+        "uninstall.template": {DISPLAY_NAME_TO_REPLACE},
+        "fast_detect.template": {DISPLAY_NAME_TO_REPLACE, REGISTRY_LOCATIONS_TO_REPLACE, DISPLAY_VERSION_TO_REPLACE},
+        "fast_uninstall.template": {DISPLAY_NAME_TO_REPLACE, REGISTRY_LOCATIONS_TO_REPLACE, DISPLAY_VERSION_TO_REPLACE},
+        "known_key_detect.template": {PATH_TO_REPLACE},
+        "known_key_uninstall.template": {PATH_TO_REPLACE},
+    },
+}
+
+
+class TemplateError(ValueError):
+    """Raised when a template's placeholders don't match its declaration or the values supplied."""
+
+
+class Template:
+    """A template split into literal text and placeholder segments.
+
+    Args:
+        path (Path): template file path
+        placeholders (Iterable[str] or None): placeholders the template must contain. If None,
+            every placeholder-shaped GUID found in the template is treated as a placeholder.
+    """
+
+    def __init__(self, path: Path, placeholders: Iterable[str] or None = None):
+        self.path = Path(path)
+        with open(self.path, "r") as f:
+            text = f.read()
+
+        found = set(PLACEHOLDER_PATTERN.findall(text))
+        if placeholders is None:
+            placeholders = found
+        placeholders = set(placeholders)
+        unknown = found - placeholders
+        if unknown:
+            raise TemplateError(f"{self.path} contains unknown placeholders: {', '.join(sorted(unknown))}")
+        unused = placeholders - found
+        if unused:
+            raise TemplateError(f"{self.path} does not contain declared placeholders: {', '.join(sorted(unused))}")
+        self.placeholders = frozenset(placeholders)
+
+        # re.split with a capturing group alternates literal text (even indices)
+        # and placeholders (odd indices)
+        if placeholders:
+            pattern = re.compile("(" + "|".join(re.escape(p) for p in sorted(placeholders)) + ")")
+            self._segments = pattern.split(text)
+        else:
+            self._segments = [text]
+
+    def _iter_render(self, values: Dict[str, str]) -> Iterator[str]:
+        missing = self.placeholders - values.keys()
+        if missing:
+            raise TemplateError(f"No value supplied for placeholders {', '.join(sorted(missing))} of {self.path}")
+        for i, segment in enumerate(self._segments):
+            yield values[segment] if i % 2 else segment
+
+    def render(self, values: Dict[str, str]) -> str:
+        """Return the template text with every placeholder replaced by its value.
+
+        Args:
+            values (Dict[str, str]): placeholder -> replacement. Values for placeholders
+                the template doesn't contain are ignored.
+
+        Returns:
+            str
+        """
+        return "".join(self._iter_render(values))
+
+    def render_to(self, f: TextIO, values: Dict[str, str]) -> None:
+        """Write the rendered template to an open text file without building the whole string first."""
+        f.writelines(self._iter_render(values))
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_template(path: Path) -> Template:
+    """Return the loaded template at 'path', reading it from disk on first use only.
+
+    Bundled templates are validated against DECLARED_PLACEHOLDERS.
+
+    Args:
+        path (Path): template file path
+
+    Returns:
+        Template
+    """
+    path = Path(path)
+    template = _cache.get(path)
+    if template is None:
+        with _cache_lock:
+            template = _cache.get(path)
+            if template is None:
+                resolved = path.resolve()
+                declared = DECLARED_PLACEHOLDERS.get(resolved.parent, {}).get(resolved.name)
+                template = _cache[path] = Template(path, declared)
+    return template
+
+
+def load_all_templates() -> Dict[Path, Template]:
+    """Load and validate every bundled template, raising TemplateError on the first mismatch.
+
+    Returns:
+        Dict[Path, Template]: template file path -> template
+    """
+    templates = {}
+    for directory, declarations in DECLARED_PLACEHOLDERS.items():
+        for path in sorted(directory.glob("*.template")):
+            if path.name not in declarations:
+                raise TemplateError(f"{path} has no placeholder declaration")
+            templates[path] = get_template(path)
+    return templates
@@ -0,0 +1,67 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import intunify
+from benchmark import PACKAGER_STUB, WINGET_STUB
+
+
+@pytest.fixture
+def stub_tools(tmp_path, monkeypatch):
+    """Put IntuneWinAppUtil.exe and winget.exe stand-ins first on the path and package with them."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name, script in [("IntuneWinAppUtil.exe", PACKAGER_STUB), ("winget.exe", WINGET_STUB)]:
+        path = bin_dir / name
+        path.write_text(script)
+        path.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{intunify.os.pathsep}{intunify.os.environ.get('PATH', '')}")
+    monkeypatch.setattr(intunify, "WINGET_EXECUTABLE", str(bin_dir / "winget.exe"))
+    monkeypatch.setattr(intunify, "PACKAGER_BACKEND", "external")
+    intunify.get_packager_version.cache_clear()
+    yield bin_dir
+    intunify.get_packager_version.cache_clear()
+
+
+def write_winget_manifest(repository, package_id, version, name=None, product_code=None):
+    """Write a singleton manifest for one package version to a winget-pkgs style checkout.
+
+    Returns:
+        Path: the version folder
+    """
+    publisher, package = package_id.split(".", 1)
+    folder = repository / "manifests" / package_id[0].lower() / publisher / package / version
+    folder.mkdir(parents=True, exist_ok=True)
+    lines = [
+        f"PackageIdentifier: {package_id}",
+        f"PackageVersion: {version}",
+        f"PackageName: {name or package}",
+        f"Publisher: {publisher}",
+        f"ShortDescription: {package} {version}",
+        "Installers:",
+        "  - Architecture: x64",
+        "    InstallerType: exe",
+        f"    InstallerUrl: https://example.com/{package}-{version}.exe",
+    ]
+    if product_code:
+        lines.append(f"    ProductCode: '{product_code}'")
+    lines += ["ManifestType: singleton", "ManifestVersion: 1.6.0"]
+    (folder / f"{package_id}.yaml").write_text("\n".join(lines) + "\n")
+    return folder
+
+
+@pytest.fixture
+def winget_manifests(tmp_path):
+    """Return a function writing a package version to a winget-pkgs style checkout in tmp_path / "winget-pkgs"."""
+    pytest.importorskip("yaml")
+    repository = tmp_path / "winget-pkgs"
+
+    def write(package_id, version, name=None, product_code=None):
+        return write_winget_manifest(repository, package_id, version, name, product_code)
+
+    write.repository = repository
+    return write
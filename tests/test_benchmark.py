@@ -0,0 +1,16 @@
+import json
+import subprocess
+import sys
+
+from conftest import ROOT
+
+
+def test_every_case_reports_the_peak_rss_of_its_own_worker(tmp_path):
+    output = tmp_path / "bench.json"
+    subprocess.run([sys.executable, str(ROOT / "benchmark.py"), "--sizes", "3", "5", "--jobs", "2", "-o", str(output)], check=True, capture_output=True)
+    results = json.loads(output.read_text())
+    assert results["environment"]["jobs"] == 2
+    assert [case["apps"] for case in results["cases"]] == [3, 5]
+    for case in results["cases"]:
+        assert case["stages"]["bulk_cold"]["count"] == case["apps"]
+        assert 0 < case["peak_rss_children_kb"] <= case["peak_rss_kb"]
@@ -0,0 +1,43 @@
+from create_installer import generate_installer
+
+
+GIT_KEY = r"HKEY_LOCAL_MACHINE\SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall\Git_is1"
+
+
+class FakeShowCache:
+    """Stands in for a WingetShowCache, returning canned winget show output."""
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+
+    def get(self, winget_id, source=None):
+        return self.outputs.get(winget_id)
+
+
+def show_output(version):
+    return f"Found Git [Git.Git]\r\nVersion: {version}\r\n"
+
+
+def build(output, show_cache):
+    return generate_installer("Git.Git", registry_key=GIT_KEY, output_parent_directory=output, include_show_output=True, show_cache=show_cache)
+
+
+def test_unchanged_application_is_skipped(tmp_path, stub_tools):
+    output = tmp_path / "out"
+    show_cache = FakeShowCache({"Git.Git": show_output("2.40.0")})
+    assert build(output, show_cache)
+    details = output / "Git.Git" / "package_details.yaml"
+    details.unlink()
+
+    assert build(output, show_cache)
+    assert not details.exists()
+
+
+def test_upstream_version_bump_rebuilds_package_details(tmp_path, stub_tools):
+    output = tmp_path / "out"
+    show_cache = FakeShowCache({"Git.Git": show_output("2.40.0")})
+    assert build(output, show_cache)
+
+    show_cache.outputs["Git.Git"] = show_output("2.41.0")
+    assert build(output, show_cache)
+    assert "Version: 2.41.0" in (output / "Git.Git" / "package_details.yaml").read_text()
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+import bulk_application_installer_generator as bulk
+import intunify
+from benchmark import PACKAGER_STUB, WINGET_STUB
+from conftest import ROOT
+
+
+# Prepended to the stand-ins: count the processes of the same tool running at once
+COUNT_RUNNING = '''#!/bin/sh
+running="$INTUNIFY_STUB_RUNNING/$(basename "$0")"
+mkdir -p "$running"
+touch "$running/$$"
+ls "$running" | wc -l >> "$running.log"
+'''
+
+
+@pytest.fixture
+def counting_tools(stub_tools, tmp_path, monkeypatch):
+    """stub_tools that log how many processes of their tool are running whenever one starts."""
+    running = tmp_path / "running"
+    for name, script in [("IntuneWinAppUtil.exe", PACKAGER_STUB), ("winget.exe", WINGET_STUB)]:
+        (stub_tools / name).write_text(script.replace("#!/bin/sh\n", COUNT_RUNNING) + 'rm "$running/$$"\n')
+    monkeypatch.setenv("INTUNIFY_STUB_RUNNING", str(running))
+    monkeypatch.setenv("INTUNIFY_STUB_LATENCY", "0.05")
+
+    def peak(name):
+        return max(int(line) for line in (running / f"{name}.log").read_text().split())
+
+    return peak
+
+
+def run_bulk(tmp_path, capsys, output, *argv):
+    with intunify.preserved_settings():
+        bulk.main(["-i", str(ROOT / "example.json"), "-o", str(tmp_path / output), "--cache", str(tmp_path / "cache.sqlite3"), *argv])
+    return capsys.readouterr().out.replace(str(tmp_path / output), "<output>")
+
+
+def read_tree(folder):
+    # The journal and build manifest record timings and absolute paths
+    return {
+        path.relative_to(folder).as_posix(): path.read_bytes()
+        for path in sorted(folder.rglob("*"))
+        if path.is_file() and not path.name.startswith(".")
+    }
+
+
+def test_parallel_build_matches_serial_build(tmp_path, counting_tools, capsys):
+    serial = run_bulk(tmp_path, capsys, "serial", "--jobs", "1")
+    parallel = run_bulk(tmp_path, capsys, "parallel", "--jobs", "4")
+    assert parallel == serial
+    assert "Built 24 of 24 applications, 0 failed." in serial
+    serial_tree = read_tree(tmp_path / "serial")
+    assert len([name for name in serial_tree if name.endswith("/install.intunewin")]) == len(json.loads((ROOT / "example.json").read_text()))
+    assert read_tree(tmp_path / "parallel") == serial_tree
+    assert counting_tools("IntuneWinAppUtil.exe") > 1
+
+
+def test_subprocess_limits_cap_concurrency(tmp_path, counting_tools, capsys):
+    out = run_bulk(tmp_path, capsys, "out", "--jobs", "6", "--packager-jobs", "2", "--winget-jobs", "1", "--show", "--refresh")
+    assert "Built 24 of 24 applications, 0 failed." in out
+    assert counting_tools("IntuneWinAppUtil.exe") <= 2
+    assert counting_tools("winget.exe") == 1
+    assert (tmp_path / "out" / "Google.Chrome" / "package_details.yaml").exists()
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+import bulk_application_installer_generator as bulk
+import intunify
+from catalog import group_bundles
+from create_installer import bundle_member_data, generate_bundle_installer
+
+
+GIT = {"winget_id": "Git.Git", "registry_key": "HKEY_LOCAL_MACHINE\\SOFTWARE\\Git_is1", "version": "2.40.0"}
+PUTTY = {"winget_id": "PuTTY.PuTTY", "file_path": "C:\\Program Files\\PuTTY\\putty.exe"}
+NOTEPAD = {"winget_id": "Notepad++.Notepad++", "display_name": "Notepad++ (64-bit x64)", "version": "8.5"}
+
+
+def test_group_bundles():
+    applications = [
+        dict(GIT, bundle="Dev tools"),
+        {"winget_id": "Google.Chrome", "registry_key": "HKEY_LOCAL_MACHINE\\SOFTWARE\\Chrome"},
+        dict(PUTTY, bundle="Admin tools"),
+        dict(NOTEPAD, bundle="Dev tools"),
+        {"winget_id": "Mozilla.Firefox", "registry_key": "HKEY_LOCAL_MACHINE\\SOFTWARE\\Firefox"},
+    ]
+    grouped = list(group_bundles(iter(applications)))
+    # Unbundled applications come first, as they arrive, then the bundles in the order they first appeared
+    assert [entry.get("winget_id") or entry["bundle"] for entry in grouped] == ["Google.Chrome", "Mozilla.Firefox", "Dev tools", "Admin tools"]
+    assert [member["winget_id"] for member in grouped[2]["members"]] == ["Git.Git", "Notepad++.Notepad++"]
+
+
+def test_bundle_member_data():
+    assert bundle_member_data([GIT, NOTEPAD]).split("\n") == [
+        "Git.Git\t2.40.0\tHKEY_LOCAL_MACHINE\\SOFTWARE\\Git_is1\t\t\t",
+        "Notepad++.Notepad++\t8.5\t\t\tNotepad++ (64-bit x64)\t",
+    ]
+    # Only display_name members are matched on their version
+    assert bundle_member_data([GIT, NOTEPAD], match_version=True).split("\n")[1].endswith("\tNotepad++ (64-bit x64)\t8.5")
+    assert bundle_member_data([GIT], match_version=True).endswith("\t")
+
+    with pytest.raises(ValueError, match="tab or line break"):
+        bundle_member_data([dict(PUTTY, file_path="C:\\Program Files\\PuTTY\tputty.exe")])
+    with pytest.raises(ValueError, match="exactly one of"):
+        bundle_member_data([dict(PUTTY, display_name="PuTTY")])
+
+
+def test_generate_bundle_installer(tmp_path, stub_tools):
+    output = tmp_path / "out"
+    assert generate_bundle_installer("Dev tools", [GIT, PUTTY], output_parent_directory=output)
+    folder = output / "Dev_tools"
+    assert sorted(path.name for path in folder.iterdir()) == ["README.md", "detect.ps1", "install.intunewin", "install.ps1", "uninstall.ps1"]
+    install = (folder / "install.ps1").read_text()
+    assert "Installing bundle Dev tools" in install
+    assert bundle_member_data([GIT, PUTTY]).replace("HKEY_LOCAL_MACHINE", "HKLM:") in install
+    assert "* Git.Git\n* PuTTY.PuTTY" in (folder / "README.md").read_text()
+
+    # An unchanged bundle is skipped...
+    (folder / "install.ps1").unlink()
+    assert generate_bundle_installer("Dev tools", [GIT, PUTTY], output_parent_directory=output)
+    assert not (folder / "install.ps1").exists()
+    # ...and changing a member rebuilds it
+    assert generate_bundle_installer("Dev tools", [GIT, dict(PUTTY, version="0.80")], output_parent_directory=output)
+    assert "PuTTY.PuTTY\t0.80\t" in (folder / "install.ps1").read_text()
+
+    with pytest.raises(ValueError, match="has no members"):
+        generate_bundle_installer("Empty", [], output_parent_directory=output)
+
+
+def test_bulk_builds_a_bundle_as_one_package(tmp_path, stub_tools, capsys):
+    catalog = tmp_path / "catalog.jsonl"
+    catalog.write_text("".join(json.dumps(entry) + "\n" for entry in [dict(GIT, bundle="Dev tools"), PUTTY, dict(NOTEPAD, bundle="Dev tools")]))
+    with intunify.preserved_settings():
+        bulk.main(["-i", str(catalog), "-o", str(tmp_path / "out")])
+    assert "Built 2 of 2 applications, 0 failed." in capsys.readouterr().out
+    assert sorted(path.name for path in (tmp_path / "out").iterdir() if not path.name.startswith(".")) == ["Dev_tools", "PuTTY.PuTTY"]
+    assert "Notepad++.Notepad++\t8.5" in (tmp_path / "out" / "Dev_tools" / "install.ps1").read_text()
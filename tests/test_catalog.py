@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+import catalog
+from catalog import CatalogError, iter_applications, iter_catalog
+
+
+def write(tmp_path, text, name="catalog.json"):
+    path = tmp_path / name
+    path.write_text(text)
+    return path
+
+
+def records(path):
+    return [(line, record if not isinstance(record, CatalogError) else str(record)) for line, record in iter_catalog(path)]
+
+
+def applications(path):
+    errors = []
+    valid = list(iter_applications(iter_catalog(path), on_error=errors.append))
+    return valid, [(error.line, str(error)) for error in errors]
+
+
+@pytest.mark.parametrize("read_size", [1, 2, 3, 7, 64 * 1024])
+def test_array_objects_straddling_read_chunks(tmp_path, monkeypatch, read_size):
+    monkeypatch.setattr(catalog, "READ_SIZE", read_size)
+    entries = [
+        {"winget_id": "Git.Git", "registry_key": "HKEY_LOCAL_MACHINE\\SOFTWARE\\Git_is1", "version": "2.40.0"},
+        {"winget_id": "PuTTY.PuTTY", "file_path": "C:\\Program Files\\PuTTY", "size": 12345},
+        {"winget_id": "Notepad++.Notepad++", "display_name": "Notepad++ (64-bit x64)", "pinned": True},
+    ]
+    path = write(tmp_path, json.dumps(entries, indent=4))
+    assert [record for _, record in iter_catalog(path)] == entries
+
+
+def test_array_number_at_end_of_chunk(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "READ_SIZE", 4)
+    path = write(tmp_path, "[1234567, 89]")
+    assert [record for _, record in iter_catalog(path)] == [1234567, 89]
+
+
+def test_array_strings_with_brackets_commas_and_escaped_quotes(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "READ_SIZE", 5)
+    entries = [
+        {"winget_id": "Weird.App", "display_name": "App ], [with] \"quotes\", and, commas"},
+        {"winget_id": "Other.App", "display_name": "\\\"]"},
+    ]
+    path = write(tmp_path, json.dumps(entries))
+    assert [record for _, record in iter_catalog(path)] == entries
+
+
+def test_array_records_report_the_line_they_start_on(tmp_path):
+    path = write(tmp_path, '\n[\n  {"winget_id": "A.A",\n   "file_path": "a"},\n\n  {"winget_id": "B.B", "file_path": "b"}\n]\n')
+    assert [line for line, _ in iter_catalog(path)] == [3, 6]
+
+
+def test_array_validation_errors_have_line_numbers(tmp_path, monkeypatch):
+    monkeypatch.setattr(catalog, "READ_SIZE", 3)
+    path = write(tmp_path, "\n".join([
+        "[",
+        '  {"winget_id": "A.A", "file_path": "a"},',
+        '  {"file_path": "b"},',
+        '  {"winget_id": "C.C",',
+        '   "file_path": "c", "display_name": "C"},',
+        '  "not an object",',
+        '  {"winget_id": "E.E", "display_name": "E"}',
+        "]",
+    ]))
+    valid, errors = applications(path)
+    assert [application["winget_id"] for application in valid] == ["A.A", "E.E"]
+    assert [line for line, _ in errors] == [3, 4, 6]
+    assert errors[0][1] == "line 3: All applications must supply a valid 'winget_id' key"
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('[\n  {"winget_id": "A.A", "file_path": "a"}', "line 2: unexpected end of file, expected ']'"),
+    ('[\n  {"winget_id": "A.A", "file_path": "a"},\n', "line 3: unexpected end of file, expected a value"),
+    ('[\n  {"winget_id": "A.A", "file_path": "a"},\n  {"winget_id": "B.', "line 3: invalid JSON"),
+    ('[\n  {"winget_id": "A.A", "file_path": "a"}\n  {"winget_id": "B.B"}\n]', "line 3: expected ',' or ']', found '{'"),
+])
+def test_truncated_or_malformed_array(tmp_path, monkeypatch, text, expected):
+    monkeypatch.setattr(catalog, "READ_SIZE", 4)
+    result = records(write(tmp_path, text))
+    assert result[0] == (2, {"winget_id": "A.A", "file_path": "a"})
+    assert len(result) == 2
+    assert result[1][1].startswith(expected)
+
+
+def test_empty_catalogs(tmp_path):
+    assert records(write(tmp_path, " [ ] ")) == []
+    assert records(write(tmp_path, "\n\n")) == []
+
+
+def test_json_lines_with_blank_lines(tmp_path):
+    path = write(tmp_path, "\n".join([
+        "",
+        "   ",
+        '{"winget_id": "A.A", "file_path": "a"}',
+        "",
+        '{"winget_id": "B.B", "display_name": "B"}',
+        "{not json",
+        "\t",
+        '{"winget_id": "D.D"}',
+        '{"winget_id": "E.E", "registry_key": "HKEY_LOCAL_MACHINE\\\\SOFTWARE\\\\E"}',
+        "",
+    ]), name="catalog.jsonl")
+    valid, errors = applications(path)
+    assert [application["winget_id"] for application in valid] == ["A.A", "B.B", "E.E"]
+    assert [line for line, _ in errors] == [6, 8]
+    assert errors[0][1].startswith("line 6: invalid JSON")
+    assert [line for line, record in iter_catalog(path) if not isinstance(record, CatalogError)] == [3, 5, 8, 9]
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+import bulk_application_installer_generator as bulk
+import content_store
+import intunify
+from content_store import ContentStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ContentStore(tmp_path / "store")
+
+
+def test_identical_files_are_stored_once(tmp_path, store):
+    first, second = tmp_path / "first.ps1", tmp_path / "second.ps1"
+    assert store.write_text(first, "winget install Git.Git\n") > 0
+    assert store.write_text(second, "winget install Git.Git\n") == 0
+    assert os.path.samefile(first, second)
+    assert first.stat().st_nlink == 3
+    assert len(list(store.objects.rglob("*"))) == 2  # one object and its fan-out directory
+
+    # The same text in another encoding is another file
+    path, written = store.put_text("winget install Git.Git\n", "utf-16")
+    assert written > 0 and not os.path.samefile(path, first)
+
+
+def test_files_are_replaced_rather_than_written_through(tmp_path, store):
+    first, second = tmp_path / "first.ps1", tmp_path / "second.ps1"
+    store.write_text(first, "old\n")
+    store.write_text(second, "old\n")
+    store.write_text(first, "new\n")
+    assert (first.read_text(), second.read_text()) == ("new\n", "old\n")
+    # Writing the same content again keeps the link
+    inode = first.stat().st_ino
+    store.write_text(first, "new\n")
+    assert first.stat().st_ino == inode
+
+
+def test_files_are_copied_where_links_fail(tmp_path, store, monkeypatch):
+    def link(source, destination):
+        raise OSError("Invalid cross-device link")
+
+    monkeypatch.setattr(content_store.os, "link", link)
+    destination = tmp_path / "install.ps1"
+    store.write_text(destination, "winget install Git.Git\n")
+    assert destination.read_text() == "winget install Git.Git\n"
+    assert destination.stat().st_nlink == 1
+    assert [path.name for path in tmp_path.iterdir() if path.name.endswith(".tmp")] == []
+
+
+def test_write_text_file_goes_through_the_output_store(tmp_path):
+    with intunify.preserved_settings():
+        intunify.set_output_store(tmp_path / "store")
+        intunify.write_text_file(tmp_path / "a.txt", "same\n")
+        intunify.write_text_file(tmp_path / "b.txt", "same\n")
+    assert os.path.samefile(tmp_path / "a.txt", tmp_path / "b.txt")
+    assert intunify._output_store is None
+
+    # Without the store, a linked file is unlinked before it is written
+    intunify.write_text_file(tmp_path / "a.txt", "changed\n")
+    assert (tmp_path / "b.txt").read_text() == "same\n"
+    assert (tmp_path / "a.txt").stat().st_nlink == 1
+
+
+def test_bulk_store_links_identical_files(tmp_path, stub_tools, capsys):
+    catalog = tmp_path / "catalog.jsonl"
+    catalog.write_text('{"winget_id": "Git.Git", "registry_key": "HKEY_LOCAL_MACHINE\\\\SOFTWARE\\\\Git_is1"}\n')
+    with intunify.preserved_settings():
+        bulk.main(["-i", str(catalog), "-o", str(tmp_path / "out"), "--tenants", "contoso", "fabrikam", "--store", str(tmp_path / "store")])
+    assert "0 failed." in capsys.readouterr().out
+    # The tenants' files are identical, so each is stored once and linked into both trees
+    contoso, fabrikam = tmp_path / "out" / "contoso-machine" / "Git.Git", tmp_path / "out" / "fabrikam-machine" / "Git.Git"
+    for name in ("README.md", "install.ps1", "detect.ps1", "uninstall.ps1"):
+        assert os.path.samefile(contoso / name, fabrikam / name)
+    assert not os.path.samefile(contoso / "install.ps1", contoso / "detect.ps1")
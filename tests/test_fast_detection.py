@@ -0,0 +1,110 @@
+import re
+
+import pytest
+
+from create_installer import generate_installer, render_installer
+from create_uninstaller import generate_uninstaller, render_uninstaller
+from variants import Variant
+
+
+LOCATIONS = {
+    ("both", False): "LocalMachine:Registry64,LocalMachine:Registry32",
+    ("both", True): "LocalMachine:Registry64,LocalMachine:Registry32,CurrentUser:Default",
+    ("64", False): "LocalMachine:Registry64",
+    ("64", True): "LocalMachine:Registry64,CurrentUser:Default",
+    ("32", False): "LocalMachine:Registry32",
+    ("32", True): "LocalMachine:Registry32,CurrentUser:Default",
+}
+
+
+def assignments(script):
+    """Return the values of the single-quoted variables a fast detection script starts with, unescaped."""
+    values = {}
+    for name, value in re.findall(r"^\$(\w+) = '((?:[^']|'')*)'", script, re.MULTILINE):
+        values[name] = value.replace("''", "'")
+    return values
+
+
+def installer_scripts(**kwargs):
+    [package] = render_installer("Notepad++.Notepad++", display_name=kwargs.pop("display_name", "Notepad++ (64-bit x64)"), fast_detection=True, **kwargs)
+    return package.files["detect.ps1"], package.files["uninstall.ps1"]
+
+
+def uninstaller_scripts(name="Notepad++ (64-bit x64)", **kwargs):
+    package = render_uninstaller(name, fast=True, **kwargs)
+    return package.files["detect.ps1"], package.files["uninstall.ps1"]
+
+
+@pytest.mark.parametrize("scripts", [installer_scripts, uninstaller_scripts])
+@pytest.mark.parametrize("registry_view, include_current_user", sorted(LOCATIONS))
+def test_locations(scripts, registry_view, include_current_user):
+    for script in scripts(registry_view=registry_view, include_current_user=include_current_user):
+        values = assignments(script)
+        assert values["Locations"] == LOCATIONS[registry_view, include_current_user]
+        assert values["DisplayName"] == "Notepad++ (64-bit x64)"
+        assert values["PinnedVersion"] == ""
+        assert "[Microsoft.Win32.RegistryKey]::OpenBaseKey" in script
+        assert "Get-ItemProperty" not in script
+
+
+def test_unknown_registry_view():
+    with pytest.raises(ValueError):
+        installer_scripts(registry_view="16")
+
+
+def test_installer_pins_version_only_with_match_version():
+    for script in installer_scripts(version="8.6.4", match_version=True):
+        assert assignments(script)["PinnedVersion"] == "8.6.4"
+    for script in installer_scripts(version="8.6.4"):
+        assert assignments(script)["PinnedVersion"] == ""
+    for script in installer_scripts(match_version=True):
+        assert assignments(script)["PinnedVersion"] == ""
+
+
+def test_uninstaller_pins_display_version():
+    for script in uninstaller_scripts(display_version="8.6.4"):
+        assert assignments(script)["PinnedVersion"] == "8.6.4"
+
+
+@pytest.mark.parametrize("scripts", [installer_scripts, uninstaller_scripts])
+def test_single_quotes_are_escaped(scripts):
+    kwargs = {"display_name": "O'Reilly's 'Reader'"} if scripts is installer_scripts else {"name": "O'Reilly's 'Reader'"}
+    for script in scripts(**kwargs):
+        assert "$DisplayName = 'O''Reilly''s ''Reader'''\n" in script
+        assert assignments(script)["DisplayName"] == "O'Reilly's 'Reader'"
+
+
+def test_user_scope_variant_searches_current_user():
+    machine, user = render_installer("Git.Git", display_name="Git", fast_detection=True, registry_view="64", variants=[Variant("machine"), Variant("user")])
+    assert assignments(machine.files["detect.ps1"])["Locations"] == "LocalMachine:Registry64"
+    assert assignments(user.files["detect.ps1"])["Locations"] == "LocalMachine:Registry64,CurrentUser:Default"
+
+
+def test_generated_installer_scripts(tmp_path, stub_tools):
+    assert generate_installer("Notepad++.Notepad++", display_name="Notepad++ (64-bit x64)", version="8.6.4", output_parent_directory=tmp_path, fast_detection=True, registry_view="32", include_current_user=True, match_version=True)
+    for file_name in ["detect.ps1", "uninstall.ps1"]:
+        values = assignments((tmp_path / "Notepad++.Notepad++" / file_name).read_text())
+        assert values == {
+            "DisplayName": "Notepad++ (64-bit x64)",
+            "PinnedVersion": "8.6.4",
+            "Locations": "LocalMachine:Registry32,CurrentUser:Default",
+            "UninstallKey": r"SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall",
+        }
+
+
+def test_generated_uninstaller_scripts(tmp_path, stub_tools):
+    assert generate_uninstaller("Notepad++ (64-bit x64)", output_parent_directory=tmp_path, fast=True, registry_view="64", display_version="8.6.4")
+    for file_name in ["detect.ps1", "uninstall.ps1"]:
+        values = assignments((tmp_path / "Notepad++_(64-bit_x64)" / file_name).read_text())
+        assert values["DisplayName"] == "Notepad++ (64-bit x64)"
+        assert values["PinnedVersion"] == "8.6.4"
+        assert values["Locations"] == "LocalMachine:Registry64"
+
+
+def test_fast_detection_is_a_build_input(tmp_path, stub_tools):
+    assert generate_installer("Git.Git", display_name="Git", output_parent_directory=tmp_path)
+    assert "Get-ItemProperty" in (tmp_path / "Git.Git" / "detect.ps1").read_text()
+    assert generate_installer("Git.Git", display_name="Git", output_parent_directory=tmp_path, fast_detection=True)
+    assert assignments((tmp_path / "Git.Git" / "detect.ps1").read_text())["Locations"] == LOCATIONS["both", False]
+    assert generate_installer("Git.Git", display_name="Git", output_parent_directory=tmp_path, fast_detection=True, include_current_user=True)
+    assert assignments((tmp_path / "Git.Git" / "detect.ps1").read_text())["Locations"] == LOCATIONS["both", True]
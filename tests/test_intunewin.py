@@ -0,0 +1,119 @@
+import base64
+import hashlib
+import hmac
+import io
+import zipfile
+from xml.etree import ElementTree
+
+import pytest
+
+import intunewin
+import intunify
+
+
+@pytest.fixture
+def cryptography():
+    return pytest.importorskip("cryptography")
+
+
+def source_folder(tmp_path):
+    folder = tmp_path / "Git.Git"
+    (folder / "sub").mkdir(parents=True)
+    (folder / "install.ps1").write_text("winget install --id Git.Git\n")
+    (folder / "detect.ps1").write_text("Write-Output 'Found'\n" * 1000)
+    (folder / "sub" / "data.bin").write_bytes(bytes(range(256)) * 64)
+    (folder / "stale.intunewin").write_bytes(b"an earlier package")
+    return folder
+
+
+def unpack(package):
+    """Return the Detection.xml of an .intunewin file and its decrypted content, checking its HMAC and digest."""
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    with zipfile.ZipFile(package) as zf:
+        detection = ElementTree.fromstring(zf.read(intunewin.DETECTION_ARCNAME))
+        info = zf.getinfo(intunewin.CONTENT_ARCNAME)
+        content = zf.read(info)
+    # The encrypted content is stored, so publishing can upload it straight from the file
+    assert info.compress_type == zipfile.ZIP_STORED
+    encryption = detection.find("EncryptionInfo")
+    key = base64.b64decode(encryption.findtext("EncryptionKey"))
+    mac_key = base64.b64decode(encryption.findtext("MacKey"))
+    iv = base64.b64decode(encryption.findtext("InitializationVector"))
+    mac, ciphertext = content[:32], content[32:]
+    assert content[32:48] == iv
+    assert hmac.compare_digest(mac, hmac.new(mac_key, ciphertext, hashlib.sha256).digest())
+    assert base64.b64decode(encryption.findtext("Mac")) == mac
+    assert encryption.findtext("ProfileIdentifier") == "ProfileVersion1"
+    assert encryption.findtext("FileDigestAlgorithm") == "SHA256"
+
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+    unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+    plaintext = unpadder.update(decryptor.update(ciphertext[16:]) + decryptor.finalize()) + unpadder.finalize()
+    assert base64.b64decode(encryption.findtext("FileDigest")) == hashlib.sha256(plaintext).digest()
+    assert int(detection.findtext("UnencryptedContentSize")) == len(plaintext)
+    return detection, plaintext
+
+
+def test_package_decrypts_to_the_source_folder(tmp_path, cryptography):
+    folder = source_folder(tmp_path)
+    package = intunewin.create_intunewin(folder, "install.ps1", folder)
+    assert package == folder / "install.intunewin"
+
+    detection, plaintext = unpack(package)
+    assert detection.findtext("SetupFile") == "install.ps1"
+    assert detection.findtext("FileName") == intunewin.CONTENT_FILE_NAME
+    with zipfile.ZipFile(io.BytesIO(plaintext)) as zf:
+        assert sorted(zf.namelist()) == ["detect.ps1", "install.ps1", "sub/data.bin"]
+        assert zf.read("sub/data.bin") == (folder / "sub" / "data.bin").read_bytes()
+        assert zf.read("detect.ps1") == (folder / "detect.ps1").read_bytes()
+    assert not list(folder.glob("*.tmp"))
+
+
+def test_every_package_has_its_own_keys(tmp_path, cryptography):
+    folder = source_folder(tmp_path)
+    first, _ = unpack(intunewin.create_intunewin(folder, "install.ps1", tmp_path))
+    second, _ = unpack(intunewin.create_intunewin(folder, "install.ps1", tmp_path))
+    assert first.findtext("EncryptionInfo/EncryptionKey") != second.findtext("EncryptionInfo/EncryptionKey")
+    assert first.findtext("EncryptionInfo/FileDigest") == second.findtext("EncryptionInfo/FileDigest")
+
+
+def test_in_memory_package(tmp_path, cryptography):
+    files = {"install.ps1": b"winget install --id Git.Git\n", "sub/notes.txt": b"notes", "old.intunewin": b"skipped"}
+    out = io.BytesIO()
+    intunewin.write_intunewin(files, "install.ps1", out)
+    _, plaintext = unpack(io.BytesIO(out.getvalue()))
+    with zipfile.ZipFile(io.BytesIO(plaintext)) as zf:
+        assert {name: zf.read(name) for name in zf.namelist()} == {"install.ps1": files["install.ps1"], "sub/notes.txt": b"notes"}
+
+    with pytest.raises(ValueError):
+        intunewin.write_intunewin(files, "setup.ps1", io.BytesIO())
+
+
+def test_missing_setup_file(tmp_path, cryptography):
+    folder = source_folder(tmp_path)
+    with pytest.raises(FileNotFoundError):
+        intunewin.create_intunewin(folder, "setup.ps1", folder)
+
+
+def test_native_backend(tmp_path, cryptography, monkeypatch):
+    monkeypatch.setattr(intunify, "PACKAGER_BACKEND", "native")
+    folder = source_folder(tmp_path)
+    assert intunify.create_intunewin_file(folder.name, "install.ps1", cwd=tmp_path)
+    unpack(folder / "install.intunewin")
+    assert intunify.get_packager_version.__wrapped__() == f"native:{intunewin.FORMAT_VERSION}"
+
+
+def test_auto_falls_back_to_the_external_packager(tmp_path, stub_tools, monkeypatch):
+    monkeypatch.setattr(intunify, "PACKAGER_BACKEND", "auto")
+    monkeypatch.setattr(intunewin, "Cipher", None)
+    assert not intunify.use_native_packager()
+    folder = source_folder(tmp_path)
+    (folder / "stale.intunewin").unlink()
+    assert intunify.create_intunewin_file(folder.name, "install.ps1", cwd=tmp_path)
+    # The IntuneWinAppUtil.exe stand-in writes a placeholder package
+    assert (folder / "install.intunewin").read_bytes() == b"stub"
+    assert intunify.get_packager_version.__wrapped__().startswith(str(stub_tools))
+    with pytest.raises(RuntimeError, match="requires the cryptography package"):
+        intunewin.create_intunewin(folder, "install.ps1", folder)
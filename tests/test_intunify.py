@@ -0,0 +1,111 @@
+import io
+import json
+import subprocess
+import sys
+
+import pytest
+
+import intunify
+from conftest import ROOT
+
+
+def write_catalog(tmp_path):
+    catalog = tmp_path / "catalog.jsonl"
+    catalog.write_text(json.dumps({"winget_id": "Git.Git", "registry_key": "HKEY_LOCAL_MACHINE\\SOFTWARE\\Git_is1"}) + "\n")
+    return catalog
+
+
+def run_batch(commands):
+    out = io.StringIO()
+    failed = intunify.run_batch([json.dumps(command) if isinstance(command, dict) else command for command in commands], out)
+    return failed, [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+def test_batch_writes_one_result_per_command(tmp_path, stub_tools):
+    catalog = write_catalog(tmp_path)
+    failed, results = run_batch([
+        {"id": "git", "command": "bulk", "args": ["-i", str(catalog), "-o", str(tmp_path / "out")]},
+        "",
+        "not json",
+        {"command": "serve", "args": []},
+        {"id": 7, "command": "bulk", "args": ["-i", str(catalog)]},
+        {"command": "lock", "args": "-i catalog.jsonl"},
+    ])
+    assert failed == 4
+    assert [(result["id"], result["command"], result["exit_code"], result["ok"]) for result in results] == [
+        ("git", "bulk", 0, True),
+        (None, None, 2, False),
+        (None, "serve", 2, False),
+        (7, "bulk", 2, False),
+        (None, "lock", 2, False),
+    ]
+    assert "Built 1 of 1 applications, 0 failed." in results[0]["output"]
+    assert (tmp_path / "out" / "Git.Git" / "install.intunewin").exists()
+    assert results[1]["output"].startswith("Line 3: ")
+    # The server doesn't return, so it can't be batched
+    assert "command must be one of" in results[2]["output"] and "serve" not in results[2]["output"].split("Received")[0]
+    assert "exactly one of --outfolder and --archive is required" in results[3]["output"]
+    assert "args must be a list of strings" in results[4]["output"]
+
+
+def test_batch_restores_settings_after_every_command(tmp_path, stub_tools, monkeypatch):
+    catalog = write_catalog(tmp_path)
+    monkeypatch.setattr(intunify, "PACKAGER_BACKEND", "auto")
+    winget_executable = intunify.WINGET_EXECUTABLE
+    timeouts = dict(intunify.SUBPROCESS_TIMEOUTS)
+    failed, results = run_batch([
+        {"command": "bulk", "args": [
+            "-i", str(catalog), "-o", str(tmp_path / "stored"), "--store", str(tmp_path / "store"), "--packager", "external",
+            "--winget", str(tmp_path / "other-winget"), "-j", "3", "--retries", "4", "--winget-timeout", "3",
+        ]},
+        {"command": "bulk", "args": ["-i", str(catalog), "-o", str(tmp_path / "out")]},
+    ])
+    assert failed == 0, results
+    assert intunify.PACKAGER_BACKEND == "auto"
+    assert intunify.WINGET_EXECUTABLE == winget_executable
+    assert intunify._output_store is None
+    assert intunify._packager_slots is None and intunify._winget_slots is None
+    assert intunify.SUBPROCESS_RETRIES == 0
+    assert intunify.SUBPROCESS_TIMEOUTS == timeouts
+    # Only the first command wrote through the store
+    assert (tmp_path / "stored" / "Git.Git" / "install.ps1").stat().st_nlink == 2
+    assert (tmp_path / "out" / "Git.Git" / "install.ps1").stat().st_nlink == 1
+
+
+def test_batch_from_the_command_line(tmp_path, stub_tools):
+    catalog = write_catalog(tmp_path)
+    commands = [
+        {"id": "stored", "command": "bulk", "args": ["-i", str(catalog), "-o", str(tmp_path / "stored"), "--store", str(tmp_path / "store"), "--packager", "external"]},
+        {"id": "plain", "command": "bulk", "args": ["-i", str(catalog), "-o", str(tmp_path / "out"), "--packager", "external"]},
+    ]
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", str(ROOT / "intunify.py"), "--batch"],
+        input="".join(json.dumps(command) + "\n" for command in commands),
+        capture_output=True, text=True, cwd=tmp_path, timeout=60,
+    )
+    assert completed.returncode == 0, completed.stderr
+    # stdout holds nothing but the results
+    results = [json.loads(line) for line in completed.stdout.splitlines()]
+    assert [(result["id"], result["ok"]) for result in results] == [("stored", True), ("plain", True)]
+    # The commands share the script's module rather than importing it again as 'intunify'...
+    assert not [line for line in completed.stderr.splitlines() if line.startswith("import time:") and line.endswith("| intunify")]
+    # ...so the store set by the first command doesn't outlive it
+    assert (tmp_path / "stored" / "Git.Git" / "install.ps1").stat().st_nlink == 2
+    assert (tmp_path / "out" / "Git.Git" / "install.ps1").stat().st_nlink == 1
+
+
+def test_commands_load_only_what_they_use():
+    code = "import sys, intunify; print(sorted(name for name in ('templating', 'content_store', 'instrumentation', 'intunewin', 'cryptography') if name in sys.modules))"
+    completed = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=ROOT, check=True)
+    assert completed.stdout.strip() == "[]"
+
+
+@pytest.mark.parametrize("argv, error", [
+    ([], "a command or --batch is required"),
+    (["--batch", "show"], "--batch reads its commands from stdin"),
+])
+def test_batch_or_a_command_is_required(argv, error, capsys):
+    with pytest.raises(SystemExit) as exit:
+        intunify.main(argv)
+    assert exit.value.code == 2
+    assert error in capsys.readouterr().err
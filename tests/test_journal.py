@@ -0,0 +1,171 @@
+import json
+
+import pytest
+
+import bulk_application_installer_generator as bulk
+import instrumentation
+import intunify
+from benchmark import PACKAGER_STUB
+from build_manifest import MANIFEST_FILE_NAME, BuildManifest
+from journal import FAILURES_FILE_NAME, JOURNAL_FILE_NAME, BuildJournal, read_journal
+
+
+GIT = {"winget_id": "Git.Git", "registry_key": "HKEY_LOCAL_MACHINE\\SOFTWARE\\Git_is1"}
+BROKEN = {"winget_id": "Broken.App", "display_name": "Broken App"}
+PUTTY = {"winget_id": "PuTTY.PuTTY", "file_path": "C:\\Program Files\\PuTTY\\putty.exe"}
+
+# Logs every package it builds and fails to build Broken.App
+LOGGING_PACKAGER_STUB = PACKAGER_STUB.replace('name=$(basename "$setup")', '''echo "$setup" >> "$INTUNIFY_STUB_LOG"
+case "$setup" in *Broken.App*) exit 1 ;; esac
+name=$(basename "$setup")''')
+
+
+def read_lines(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def cut_short(path, app):
+    """Cut the journal at 'path' off halfway through the "done" line of 'app', as a crash would."""
+    text = path.read_text()
+    start = text.index(json.dumps({"event": "done", "app": app}).rstrip("}"))
+    path.write_text(text[:start + 20])
+
+
+def test_resume_ignores_a_line_cut_short(tmp_path):
+    with BuildJournal(tmp_path) as journal:
+        journal.finish("Git.Git", None, [GIT])
+        journal.finish("PuTTY.PuTTY", None, [PUTTY])
+    cut_short(tmp_path / JOURNAL_FILE_NAME, "PuTTY.PuTTY")
+
+    with BuildJournal(tmp_path, resume=True) as journal:
+        assert journal.finished == {"Git.Git": None}
+        journal.finish("PuTTY.PuTTY", None, [PUTTY])
+
+    # The resumed run starts on a line of its own rather than running on from the cut one
+    lines = (tmp_path / JOURNAL_FILE_NAME).read_text().splitlines()
+    assert lines[-2].startswith('{"event": "run"')
+    assert json.loads(lines[-1]) == {"event": "done", "app": "PuTTY.PuTTY", "error": None}
+    assert read_journal(tmp_path / JOURNAL_FILE_NAME)[0] == {"Git.Git": None, "PuTTY.PuTTY": None}
+
+
+def test_records_are_carried_over_without_resume(tmp_path):
+    with BuildJournal(tmp_path) as journal:
+        journal.attach(BuildManifest(tmp_path))
+        journal.record("Git.Git", "digest-1")
+        journal.finish("Git.Git", None, [GIT])
+
+    with BuildJournal(tmp_path) as journal:
+        assert journal.finished == {}
+        manifest = BuildManifest(tmp_path)
+        journal.attach(manifest)
+        assert manifest.is_current("Git.Git", "digest-1")
+        manifest.record("PuTTY.PuTTY", "digest-2")
+
+    # A fresh journal holds the records of the earlier one, but not its finished applications
+    assert read_journal(tmp_path / JOURNAL_FILE_NAME) == ({}, {"Git.Git": "digest-1", "PuTTY.PuTTY": "digest-2"})
+
+
+def test_failures_file_is_replaced_when_the_run_ends(tmp_path):
+    failures_path = tmp_path / FAILURES_FILE_NAME
+    failures_path.write_text(json.dumps(dict(PUTTY, error="from an earlier run")) + "\n")
+
+    journal = BuildJournal(tmp_path)
+    assert journal.finish("Broken.App", "intunewin file was not generated", [BROKEN]) == "intunewin file was not generated"
+    # The earlier failures file is kept until the run ends, so it can be retried into the same folder
+    assert read_lines(failures_path) == [dict(PUTTY, error="from an earlier run")]
+    journal.close()
+    assert read_lines(failures_path) == [dict(BROKEN, error="intunewin file was not generated")]
+    assert not (tmp_path / (FAILURES_FILE_NAME + ".partial")).exists()
+    assert journal.failures == 1
+
+    # Resuming keeps the failures of the run being resumed
+    with BuildJournal(tmp_path, resume=True) as journal:
+        journal.finish("PuTTY.PuTTY", "intunewin file was not generated", [PUTTY])
+    assert [line["winget_id"] for line in read_lines(failures_path)] == ["Broken.App", "PuTTY.PuTTY"]
+
+    # ...and a run in which nothing failed removes the failures file
+    with BuildJournal(tmp_path) as journal:
+        journal.finish("Broken.App", None, [BROKEN])
+    assert not failures_path.exists()
+    assert not (tmp_path / (FAILURES_FILE_NAME + ".partial")).exists()
+
+
+@pytest.fixture
+def bulk_run(tmp_path, stub_tools, monkeypatch):
+    """Return a function running the bulk generator on a catalog of Git.Git, Broken.App and PuTTY.PuTTY,
+    and the log of the packages built."""
+    packager = stub_tools / "IntuneWinAppUtil.exe"
+    packager.write_text(LOGGING_PACKAGER_STUB)
+    log = tmp_path / "packager.log"
+    log.touch()
+    monkeypatch.setenv("INTUNIFY_STUB_LOG", str(log))
+    # run() sets these for the whole process
+    for name in ["_packager_slots", "_winget_slots", "SUBPROCESS_RETRIES", "SUBPROCESS_RETRY_BACKOFF"]:
+        monkeypatch.setattr(intunify, name, getattr(intunify, name))
+    monkeypatch.setattr(intunify, "SUBPROCESS_TIMEOUTS", dict(intunify.SUBPROCESS_TIMEOUTS))
+    catalog = tmp_path / "catalog.jsonl"
+    catalog.write_text("".join(json.dumps(application) + "\n" for application in [GIT, BROKEN, PUTTY]))
+
+    def run(*argv):
+        log.write_text("")
+        bulk.main(["-i", str(catalog), "-o", str(tmp_path / "out"), "--retries", "0", *argv])
+        return [line.split("\\")[1] for line in log.read_text().replace("/", "\\").splitlines()]
+
+    return run
+
+
+def test_bulk_resume_after_a_crash(tmp_path, bulk_run, capsys):
+    output = tmp_path / "out"
+    assert bulk_run() == ["Git.Git", "Broken.App", "PuTTY.PuTTY"]
+    out = capsys.readouterr().out
+    assert "Built 2 of 3 applications, 1 failed." in out
+    assert f"Retry them with -i {output / FAILURES_FILE_NAME}" in out
+    [failure] = read_lines(output / FAILURES_FILE_NAME)
+    assert failure["winget_id"] == "Broken.App"
+    assert "package exited with 1" in failure["error"]
+
+    # Crash while journaling PuTTY.PuTTY, before the build manifest was saved
+    cut_short(output / JOURNAL_FILE_NAME, "PuTTY.PuTTY")
+    (output / MANIFEST_FILE_NAME).unlink()
+
+    # Git.Git and the failed Broken.App are skipped, and PuTTY.PuTTY, whose package was
+    # journaled, is up to date
+    assert bulk_run("--resume") == []
+    out = capsys.readouterr().out
+    assert "Built 1 of 1 applications, 0 failed." in out
+    assert "Skipped 2 catalog entries finished before the run was resumed." in out
+    assert [line["winget_id"] for line in read_lines(output / FAILURES_FILE_NAME)] == ["Broken.App"]
+    assert set(json.loads((output / MANIFEST_FILE_NAME).read_text())) == {"Git.Git", "PuTTY.PuTTY"}
+
+    # Without --resume every application is built again, except those whose packages are current
+    assert bulk_run() == ["Broken.App"]
+    assert "Built 2 of 3 applications, 1 failed." in capsys.readouterr().out
+
+
+def test_bulk_run_keeps_journaled_packages_without_resume(tmp_path, bulk_run, capsys):
+    output = tmp_path / "out"
+    failures_path = tmp_path / "failed.jsonl"
+    bulk_run("--failures", str(failures_path))
+    # Crash before the build manifest was saved
+    (output / MANIFEST_FILE_NAME).unlink()
+    capsys.readouterr()
+
+    assert bulk_run("--failures", str(failures_path)) == ["Broken.App"]
+    assert "Built 2 of 3 applications, 1 failed." in capsys.readouterr().out
+    assert [line["winget_id"] for line in read_lines(failures_path)] == ["Broken.App"]
+    assert not (output / FAILURES_FILE_NAME).exists()
+
+
+def test_a_second_run_does_not_write_into_the_first_runs_journal(tmp_path, bulk_run, capsys):
+    bulk_run()
+    first_journal = tmp_path / "out" / JOURNAL_FILE_NAME
+    journaled = first_journal.read_text()
+    assert instrumentation._listeners == ()
+
+    # Another run in the same process, into another output folder
+    catalog = tmp_path / "catalog.jsonl"
+    bulk.main(["-i", str(catalog), "-o", str(tmp_path / "other"), "--retries", "0", "--force"])
+    assert "Built 2 of 3 applications, 1 failed." in capsys.readouterr().out
+    assert first_journal.read_text() == journaled
+    assert '"event": "stage"' in (tmp_path / "other" / JOURNAL_FILE_NAME).read_text()
+    assert instrumentation._listeners == ()
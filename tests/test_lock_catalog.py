@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+import intunify
+import lock_catalog
+from lock_catalog import lock_catalog as lock, read_lockfile, write_lockfile
+from winget_index import WingetIndex
+
+
+# Prints the version in $INTUNIFY_STUB_VERSIONS for the id, e.g. "Git.Git=2.41.0 PuTTY.PuTTY=0.80",
+# and fails like winget does for ids it doesn't list
+WINGET_STUB = r"""#!/bin/sh
+while [ $# -gt 0 ]; do
+    [ "$1" = "--id" ] && id="$2"
+    shift
+done
+for entry in $INTUNIFY_STUB_VERSIONS; do
+    if [ "${entry%%=*}" = "$id" ]; then
+        printf 'Found %s [%s]\r\nVersion: %s\r\nPublisher: Test\r\n' "$id" "$id" "${entry#*=}"
+        exit 0
+    fi
+done
+echo "No package found matching input criteria."
+exit 1
+"""
+
+
+def write_catalog(path, applications):
+    path.write_text("\n".join(json.dumps(application) for application in applications) + "\n")
+    return path
+
+
+CATALOG = [
+    {"winget_id": "Git.Git", "registry_key": r"HKEY_LOCAL_MACHINE\SOFTWARE\Git_is1"},
+    {"winget_id": "PuTTY.PuTTY", "file_path": r"C:\Program Files\PuTTY", "version": "0.78"},
+    {"winget_id": "WinSCP.WinSCP", "display_name": "WinSCP"},
+]
+
+
+def install_winget_stub(tmp_path, monkeypatch, versions):
+    winget = tmp_path / "winget"
+    winget.write_text(WINGET_STUB)
+    winget.chmod(0o755)
+    # main() points intunify at --winget and caps winget processes; undo both after the test
+    monkeypatch.setattr(intunify, "WINGET_EXECUTABLE", intunify.WINGET_EXECUTABLE)
+    monkeypatch.setattr(intunify, "_winget_slots", intunify._winget_slots)
+    monkeypatch.setenv("INTUNIFY_STUB_VERSIONS", " ".join(f"{winget_id}={version}" for winget_id, version in versions.items()))
+    return str(winget)
+
+
+def test_resolve_from_winget_index(tmp_path, winget_manifests):
+    for version in ["2.9.0", "2.10.0", "2.40.0"]:
+        winget_manifests("Git.Git", version)
+    winget_manifests("WinSCP.WinSCP", "6.1")
+    catalog = write_catalog(tmp_path / "catalog.jsonl", CATALOG + [{"winget_id": "Unknown.App", "file_path": "C:\\unknown"}])
+
+    with WingetIndex(tmp_path / "index.sqlite3") as index:
+        index.reindex(winget_manifests.repository)
+        versions, failures = lock(catalog, winget_index=index)
+
+    assert versions == {"Git.Git": "2.40.0", "PuTTY.PuTTY": "0.78", "WinSCP.WinSCP": "6.1"}
+    assert failures == ["Unknown.App"]
+
+
+def test_lockfile_keeps_pinned_versions(tmp_path, monkeypatch, capsys):
+    winget = install_winget_stub(tmp_path, monkeypatch, {"Git.Git": "2.40.0", "PuTTY.PuTTY": "0.80", "WinSCP.WinSCP": "6.1"})
+    catalog = write_catalog(tmp_path / "catalog.jsonl", CATALOG)
+
+    lock_catalog.main(["-i", str(catalog), "--winget", winget])
+
+    lockfile = tmp_path / "catalog.lock.json"
+    lock_data = json.loads(lockfile.read_text())
+    assert lock_data["format_version"] == lock_catalog.LOCKFILE_FORMAT_VERSION
+    assert lock_data["catalog"] == str(catalog)
+    assert lock_data["packages"] == {
+        "Git.Git": {"version": "2.40.0"},
+        "PuTTY.PuTTY": {"version": "0.78"},
+        "WinSCP.WinSCP": {"version": "6.1"},
+    }
+    assert read_lockfile(lockfile) == {"git.git": "2.40.0", "putty.putty": "0.78", "winscp.winscp": "6.1"}
+    assert "Locked 3 applications, 3 changed, 0 could not be resolved." in capsys.readouterr().out
+
+
+def test_relock_an_already_locked_catalog(tmp_path, monkeypatch, capsys):
+    catalog = write_catalog(tmp_path / "catalog.jsonl", CATALOG)
+    lockfile = tmp_path / "locked.json"
+    write_lockfile(lockfile, {"Git.Git": "2.39.0", "PuTTY.PuTTY": "0.78", "WinSCP.WinSCP": "6.0"}, catalog)
+
+    # WinSCP can't be resolved this time, so it keeps its locked version
+    winget = install_winget_stub(tmp_path, monkeypatch, {"Git.Git": "2.40.0"})
+    lock_catalog.main(["-i", str(catalog), "-o", str(lockfile), "--winget", winget])
+
+    assert read_lockfile(lockfile) == {"git.git": "2.40.0", "putty.putty": "0.78", "winscp.winscp": "6.0"}
+    out = capsys.readouterr().out
+    assert "Unable to resolve WinSCP.WinSCP, keeping locked version 6.0." in out
+    assert "Locked 3 applications, 1 changed, 0 could not be resolved." in out
+    assert "  Git.Git: 2.39.0 -> 2.40.0" in out
+
+    # Locking again without changes upstream leaves the lockfile's versions as they are
+    lock_catalog.main(["-i", str(catalog), "-o", str(lockfile), "--winget", winget])
+    assert read_lockfile(lockfile) == {"git.git": "2.40.0", "putty.putty": "0.78", "winscp.winscp": "6.0"}
+    assert "Locked 3 applications, 0 changed, 0 could not be resolved." in capsys.readouterr().out
+
+
+def test_unresolvable_entry_without_locked_version_fails(tmp_path, monkeypatch):
+    catalog = write_catalog(tmp_path / "catalog.jsonl", CATALOG)
+    winget = install_winget_stub(tmp_path, monkeypatch, {"Git.Git": "2.40.0"})
+    with pytest.raises(SystemExit) as exc:
+        lock_catalog.main(["-i", str(catalog), "--winget", winget])
+    assert exc.value.code == 1
+    assert read_lockfile(tmp_path / "catalog.lock.json") == {"git.git": "2.40.0", "putty.putty": "0.78"}
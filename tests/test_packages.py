@@ -0,0 +1,108 @@
+import io
+import os
+import tarfile
+import threading
+import zipfile
+
+import pytest
+
+import bulk_application_installer_generator as bulk
+import intunify
+from create_installer import render_installer
+from packages import ArchiveSink, CallbackSink, DirectorySink, Package, archive_format
+from test_intunewin import cryptography, unpack  # noqa: F401 (fixture)
+
+
+GIT = {"winget_id": "Git.Git", "registry_key": "HKEY_LOCAL_MACHINE\\SOFTWARE\\Git_is1"}
+FILE_NAMES = ["README.md", "detect.ps1", "install.ps1", "uninstall.ps1"]
+
+
+def test_render_installer_writes_nothing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    [package] = render_installer(**GIT, version="2.40.0")
+    assert list(tmp_path.iterdir()) == []
+    assert (package.name, package.slug, package.intunewin_name) == ("Git.Git", "Git.Git", "install.intunewin")
+    assert sorted(package.files) == FILE_NAMES
+    assert 'install --exact --id Git.Git --version "2.40.0"' in package.files["install.ps1"]
+    assert package.metadata == {"winget_id": "Git.Git", "version": "2.40.0", "variant": "machine"}
+    with pytest.raises(ValueError, match="not one of the files"):
+        Package("Git.Git", {"README.md": ""})
+
+
+def test_directory_sink(tmp_path, stub_tools):
+    [package] = render_installer(**GIT)
+    sink = DirectorySink(tmp_path / "out")
+    assert sink.write(package)
+    folder = tmp_path / "out" / "Git.Git"
+    assert sorted(path.name for path in folder.iterdir()) == sorted(FILE_NAMES + ["install.intunewin"])
+    for file_name in FILE_NAMES:
+        assert (folder / file_name).read_bytes() == package.data(file_name)
+
+    # Without packaging, only the files are written
+    assert DirectorySink(tmp_path / "files", package=False).write(package)
+    assert sorted(path.name for path in (tmp_path / "files" / "Git.Git").iterdir()) == FILE_NAMES
+
+
+@pytest.mark.parametrize("format", ["zip", "tar", "tar.gz"])
+def test_archive_sink(tmp_path, format, cryptography):
+    path = tmp_path / f"packages.{format}"
+    packages = render_installer(**GIT) + render_installer("PuTTY.PuTTY", file_path="C:\\putty.exe")
+    with ArchiveSink(path) as sink:
+        threads = [threading.Thread(target=sink.write, args=(package,)) for package in packages]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    if format == "zip":
+        with zipfile.ZipFile(path) as zf:
+            members = {name: zf.read(name) for name in zf.namelist()}
+    else:
+        with tarfile.open(path) as tf:
+            members = {member.name: tf.extractfile(member).read() for member in tf.getmembers()}
+    assert sorted(members) == sorted(f"{package.name}/{name}" for package in packages for name in FILE_NAMES + ["install.intunewin"])
+    for package in packages:
+        for file_name in FILE_NAMES:
+            assert members[f"{package.name}/{file_name}"] == package.data(file_name)
+        _, content = unpack(io.BytesIO(members[f"{package.name}/install.intunewin"]))
+        with zipfile.ZipFile(io.BytesIO(content)) as zf:
+            assert zf.read("install.ps1") == package.data("install.ps1")
+
+
+def test_archive_sink_to_a_stream(cryptography):
+    out = io.BytesIO()
+    with ArchiveSink(out, "zip", package=False) as sink:
+        sink.write(render_installer(**GIT)[0])
+    assert not out.closed
+    with zipfile.ZipFile(out) as zf:
+        assert sorted(zf.namelist()) == [f"Git.Git/{name}" for name in FILE_NAMES]
+    with pytest.raises(ValueError, match="format is required"):
+        ArchiveSink(io.BytesIO())
+
+
+def test_archive_format():
+    assert [archive_format(name) for name in ("a.ZIP", "a.tar", "a.tar.gz", "a.tgz")] == ["zip", "tar", "tar.gz", "tar.gz"]
+    with pytest.raises(ValueError, match="Unknown archive format"):
+        archive_format("a.7z")
+
+
+def test_callback_sink():
+    received = []
+    sink = CallbackSink(lambda package: received.append(package.name))
+    [package] = render_installer(**GIT)
+    assert sink.write(package)
+    assert received == ["Git.Git"]
+    assert not CallbackSink(lambda package: False).write(package)
+
+
+def test_bulk_archive(tmp_path, stub_tools, capsys, cryptography, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    catalog = tmp_path / "catalog.jsonl"
+    catalog.write_text('{"winget_id": "Git.Git", "registry_key": "HKEY_LOCAL_MACHINE\\\\SOFTWARE\\\\Git_is1"}\n')
+    with intunify.preserved_settings():
+        bulk.main(["-i", str(catalog), "--archive", str(tmp_path / "packages.zip")])
+    assert "Archived 1 of 1 applications, 0 failed." in capsys.readouterr().out
+    with zipfile.ZipFile(tmp_path / "packages.zip") as zf:
+        assert sorted(zf.namelist()) == sorted(f"Git.Git/{name}" for name in FILE_NAMES + ["install.intunewin"])
+    # No package folders are written
+    assert sorted(os.listdir(tmp_path)) == ["bin", "catalog.jsonl", "packages.zip"]
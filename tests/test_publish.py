@@ -0,0 +1,310 @@
+import base64
+import json
+import re
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from xml.etree import ElementTree
+
+import pytest
+
+import intunewin
+import publish
+from publish import ConnectionPool, GraphClient, PublishState, Publisher, TokenProvider, block_id
+
+
+BLOCK_SIZE = 1000
+GIT_DETAILS = 'Found: "Git [Git.Git]"\nVersion: "2.40.0"\nPublisher: "The Git Development Community"\n'
+FILE_PATH_PATTERN = re.compile(r"^mobileApps/([^/]+)/microsoft\.graph\.win32LobApp/contentVersions/([^/]+)/files/([^/]+)(?:/(\w+))?$")
+
+
+class MockIntune:
+    """Just enough of Graph, Azure AD and Azure storage to publish against.
+
+    Every request is logged as (method, path, query). Tests steer it through 'fail_blocks'
+    (block indexes whose first upload is rejected) and 'expired' (SAS signatures that are
+    turned away with 403).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []
+        self.tokens = 0
+        self.ids = 0
+        self.apps = {}
+        self.files = {}
+        self.blobs = {}
+        self.fail_blocks = set()
+        self.expired = set()
+        self.base_url = None
+
+    def new_id(self, prefix):
+        self.ids += 1
+        return f"{prefix}-{self.ids}"
+
+    def sas_uri(self, file_id):
+        signature = self.new_id("sig")
+        return f"{self.base_url}/blob/{file_id}?sv=2019-12-12&sig={signature}"
+
+    def requests_for(self, method, pattern):
+        return [path for request_method, path, _ in self.requests if request_method == method and re.search(pattern, path)]
+
+    def handle(self, method, url, body):
+        parts = urlsplit(url)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        with self.lock:
+            self.requests.append((method, parts.path, query))
+            if parts.path.startswith("/login/"):
+                self.tokens += 1
+                return 200, {"access_token": f"token-{self.tokens}", "expires_in": 3600}
+            if parts.path.startswith("/blob/"):
+                return self.storage(method, parts.path[len("/blob/"):], query, body)
+            return self.graph(method, parts.path[len("/graph/deviceAppManagement/"):], json.loads(body) if body else None)
+
+    def graph(self, method, path, body):
+        if path == "mobileApps" and method == "POST":
+            app_id = self.new_id("app")
+            self.apps[app_id] = dict(body, id=app_id, contentVersions={})
+            return 201, {"id": app_id}
+        match = re.match(r"^mobileApps/([^/]+)$", path)
+        if match:
+            app = self.apps.get(match.group(1))
+            if app is None:
+                return 404, {"error": {"code": "ResourceNotFound"}}
+            if method == "PATCH":
+                app.update(body)
+                return 204, None
+            return 200, {key: value for key, value in app.items() if key != "contentVersions"}
+        match = re.match(r"^mobileApps/([^/]+)/microsoft\.graph\.win32LobApp/contentVersions(?:/([^/]+)/files)?$", path)
+        if match and method == "POST":
+            app = self.apps[match.group(1)]
+            if match.group(2) is None:
+                content_version_id = self.new_id("cv")
+                app["contentVersions"][content_version_id] = []
+                return 201, {"id": content_version_id}
+            file_id = self.new_id("file")
+            app["contentVersions"][match.group(2)].append(file_id)
+            self.files[file_id] = dict(body, id=file_id, uploadState="azureStorageUriRequestSuccess", azureStorageUri=self.sas_uri(file_id))
+            self.blobs[file_id] = {"uncommitted": {}, "committed": None}
+            return 201, {"id": file_id}
+        match = FILE_PATH_PATTERN.match(path)
+        if match:
+            app_id, _, file_id, action = match.groups()
+            content_file = self.files.get(file_id)
+            if app_id not in self.apps or content_file is None:
+                return 404, {"error": {"code": "ResourceNotFound"}}
+            if action == "renewUpload":
+                content_file.update(uploadState="azureStorageUriRenewalSuccess", azureStorageUri=self.sas_uri(file_id))
+                return 204, None
+            if action == "commit":
+                committed = self.blobs[file_id]["committed"]
+                ok = committed is not None and len(committed) == content_file["sizeEncrypted"] and body["fileEncryptionInfo"]["mac"]
+                content_file.update(uploadState="commitFileSuccess" if ok else "commitFileFailed", fileEncryptionInfo=body["fileEncryptionInfo"])
+                return 204, None
+            return 200, content_file
+        return 400, {"error": {"code": "BadRequest", "message": f"{method} {path}"}}
+
+    def storage(self, method, file_id, query, body):
+        if query.get("sig") in self.expired or query.get("sig") != urlsplit(self.files[file_id]["azureStorageUri"]).query.split("sig=")[1]:
+            return 403, b"<Error><Code>AuthenticationFailed</Code></Error>"
+        blob = self.blobs[file_id]
+        if method == "GET" and query.get("comp") == "blocklist":
+            blocks = "".join(f"<Block><Name>{name}</Name><Size>{len(data)}</Size></Block>" for name, data in blob["uncommitted"].items())
+            return 200, f'<?xml version="1.0" encoding="utf-8"?><BlockList><CommittedBlocks /><UncommittedBlocks>{blocks}</UncommittedBlocks></BlockList>'.encode()
+        if method == "PUT" and query.get("comp") == "block":
+            index = int(base64.b64decode(query["blockid"]).decode().split("-")[1])
+            if index in self.fail_blocks:
+                self.fail_blocks.discard(index)
+                return 400, b"<Error><Code>InvalidBlob</Code></Error>"
+            blob["uncommitted"][query["blockid"]] = body
+            return 201, b""
+        if method == "PUT" and query.get("comp") == "blocklist":
+            names = [element.text for element in ElementTree.fromstring(body).iter("Latest")]
+            blob["committed"] = b"".join(blob["uncommitted"][name] for name in names)
+            blob["uncommitted"] = {}
+            return 201, b""
+        return 400, b""
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def respond(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        status, data = self.server.intune.handle(self.command, self.path, body)
+        if isinstance(data, dict):
+            data = json.dumps(data).encode()
+        data = data or b""
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_PATCH = respond
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def intune():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.intune = MockIntune()
+    server.intune.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.intune
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def publisher(intune, tmp_path):
+    pool = ConnectionPool()
+    tokens = TokenProvider(pool, tenant="contoso.onmicrosoft.com", client_id="client", client_secret="secret", login_url=f"{intune.base_url}/login")
+    yield Publisher(GraphClient(pool, tokens, f"{intune.base_url}/graph"), PublishState(tmp_path / "out"), block_size=BLOCK_SIZE, upload_jobs=1, poll_interval=0, timeout=5)
+    pool.close()
+
+
+def write_package(folder, content, mac, details=None):
+    """Write a package folder holding an .intunewin file with 'content' as its (pretend) encrypted content."""
+    folder.mkdir(parents=True, exist_ok=True)
+    (folder / "detect.ps1").write_text("Write-Output 'Found'\n")
+    if details:
+        (folder / "package_details.yaml").write_text(details, encoding="utf-8")
+    detection = intunewin.DETECTION_XML_TEMPLATE.format(
+        tool_version=intunewin.TOOL_VERSION,
+        name="install.ps1",
+        unencrypted_content_size=len(content) - 48,
+        file_name=intunewin.CONTENT_FILE_NAME,
+        setup_file="install.ps1",
+        encryption_key="a2V5",
+        mac_key="bWFj",
+        initialization_vector="aXY=",
+        mac=mac,
+        file_digest="ZGlnZXN0",
+    )
+    with zipfile.ZipFile(folder / publish.PACKAGE_FILE_NAME, "w", zipfile.ZIP_STORED) as zf:
+        zf.writestr(intunewin.CONTENT_ARCNAME, content)
+        zf.writestr(intunewin.DETECTION_ARCNAME, detection)
+    return folder
+
+
+def content(size, seed=0):
+    return bytes((i * 7 + seed) % 251 for i in range(size))
+
+
+def test_publish_and_skip_committed_package(intune, publisher, tmp_path):
+    data = content(3500)
+    folder = write_package(tmp_path / "out" / "Git.Git", data, mac="mac-1", details=GIT_DETAILS)
+
+    assert publisher.publish(folder)
+    [app_id] = intune.apps
+    app = intune.apps[app_id]
+    assert app["displayName"] == "Git"
+    assert app["publisher"] == "The Git Development Community"
+    [content_version_id] = app["contentVersions"]
+    assert app["committedContentVersion"] == content_version_id
+    [file_id] = app["contentVersions"][content_version_id]
+    assert intune.blobs[file_id]["committed"] == data
+    assert intune.files[file_id]["fileEncryptionInfo"]["mac"] == "mac-1"
+    assert len(intune.requests_for("PUT", "^/blob/")) == 4 + 1
+    assert PublishState(tmp_path / "out").get("Git.Git") == {"app_id": app_id, "committed": "mac-1"}
+
+    # The same package isn't published again, and nothing is sent to Graph
+    requests = len(intune.requests)
+    assert not publisher.publish(folder)
+    assert len(intune.requests) == requests
+
+    # A rebuilt package updates the existing app with a new content version
+    data = content(1200, seed=1)
+    write_package(folder, data, mac="mac-2", details=GIT_DETAILS)
+    assert publisher.publish(folder)
+    assert list(intune.apps) == [app_id]
+    assert len(app["contentVersions"]) == 2
+    new_file_id = app["contentVersions"][app["committedContentVersion"]][0]
+    assert intune.blobs[new_file_id]["committed"] == data
+
+
+def test_resume_uploads_only_missing_blocks(intune, publisher, tmp_path):
+    data = content(4500)
+    folder = write_package(tmp_path / "out" / "Git.Git", data, mac="mac-1")
+    intune.fail_blocks = {2}
+
+    with pytest.raises(publish.PublishError, match="Uploading block 2 failed with 400"):
+        publisher.publish(folder)
+    state = PublishState(tmp_path / "out").get("Git.Git")
+    assert state["pending"] == "mac-1"
+    file_id = state["file_id"]
+    uploaded = set(intune.blobs[file_id]["uncommitted"])
+    assert {block_id(0), block_id(1)} <= uploaded and block_id(2) not in uploaded
+    # Blocks queued after the failed one may or may not have been sent
+    missing = [block_id(index) for index in range(5) if block_id(index) not in uploaded]
+
+    # The resumed upload reuses the content version and only sends the missing blocks
+    requests = len(intune.requests)
+    assert publisher.publish(folder)
+    resumed = intune.requests[requests:]
+    assert [query["blockid"] for method, _, query in resumed if method == "PUT" and query.get("comp") == "block"] == missing
+    assert not [path for method, path, _ in resumed if method == "POST" and path.endswith(("/contentVersions", "/files"))]
+    assert intune.blobs[file_id]["committed"] == data
+    assert PublishState(tmp_path / "out").get("Git.Git") == {"app_id": state["app_id"], "committed": "mac-1"}
+
+
+def test_expired_upload_url_is_renewed(intune, publisher, tmp_path):
+    data = content(2500)
+    folder = write_package(tmp_path / "out" / "Git.Git", data, mac="mac-1")
+    original_sas_uri = intune.sas_uri
+
+    def expired_sas_uri(file_id):
+        # The first upload URL handed out has already expired
+        uri = original_sas_uri(file_id)
+        if not intune.expired:
+            intune.expired.add(uri.split("sig=")[1])
+        return uri
+
+    intune.sas_uri = expired_sas_uri
+    assert publisher.publish(folder)
+    assert len(intune.requests_for("POST", "/renewUpload$")) == 1
+    [file_id] = intune.files
+    assert intune.files[file_id]["uploadState"] == "commitFileSuccess"
+    assert intune.blobs[file_id]["committed"] == data
+
+
+def test_deleted_app_is_recreated(intune, publisher, tmp_path):
+    folder = write_package(tmp_path / "out" / "Git.Git", content(1500), mac="mac-1")
+    assert publisher.publish(folder)
+    [app_id] = intune.apps
+    del intune.apps[app_id]
+
+    data = content(1500, seed=2)
+    write_package(folder, data, mac="mac-2")
+    assert publisher.publish(folder)
+    [new_app_id] = intune.apps
+    assert new_app_id != app_id
+    app = intune.apps[new_app_id]
+    assert intune.blobs[app["contentVersions"][app["committedContentVersion"]][0]]["committed"] == data
+    assert PublishState(tmp_path / "out").get("Git.Git") == {"app_id": new_app_id, "committed": "mac-2"}
+
+
+def test_main_publishes_every_package_folder(intune, tmp_path, monkeypatch, capsys):
+    output = tmp_path / "out"
+    write_package(output / "Git.Git", content(2000), mac="mac-git")
+    write_package(output / "PuTTY.PuTTY", content(3000), mac="mac-putty")
+    (output / "not_a_package").mkdir()
+    monkeypatch.setenv("INTUNIFY_CLIENT_SECRET", "secret")
+    monkeypatch.delenv("INTUNIFY_GRAPH_TOKEN", raising=False)
+    argv = ["-o", str(output), "--tenant", "contoso.onmicrosoft.com", "--client-id", "client", "--graph-url", f"{intune.base_url}/graph", "--login-url", f"{intune.base_url}/login", "--poll-interval", "0", "--jobs", "2"]
+
+    publish.main(argv)
+    assert "Published 2 of 2 applications, 0 failed." in capsys.readouterr().out
+    assert sorted(app["displayName"] for app in intune.apps.values()) == ["Git.Git", "PuTTY.PuTTY"]
+    assert intune.tokens == 1
+
+    # Nothing is uploaded again
+    uploads = len(intune.requests_for("PUT", "^/blob/"))
+    publish.main(argv)
+    assert "Published 2 of 2 applications, 0 failed." in capsys.readouterr().out
+    assert len(intune.requests_for("PUT", "^/blob/")) == uploads
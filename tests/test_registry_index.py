@@ -0,0 +1,125 @@
+import json
+
+import pytest
+
+from registry_index import RegistryIndex, normalize_name, resolve_detection
+
+
+UNINSTALL = r"HKEY_LOCAL_MACHINE\SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall"
+WOW_UNINSTALL = r"HKEY_LOCAL_MACHINE\SOFTWARE\WOW6432Node\Microsoft\Windows\CurrentVersion\Uninstall"
+
+REG_EXPORT = "\r\n".join([
+    "Windows Registry Editor Version 5.00",
+    "",
+    rf"[{UNINSTALL}\Notepad++]",
+    '"DisplayName"="Notepad++ (64-bit x64)"',
+    '"DisplayVersion"="8.6.4"',
+    '"Publisher"="Notepad++ Team"',
+    '"EstimatedSize"=dword:00001000',
+    "",
+    rf"[{WOW_UNINSTALL}\winscp3_is1]",
+    '"DisplayName"="WinSCP 6.1.2"',
+    '"Publisher"="Martin Prikryl"',
+    "",
+    rf"[{UNINSTALL}\PuTTY]",
+    '"DisplayName"="PuTTY release 0.80 (64-bit)"',
+    '"Publisher"="Simon Tatham"',
+    "",
+    rf"[{UNINSTALL}\NoDisplayName]",
+    '"SystemComponent"=dword:00000001',
+    "",
+])
+
+JSON_DUMP = [
+    {
+        "PSPath": rf"Microsoft.PowerShell.Core\Registry::{UNINSTALL}\PowerToys",
+        "DisplayName": "Power Toys",
+        "Publisher": "Microsoft Corporation",
+    },
+    {
+        "PSPath": r"Microsoft.PowerShell.Core\Registry::HKEY_CURRENT_USER\Software\Microsoft\Windows\CurrentVersion\Uninstall\Zoom",
+        "DisplayName": "Zoom Workplace",
+        "Publisher": "Zoom Video Communications, Inc.",
+    },
+    {
+        "PSPath": rf"Microsoft.PowerShell.Core\Registry::{UNINSTALL}\{{11111111-2222-3333-4444-555555555555}}",
+        "DisplayName": "Microsoft Visual C++ 2015-2022 Redistributable (x64) - 14.38.33130",
+        "Publisher": "Microsoft Corporation",
+    },
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    reg = tmp_path / "reference.reg"
+    reg.write_text(REG_EXPORT, encoding="utf-16")
+    dump = tmp_path / "reference.json"
+    dump.write_text(json.dumps(JSON_DUMP))
+    with RegistryIndex(tmp_path / "index.sqlite3") as index:
+        assert index.import_snapshot(reg) == 3
+        assert index.import_snapshot(dump) == 3
+        yield index
+
+
+def names(matches):
+    return [match.display_name for match in matches]
+
+
+def test_normalize_name():
+    assert normalize_name("Notepad++ (64-bit x64)") == "notepad"
+    assert normalize_name("Python 3.10.11 (64-bit)") == "python"
+
+
+def test_exact_and_containing_matches(index):
+    assert names(index.lookup("notepad++")) == ["Notepad++ (64-bit x64)"]
+    assert index.lookup("WinSCP")[0].key == rf"{WOW_UNINSTALL}\winscp3_is1"
+    assert names(index.lookup("PuTTY")) == ["PuTTY release 0.80 (64-bit)"]
+
+
+def test_fuzzy_match_with_a_typo(index):
+    assert names(index.lookup("Notpad++")) == ["Notepad++ (64-bit x64)"]
+    assert names(index.lookup("WinSPC")) == []
+
+
+def test_fuzzy_match_with_a_split_word(index):
+    assert names(index.lookup("Win SCP")) == ["WinSCP 6.1.2"]
+
+
+def test_fuzzy_match_with_a_joined_word(index):
+    assert names(index.lookup("PowerToys")) == ["Power Toys"]
+
+
+def test_fuzzy_cutoff(index):
+    assert names(index.lookup("Notpad")) == ["Notepad++ (64-bit x64)"]
+    assert index.lookup("Notpad", cutoff=0.95) == []
+    assert index.lookup("Firefox") == []
+
+
+def test_hive_filter(index):
+    assert names(index.lookup("Zoom Workplace")) == ["Zoom Workplace"]
+    assert index.lookup("Zoom Workplace", hive="HKEY_LOCAL_MACHINE") == []
+
+
+def test_reimport_replaces_previous_import(index, tmp_path):
+    dump = tmp_path / "reference.json"
+    dump.write_text(json.dumps(JSON_DUMP[:1]))
+    assert index.import_snapshot(dump) == 1
+    assert index.lookup("Zoom Workplace") == []
+    assert names(index.lookup("PowerToys")) == ["Power Toys"]
+
+
+def test_resolve_detection_fills_in_placeholders(index):
+    applications = [
+        {"name": "Notpad++", "winget_id": "Notepad++.Notepad++", "display_name": ""},
+        {"name": "Win SCP", "winget_id": "WinSCP.WinSCP", "registry_key": "this_does_not_exist, yet."},
+        {"name": "Zoom", "winget_id": "Zoom.Zoom", "registry_key": "this_does_not_exist, yet."},
+        {"name": "PuTTY", "winget_id": "PuTTY.PuTTY", "file_path": r"C:\Program Files\PuTTY"},
+    ]
+    unresolved = []
+    resolved = list(resolve_detection(applications, index, on_unresolved=unresolved.append))
+    assert resolved[0]["display_name"] == "Notepad++ (64-bit x64)"
+    assert resolved[1]["registry_key"] == rf"{WOW_UNINSTALL}\winscp3_is1"
+    # Zoom is only installed per user, which the registry_key detection scripts don't search
+    assert resolved[2] == applications[2]
+    assert resolved[3] == applications[3]
+    assert unresolved == [applications[2]]
@@ -0,0 +1,117 @@
+import http.client
+import json
+import threading
+import time
+
+import pytest
+
+from serve import JobQueue, make_server
+
+
+GIT = {"winget_id": "Git.Git", "registry_key": "HKEY_LOCAL_MACHINE\\SOFTWARE\\Git_is1"}
+PUTTY = {"winget_id": "PuTTY.PuTTY", "file_path": "C:\\Program Files\\PuTTY\\putty.exe"}
+
+
+class Client:
+    def __init__(self, port):
+        self.port = port
+
+    def request(self, method, path, body=None):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        try:
+            connection.request(method, path, json.dumps(body) if body is not None else None, {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    def wait(self, job_id, timeout=30):
+        deadline = time.monotonic() + timeout
+        while True:
+            status, job = self.request("GET", f"/jobs/{job_id}")
+            assert status == 200
+            if job["status"] in ("succeeded", "failed"):
+                return job
+            assert time.monotonic() < deadline, job
+            time.sleep(0.01)
+
+
+@pytest.fixture
+def server(tmp_path, stub_tools, monkeypatch):
+    monkeypatch.setenv("INTUNIFY_STUB_LATENCY", "0.05")
+    queue = JobQueue(tmp_path / "out", jobs=4)
+    server = make_server(queue, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield Client(server.server_address[1]), queue
+    server.shutdown()
+    server.server_close()
+    queue.shutdown()
+
+
+def test_jobs_run_to_completion(server, tmp_path):
+    client, queue = server
+    status, job = client.request("POST", "/jobs", GIT)
+    assert status == 202
+    assert job["status"] in ("queued", "running")
+    job = client.wait(job["id"])
+    assert job["status"] == "succeeded"
+    assert job["error"] is None
+    assert job["wall_s"] >= 0
+    assert str(tmp_path / "out" / "Git.Git" / "install.intunewin") in job["artifacts"]
+
+    # ?wait returns the finished job
+    status, job = client.request("POST", "/jobs?wait=30", {"type": "uninstaller", "name": "Google Chrome"})
+    assert status == 200
+    assert job["status"] == "succeeded"
+    assert str(tmp_path / "out" / "Google_Chrome" / "uninstall.intunewin") in job["artifacts"]
+
+    status, jobs = client.request("GET", "/jobs")
+    assert [job["type"] for job in jobs] == ["installer", "uninstaller"]
+    status, health = client.request("GET", "/health")
+    assert health["jobs"] == {"queued": 0, "running": 0, "succeeded": 2, "failed": 0}
+
+
+def test_invalid_jobs_are_rejected(server):
+    client, queue = server
+    status, body = client.request("POST", "/jobs", {"winget_id": "Git.Git"})
+    assert status == 400
+    assert body["error"]
+    status, body = client.request("POST", "/jobs", dict(GIT, force="yes"))
+    assert (status, body["error"]) == (400, "'force' must be true or false.")
+    status, body = client.request("POST", "/jobs", dict(GIT, type="publish"))
+    assert status == 400
+    assert client.request("GET", "/jobs/404")[0] == 404
+    assert client.request("GET", "/jobs")[1] == []
+
+
+def test_concurrent_jobs_for_one_folder_run_one_at_a_time(server):
+    client, queue = server
+    ids = [client.request("POST", "/jobs", dict(application, force=True))[1]["id"] for application in [GIT, PUTTY, GIT, GIT, PUTTY]]
+    jobs = [client.wait(job_id) for job_id in ids]
+    assert [job["status"] for job in jobs] == ["succeeded"] * 5
+
+    for winget_id in ("Git.Git", "PuTTY.PuTTY"):
+        runs = sorted((job["started_at"], job["finished_at"]) for job, application in zip(jobs, [GIT, PUTTY, GIT, GIT, PUTTY]) if application["winget_id"] == winget_id)
+        for (_, finished_at), (started_at, _) in zip(runs, runs[1:]):
+            assert finished_at <= started_at
+    # Different folders did run at once
+    assert min(job["finished_at"] for job in jobs) > max(job["started_at"] for job in jobs[:2])
+
+    # The folder locks are forgotten once no job holds them
+    for job_id in ids:
+        queue.get(job_id).future.result()
+    assert queue._folder_locks == {}
+
+
+def test_status_reads_see_whole_updates(server):
+    client, queue = server
+    job = queue.submit(dict(GIT, force=True))
+    # Every snapshot taken while the job runs is consistent: finished jobs have their timings
+    while True:
+        snapshot = queue.describe(job)
+        if snapshot["status"] in ("succeeded", "failed"):
+            assert snapshot["finished_at"] is not None and snapshot["wall_s"] is not None
+            break
+        assert snapshot["finished_at"] is None
+    assert snapshot["status"] == "succeeded"
@@ -0,0 +1,99 @@
+import pytest
+
+import templating
+from intunify import copy_nary_file
+from templating import DECLARED_PLACEHOLDERS, Template, TemplateError, get_template, load_all_templates
+
+
+FIRST = "11111111-2222-4333-8444-555555555555"
+SECOND = "66666666-7777-4888-9999-aaaaaaaaaaaa"
+
+
+def copy_nary_file_by_replace(inf, outf, replacements=None, affixment=None):
+    """copy_nary_file as it was before templates were precompiled: a chain of str.replace calls."""
+    with open(inf, "r") as f, outf.open("w") as g:
+        text = f.read()
+        if replacements:
+            for guid, replacement in replacements:
+                replacement = replacement.replace(r"Computer\"HKEY_LOCAL_MACHINE", "HKEY_LOCAL_MACHINE").replace("HKEY_LOCAL_MACHINE", "HKLM:").replace("'", "''")
+                text = text.replace(guid, replacement)
+        if affixment:
+            text += affixment
+        g.write(text)
+
+
+def write_template(tmp_path, text):
+    path = tmp_path / "test.template"
+    path.write_text(text)
+    return path
+
+
+def test_unknown_placeholder_is_rejected_at_load_time(tmp_path):
+    path = write_template(tmp_path, f"winget install --id {FIRST} --version {SECOND}\n")
+    with pytest.raises(TemplateError, match=f"unknown placeholders: {SECOND}"):
+        Template(path, {FIRST})
+
+
+def test_unused_placeholder_is_rejected_at_load_time(tmp_path):
+    path = write_template(tmp_path, f"winget install --id {FIRST}\n")
+    with pytest.raises(TemplateError, match=f"does not contain declared placeholders: {SECOND}"):
+        Template(path, {FIRST, SECOND})
+
+
+def test_undeclared_templates_take_every_guid_as_a_placeholder(tmp_path):
+    template = Template(write_template(tmp_path, f"{FIRST} and {SECOND}, {FIRST}"))
+    assert template.placeholders == {FIRST, SECOND}
+    assert template.render({FIRST: "a", SECOND: "b", "unused": "c"}) == "a and b, a"
+    with pytest.raises(TemplateError, match=f"No value supplied for placeholders {SECOND}"):
+        template.render({FIRST: "a"})
+
+
+def test_substituted_values_are_not_expanded_again(tmp_path):
+    path = write_template(tmp_path, f"Name: '{FIRST}'\nVersion: '{SECOND}'\n")
+    # A value that happens to contain another placeholder is inserted as is
+    assert Template(path).render({FIRST: f"App {SECOND}", SECOND: "1.0"}) == f"Name: 'App {SECOND}'\nVersion: '1.0'\n"
+
+    # The str.replace chain expanded it
+    by_replace = tmp_path / "by_replace.ps1"
+    copy_nary_file_by_replace(path, by_replace, [(FIRST, f"App {SECOND}"), (SECOND, "1.0")])
+    assert by_replace.read_text() == "Name: 'App 1.0'\nVersion: '1.0'\n"
+
+
+def test_templates_are_read_once(tmp_path):
+    path = write_template(tmp_path, f"{FIRST}\n")
+    template = get_template(path)
+    path.write_text(f"changed {FIRST}\n")
+    assert get_template(path) is template
+    assert template.render({FIRST: "x"}) == "x\n"
+
+
+def test_every_bundled_template_is_declared():
+    templates = load_all_templates()
+    assert len(templates) == sum(len(declarations) for declarations in DECLARED_PLACEHOLDERS.values())
+    for path, template in templates.items():
+        assert template.placeholders == DECLARED_PLACEHOLDERS[path.parent][path.name]
+
+
+@pytest.mark.parametrize("path", [
+    directory / name
+    for directory, declarations in DECLARED_PLACEHOLDERS.items()
+    for name in sorted(declarations)
+], ids=lambda path: f"{path.parent.name}/{path.name}")
+def test_output_matches_the_str_replace_chain(path, tmp_path):
+    values = {
+        templating.WINGET_ID_TO_REPLACE: "Git.Git",
+        templating.PATH_TO_REPLACE: r"Computer\HKEY_LOCAL_MACHINE\SOFTWARE\Microsoft\Windows\CurrentVersion\Uninstall\Git_is1",
+        templating.VERSION_TO_REPLACE: "2.40.0",
+        templating.REGISTRY_DISPLAY_NAME_TO_REPLACE: "Git version 2.40.0 (Tom's build)",
+        templating.REGISTRY_LOCATIONS_TO_REPLACE: "LocalMachine:Registry64,LocalMachine:Registry32",
+        templating.DISPLAY_VERSION_TO_REPLACE: "2.40.0",
+        templating.BUNDLE_NAME_TO_REPLACE: "Dev tools",
+        templating.BUNDLE_MEMBERS_TO_REPLACE: "@{ Id = 'Git.Git'; Version = '' }",
+        templating.BUNDLE_WINGET_IDS_TO_REPLACE: "Git.Git, PuTTY.PuTTY",
+        templating.INSTALL_OPTIONS_TO_REPLACE: "--scope machine",
+    }
+    replacements = [(placeholder, values[placeholder]) for placeholder in sorted(DECLARED_PLACEHOLDERS[path.parent][path.name])]
+    expected, actual = tmp_path / "expected", tmp_path / "actual"
+    copy_nary_file_by_replace(path, expected, replacements, affixment="\n# affixed\n")
+    copy_nary_file(path, actual, replacements, affixment="\n# affixed\n")
+    assert actual.read_bytes() == expected.read_bytes()
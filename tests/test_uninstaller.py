@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+import bulk_uninstaller_generator
+import intunify
+from create_uninstaller import generate_uninstaller, render_uninstaller
+
+
+CHROME_KEY = "HKEY_LOCAL_MACHINE\\SOFTWARE\\Microsoft\\Windows\\CurrentVersion\\Uninstall\\Google Chrome"
+FILE_NAMES = ["README.md", "detect.ps1", "uninstall.intunewin", "uninstall.ps1"]
+
+
+def test_render_uninstaller():
+    package = render_uninstaller("Google Chrome")
+    assert (package.name, package.setup_file, package.intunewin_name) == ("Google_Chrome", "uninstall.ps1", "uninstall.intunewin")
+    assert "Google Chrome" in package.files["detect.ps1"]
+    assert "Google Chrome" in package.files["uninstall.ps1"]
+
+    package = render_uninstaller("Google Chrome", key=CHROME_KEY)
+    assert package.metadata == {"name": "Google Chrome", "key": CHROME_KEY}
+    assert "HKLM:\\SOFTWARE\\Microsoft\\Windows\\CurrentVersion\\Uninstall\\Google Chrome" in package.files["uninstall.ps1"]
+
+    with pytest.raises(ValueError, match="must start with HKEY_LOCAL_MACHINE"):
+        render_uninstaller("Google Chrome", key="HKEY_CURRENT_USER\\Software")
+    with pytest.raises(ValueError, match="fast can't be combined with key"):
+        render_uninstaller("Google Chrome", key=CHROME_KEY, fast=True)
+
+
+def test_generate_uninstaller(tmp_path, stub_tools):
+    output = tmp_path / "out"
+    assert generate_uninstaller("Google Chrome", key=CHROME_KEY, output_parent_directory=output)
+    folder = output / "Google_Chrome"
+    assert sorted(path.name for path in folder.iterdir()) == FILE_NAMES
+    assert (folder / "uninstall.ps1").read_bytes() == render_uninstaller("Google Chrome", key=CHROME_KEY).data("uninstall.ps1")
+
+    # Unchanged uninstallers are skipped unless forced, changed ones are rebuilt
+    (folder / "README.md").unlink()
+    assert generate_uninstaller("Google Chrome", key=CHROME_KEY, output_parent_directory=output)
+    assert not (folder / "README.md").exists()
+    assert generate_uninstaller("Google Chrome", key=CHROME_KEY, output_parent_directory=output, force=True)
+    assert (folder / "README.md").exists()
+    assert generate_uninstaller("Google Chrome", output_parent_directory=output)
+    assert (folder / "uninstall.ps1").read_bytes() == render_uninstaller("Google Chrome").data("uninstall.ps1")
+
+
+def test_bulk_uninstallers(tmp_path, stub_tools, capsys):
+    catalog = tmp_path / "uninstallers.jsonl"
+    catalog.write_text("".join(json.dumps(entry) + "\n" for entry in [
+        {"name": "Google Chrome", "key": CHROME_KEY},
+        {"name": "Notepad++ (64-bit x64)", "display_version": "8.5"},
+        {"name": "PuTTY", "key": "HKEY_CURRENT_USER\\Software\\PuTTY"},
+        {"name": "7-Zip 23.01 (x64)"},
+    ]))
+    with intunify.preserved_settings():
+        bulk_uninstaller_generator.main(["-i", str(catalog), "-o", str(tmp_path / "out"), "--jobs", "2", "--fast"])
+    out = capsys.readouterr().out
+    assert "line 3" in out and "'key' must be a registry key path" in out
+    assert "Built 3 of 3 uninstallers, 0 failed.\nSkipped 1 invalid catalog records." in out
+    folders = sorted(path.name for path in (tmp_path / "out").iterdir() if not path.name.startswith("."))
+    assert folders == ["7-Zip_23.01_(x64)", "Google_Chrome", "Notepad++_(64-bit_x64)"]
+    for folder in folders:
+        assert (tmp_path / "out" / folder / "uninstall.intunewin").exists()
+    # --fast applies to the entries without a key, which may pin a DisplayVersion
+    assert (tmp_path / "out" / "Notepad++_(64-bit_x64)" / "detect.ps1").read_text() == render_uninstaller("Notepad++ (64-bit x64)", fast=True, display_version="8.5").files["detect.ps1"]
+    assert (tmp_path / "out" / "Google_Chrome" / "detect.ps1").read_text() == render_uninstaller("Google Chrome", key=CHROME_KEY).files["detect.ps1"]
@@ -0,0 +1,115 @@
+import json
+
+import pytest
+
+import bulk_application_installer_generator as bulk
+import intunify
+import packages
+from create_installer import _variant_folders, generate_installer, render_installer
+from variants import DEFAULT_VARIANT, Variant, application_variants, load_variant_matrix, variant_matrix
+
+
+GIT = {"winget_id": "Git.Git", "registry_key": "HKEY_LOCAL_MACHINE\\SOFTWARE\\Git_is1"}
+
+
+class FakeShowCache:
+    """Stands in for a WingetShowCache, counting the lookups."""
+
+    def __init__(self):
+        self.calls = []
+
+    def get(self, winget_id):
+        self.calls.append(winget_id)
+        return f"Found {winget_id} [{winget_id}]\r\nVersion: 1.0\r\n"
+
+
+@pytest.fixture
+def packager_calls(monkeypatch):
+    calls = []
+    create_intunewin_file = packages.create_intunewin_file
+
+    def counting(folder, *args, **kwargs):
+        calls.append(folder)
+        return create_intunewin_file(folder, *args, **kwargs)
+
+    monkeypatch.setattr(packages, "create_intunewin_file", counting)
+    return calls
+
+
+def test_variant_matrix():
+    variants = variant_matrix(["machine", "user"], ["arm64"], ["contoso", "fabrikam"])
+    assert [variant.name for variant in variants] == ["contoso-machine-arm64", "contoso-user-arm64", "fabrikam-machine-arm64", "fabrikam-user-arm64"]
+    assert [variant.name for variant in variant_matrix()] == ["machine"]
+    assert variants[1].install_options() == "--scope user --architecture arm64"
+    with pytest.raises(ValueError, match="unique"):
+        variant_matrix(["user", "user"])
+    with pytest.raises(ValueError, match="tenant names"):
+        Variant(tenant="contoso/../fabrikam")
+
+
+def test_load_variant_matrix(tmp_path):
+    path = tmp_path / "variants.json"
+    path.write_text(json.dumps({"scopes": ["user"], "architectures": ["x64", "arm64"]}))
+    assert [variant.name for variant in load_variant_matrix(path)] == ["user-x64", "user-arm64"]
+    path.write_text(json.dumps({"scope": ["user"]}))
+    with pytest.raises(ValueError, match="must hold an object"):
+        load_variant_matrix(path)
+
+
+def test_application_variants():
+    variants = variant_matrix(["machine", "user"], ["x64", "arm64"])
+    x64_only = dict(GIT, architectures=["x64"])
+    assert [variant.name for variant in application_variants(x64_only, variants)] == ["machine-x64", "user-x64"]
+    # A variant that lets winget choose the architecture matches every application
+    assert application_variants(x64_only, [DEFAULT_VARIANT]) == [DEFAULT_VARIANT]
+    bundle = {"bundle": "Dev tools", "members": [x64_only, dict(GIT, scopes=["user"])]}
+    assert [variant.name for variant in application_variants(bundle, variants)] == ["user-x64"]
+
+
+def test_variant_folders():
+    assert _variant_folders("Git.Git", None) == [(DEFAULT_VARIANT, "Git.Git")]
+    variants = variant_matrix(["user"], tenants=["contoso"])
+    assert _variant_folders("Git.Git", variants) == [(variants[0], "contoso-user/Git.Git")]
+    with pytest.raises(ValueError, match="not built in any"):
+        _variant_folders("Git.Git", [])
+
+
+def test_variants_are_rendered_from_one_details_lookup():
+    show_cache = FakeShowCache()
+    rendered = render_installer(**GIT, include_show_output=True, show_cache=show_cache, variants=variant_matrix(["machine", "user"], ["x64", "arm64"]))
+    assert show_cache.calls == ["Git.Git"]
+    assert [package.name for package in rendered] == ["machine-x64/Git.Git", "machine-arm64/Git.Git", "user-x64/Git.Git", "user-arm64/Git.Git"]
+    assert [package.metadata["variant"] for package in rendered] == ["machine-x64", "machine-arm64", "user-x64", "user-arm64"]
+    assert "--scope user --architecture arm64" in rendered[3].files["install.ps1"]
+    assert all(package.files["package_details.yaml"] == "Found: Git.Git [Git.Git]\nVersion: 1.0\n" for package in rendered)
+
+
+def test_generate_installer_writes_a_tree_per_variant(tmp_path, stub_tools, packager_calls):
+    output = tmp_path / "out"
+    show_cache = FakeShowCache()
+    variants = variant_matrix(["machine", "user"], tenants=["contoso", "fabrikam"])
+    assert generate_installer(**GIT, output_parent_directory=output, include_show_output=True, show_cache=show_cache, variants=variants)
+    assert show_cache.calls == ["Git.Git"]
+    for variant in variants:
+        folder = output / variant.name / "Git.Git"
+        assert (folder / "install.intunewin").exists()
+        assert f"--scope {variant.scope}" in (folder / "install.ps1").read_text()
+    # Variants that differ only by tenant are packaged once and the package copied
+    assert len(packager_calls) == 2
+    assert (output / "fabrikam-user" / "Git.Git" / "install.intunewin").read_bytes() == (output / "contoso-user" / "Git.Git" / "install.intunewin").read_bytes()
+
+    # Unchanged variants are skipped, new ones are built
+    assert generate_installer(**GIT, output_parent_directory=output, include_show_output=True, show_cache=show_cache, variants=variant_matrix(["machine", "user"], tenants=["contoso", "northwind"]))
+    assert len(packager_calls) == 4
+    assert (output / "northwind-machine" / "Git.Git" / "install.intunewin").exists()
+    assert (output / "northwind-user" / "Git.Git" / "install.intunewin").exists()
+
+
+def test_bulk_variants(tmp_path, stub_tools, capsys):
+    catalog = tmp_path / "catalog.jsonl"
+    catalog.write_text(json.dumps(dict(GIT, architectures=["x64"])) + "\n" + json.dumps({"winget_id": "PuTTY.PuTTY", "file_path": "C:\\putty.exe"}) + "\n")
+    with intunify.preserved_settings():
+        bulk.main(["-i", str(catalog), "-o", str(tmp_path / "out"), "--scopes", "machine", "--architectures", "x64", "arm64"])
+    assert "0 failed." in capsys.readouterr().out
+    built = sorted(path.parent.relative_to(tmp_path / "out").as_posix() for path in (tmp_path / "out").rglob("install.intunewin"))
+    assert built == ["machine-arm64/PuTTY.PuTTY", "machine-x64/Git.Git", "machine-x64/PuTTY.PuTTY"]
@@ -0,0 +1,87 @@
+import threading
+import time
+
+import intunify
+from winget_cache import WingetShowCache
+
+
+# Fails for ids starting with "Missing", as winget does for unknown packages
+FAILING_WINGET_STUB = r"""#!/bin/sh
+while [ $# -gt 0 ]; do
+    [ "$1" = "--id" ] && id="$2"
+    shift
+done
+case "$id" in
+    Missing*) echo "No package found matching input criteria."; exit 1 ;;
+esac
+printf 'Found %s [%s]\r\nVersion: 1.0.0\r\n' "$id" "$id"
+"""
+
+
+def test_prefetch_counts_successful_fetches(tmp_path, stub_tools, monkeypatch):
+    winget = stub_tools / "failing-winget"
+    winget.write_text(FAILING_WINGET_STUB)
+    winget.chmod(0o755)
+    monkeypatch.setattr(intunify, "WINGET_EXECUTABLE", str(winget))
+
+    with WingetShowCache(tmp_path / "cache.sqlite3") as cache:
+        cache.store("Cached.App", "Found Cached.App [Cached.App]\r\n")
+        assert cache.prefetch(["Git.Git", "git.git", "Missing.App", "Cached.App"]) == 1
+        assert (cache.fetched, cache.failed) == (1, 1)
+        assert cache.lookup("Git.Git").lower().startswith("found git.git")
+        assert cache.lookup("Missing.App") is None
+
+
+def test_entries_expire_after_ttl(tmp_path, stub_tools):
+    with WingetShowCache(tmp_path / "cache.sqlite3", ttl=0) as cache:
+        cache.store("Git.Git", "stale")
+        assert cache.lookup("Git.Git") is None
+        assert cache.get("Git.Git").startswith("Found Git.Git")
+        assert cache.fetched == 1
+
+
+def test_concurrent_misses_run_winget_once(tmp_path, monkeypatch):
+    calls = []
+
+    def get_winget_show_output(winget_id, source=None):
+        calls.append(winget_id)
+        time.sleep(0.2)
+        return f"Found {winget_id} [{winget_id}]\r\n"
+
+    monkeypatch.setattr(intunify, "get_winget_show_output", get_winget_show_output)
+    with WingetShowCache(tmp_path / "cache.sqlite3") as cache:
+        barrier = threading.Barrier(8)
+        outputs = []
+
+        def get(winget_id):
+            barrier.wait()
+            outputs.append(cache.get(winget_id))
+
+        threads = [threading.Thread(target=get, args=(winget_id,)) for winget_id in ["Git.Git", "git.git"] * 4]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(calls) == 1
+        assert outputs == [outputs[0]] * 8
+        assert (cache.fetched, cache.failed) == (1, 0)
+        assert cache._inflight == {}
+
+
+def test_a_fetch_finishing_during_a_miss_is_not_repeated(tmp_path, monkeypatch):
+    def get_winget_show_output(winget_id, source=None):
+        raise AssertionError("winget was run again")
+
+    monkeypatch.setattr(intunify, "get_winget_show_output", get_winget_show_output)
+    with WingetShowCache(tmp_path / "cache.sqlite3") as cache:
+        lookup = cache.lookup
+
+        def missed_lookup(winget_id, source=None):
+            # Another caller's fetch stores its output right after this lookup misses
+            monkeypatch.setattr(cache, "lookup", lookup)
+            cache.store(winget_id, "Found Git.Git [Git.Git]\r\n", source)
+            return None
+
+        monkeypatch.setattr(cache, "lookup", missed_lookup)
+        assert cache.get("Git.Git") == "Found Git.Git [Git.Git]\r\n"
+        assert (cache.fetched, cache.failed) == (0, 0)
@@ -0,0 +1,118 @@
+import shutil
+
+import pytest
+
+import winget_index
+from winget_index import WingetIndex, validate_applications, version_key
+
+
+PUTTY_CODE = "{11111111-2222-3333-4444-555555555555}"
+NEW_PUTTY_CODE = "{66666666-7777-8888-9999-000000000000}"
+
+
+@pytest.fixture
+def index(tmp_path):
+    with WingetIndex(tmp_path / "index.sqlite3") as index:
+        yield index
+
+
+def test_version_key():
+    assert sorted(["1.10", "1.9", "1.9.1", "1.0", "2"], key=version_key) == ["1.0", "1.9", "1.9.1", "1.10", "2"]
+    assert version_key("1.0") == version_key("1")
+
+
+def test_reindex_parses_only_changed_folders(index, winget_manifests):
+    winget_manifests("Git.Git", "2.40.0", name="Git", product_code="Git_is1")
+    old_putty = winget_manifests("PuTTY.PuTTY", "0.79", product_code=PUTTY_CODE)
+    putty = winget_manifests("PuTTY.PuTTY", "0.80", product_code=PUTTY_CODE)
+    repository = winget_manifests.repository
+
+    assert index.reindex(repository) == {"parsed": 3, "unchanged": 0, "removed": 0, "failed": 0}
+    assert index.versions("putty.putty") == ["0.80", "0.79"]
+    assert index.find_product_code(PUTTY_CODE.lower()) == [("PuTTY.PuTTY", "0.79"), ("PuTTY.PuTTY", "0.80")]
+    assert index.reindex(repository) == {"parsed": 0, "unchanged": 3, "removed": 0, "failed": 0}
+
+    # Edit one version folder, add another and delete a third
+    winget_manifests("PuTTY.PuTTY", "0.80", product_code=NEW_PUTTY_CODE)
+    winget_manifests("PuTTY.PuTTY", "0.81", product_code=NEW_PUTTY_CODE)
+    shutil.rmtree(old_putty)
+
+    assert index.reindex(repository) == {"parsed": 2, "unchanged": 1, "removed": 1, "failed": 0}
+    assert index.versions("PuTTY.PuTTY") == ["0.81", "0.80"]
+    assert index.latest_version("PuTTY.PuTTY") == "0.81"
+    assert index.find_product_code(PUTTY_CODE) == []
+    assert sorted(index.find_product_code(NEW_PUTTY_CODE)) == [("PuTTY.PuTTY", "0.80"), ("PuTTY.PuTTY", "0.81")]
+    assert index.find_product_code("Git_is1") == [("Git.Git", "2.40.0")]
+    assert (putty / "PuTTY.PuTTY.yaml").exists()
+
+    # Removing every version of a package removes the package
+    shutil.rmtree(putty.parent)
+    assert index.reindex(repository) == {"parsed": 0, "unchanged": 1, "removed": 2, "failed": 0}
+    assert index.versions("PuTTY.PuTTY") == []
+    assert index.find_product_code(NEW_PUTTY_CODE) == []
+    assert index.check("PuTTY.PuTTY") == "PuTTY.PuTTY is not in the winget index"
+
+
+def test_reindex_when_a_folder_changes_version(index, winget_manifests):
+    folder = winget_manifests("Git.Git", "2.40.0")
+    index.reindex(winget_manifests.repository)
+    manifest = folder / "Git.Git.yaml"
+    manifest.write_text(manifest.read_text().replace("PackageVersion: 2.40.0", "PackageVersion: 2.40.0.1"))
+
+    assert index.reindex(winget_manifests.repository)["parsed"] == 1
+    assert index.versions("Git.Git") == ["2.40.0.1"]
+
+
+def test_reindex_reports_and_retries_invalid_folders(index, winget_manifests):
+    folder = winget_manifests("Git.Git", "2.40.0")
+    manifest = folder / "Git.Git.yaml"
+    text = manifest.read_text()
+    manifest.write_text("PackageIdentifier: Git.Git\nManifestType: singleton\n")
+    errors = []
+
+    assert index.reindex(winget_manifests.repository, on_error=lambda path, error: errors.append((path, error))) == {"parsed": 0, "unchanged": 0, "removed": 0, "failed": 1}
+    assert errors == [("g/Git/Git/2.40.0", "ValueError: missing PackageIdentifier or PackageVersion")]
+    assert index.versions("Git.Git") == []
+
+    manifest.write_text(text)
+    assert index.reindex(winget_manifests.repository)["parsed"] == 1
+    assert index.versions("Git.Git") == ["2.40.0"]
+
+
+def test_reindex_in_parallel(index, winget_manifests):
+    for version in ["1.0", "1.1", "1.2", "1.10"]:
+        winget_manifests("Example.App", version)
+    assert index.reindex(winget_manifests.repository, jobs=2)["parsed"] == 4
+    assert index.versions("example.app") == ["1.10", "1.2", "1.1", "1.0"]
+
+
+def test_package_details_and_validation(index, winget_manifests):
+    winget_manifests("Git.Git", "2.39.0", name="Git")
+    winget_manifests("Git.Git", "2.40.0", name="Git", product_code="Git_is1")
+    index.reindex(winget_manifests.repository)
+
+    details = index.package_details("Git.Git")
+    assert details.startswith('Found: "Git [Git.Git]"\nVersion: "2.40.0"\n')
+    assert '  - Architecture: "x64"\n' in details
+    assert '    ProductCode: "Git_is1"\n' in details
+    assert 'Version: "2.39.0"' in index.package_details("Git.Git", "2.39.0")
+    assert index.package_details("Git.Git", "1.0") is None
+
+    errors = []
+    applications = [
+        {"winget_id": "git.git", "file_path": "a"},
+        {"winget_id": "Git.Git", "file_path": "a", "version": "1.0"},
+        {"winget_id": "Unknown.App", "file_path": "a"},
+    ]
+    assert list(validate_applications(applications, index, on_error=errors.append)) == applications[:1]
+    assert errors == [
+        "Git.Git has no version 1.0 in the winget index (newest is 2.40.0)",
+        "Unknown.App is not in the winget index",
+    ]
+
+
+def test_indexing_requires_pyyaml(index, winget_manifests, monkeypatch):
+    winget_manifests("Git.Git", "2.40.0")
+    monkeypatch.setattr(winget_index, "yaml", None)
+    with pytest.raises(RuntimeError, match="pip install pyyaml"):
+        index.reindex(winget_manifests.repository)
@@ -0,0 +1,119 @@
+"""variants.py
+
+Variant matrices: the same catalog generated for several install scopes,
+architectures and tenants in one run.
+
+A variant fixes the winget --scope and --architecture of the install script,
+and the tenant it is generated for. Every variant is written to its own output
+tree, named after the variant (e.g. "contoso-user-arm64"), so that each tree
+can be published on its own.
+
+The matrix is the product of the scopes, architectures and tenants given on
+the command line or in a JSON file such as
+    {"scopes": ["machine", "user"], "architectures": ["x64", "arm64"], "tenants": ["contoso", "fabrikam"]}
+Catalog entries may narrow it down with "scopes" and "architectures" lists of
+their own, e.g. for applications without an arm64 installer.
+"""
+
+
+import itertools
+import json
+import re
+from pathlib import Path
+from typing import Iterable, List
+
+
+SCOPES = ("machine", "user")
+ARCHITECTURES = ("x86", "x64", "arm", "arm64")
+
+_TENANT_PATTERN = re.compile(r"^[A-Za-z0-9_.]+$")
+
+
+class Variant:
+    """One combination of install scope, architecture and tenant.
+
+    Args:
+        scope (str): winget --scope, one of SCOPES
+        architecture (str or None): winget --architecture, one of ARCHITECTURES. None lets winget choose.
+        tenant (str or None): name of the tenant the variant is generated for
+    """
+
+    __slots__ = ("scope", "architecture", "tenant")
+
+    def __init__(self, scope: str = "machine", architecture: str or None = None, tenant: str or None = None):
+        if scope not in SCOPES:
+            raise ValueError(f"scope must be one of {', '.join(SCOPES)}. Received: {scope!r}")
+        if architecture is not None and architecture not in ARCHITECTURES:
+            raise ValueError(f"architecture must be one of {', '.join(ARCHITECTURES)}. Received: {architecture!r}")
+        if tenant is not None and not _TENANT_PATTERN.match(tenant):
+            raise ValueError(f"tenant names may only contain letters, digits, underscores and periods. Received: {tenant!r}")
+        self.scope = scope
+        self.architecture = architecture
+        self.tenant = tenant
+
+    @property
+    def name(self) -> str:
+        """Name of the variant's output tree, e.g. "contoso-user-arm64"."""
+        return "-".join(value for value in (self.tenant, self.scope, self.architecture) if value)
+
+    def install_options(self) -> str:
+        """Return the winget install arguments selecting the variant, e.g. "--scope user --architecture arm64"."""
+        options = f"--scope {self.scope}"
+        if self.architecture:
+            options += f" --architecture {self.architecture}"
+        return options
+
+    def config(self) -> dict:
+        """Return the variant's contribution to an application's build inputs. The tenant doesn't change the generated files."""
+        return {"scope": self.scope, "architecture": self.architecture}
+
+    def __repr__(self) -> str:
+        return f"Variant({self.name})"
+
+
+# The variant generated when no matrix is given
+DEFAULT_VARIANT = Variant()
+
+
+def variant_matrix(scopes: Iterable[str] or None = None, architectures: Iterable[str] or None = None, tenants: Iterable[str] or None = None) -> List[Variant]:
+    """Return every combination of the given scopes, architectures and tenants.
+
+    Dimensions that aren't given take their default: machine scope, any architecture, no tenant.
+
+    Raises:
+        ValueError: if a value is unknown or given twice
+    """
+    dimensions = []
+    for values, default in [(scopes, "machine"), (architectures, None), (tenants, None)]:
+        values = list(values) if values else [default]
+        if len(set(values)) != len(values):
+            raise ValueError(f"Variant values must be unique. Received: {values}")
+        dimensions.append(values)
+    return [Variant(scope, architecture, tenant) for tenant, scope, architecture in itertools.product(dimensions[2], dimensions[0], dimensions[1])]
+
+
+def load_variant_matrix(path: Path) -> List[Variant]:
+    """Return the variant matrix declared in a JSON file with optional "scopes", "architectures" and "tenants" lists."""
+    with Path(path).open("r") as f:
+        declaration = json.load(f)
+    if not isinstance(declaration, dict) or set(declaration) - {"scopes", "architectures", "tenants"}:
+        raise ValueError(f"{path} must hold an object with only 'scopes', 'architectures' and 'tenants' lists")
+    return variant_matrix(declaration.get("scopes"), declaration.get("architectures"), declaration.get("tenants"))
+
+
+def application_variants(application: dict, variants: Iterable[Variant]) -> List[Variant]:
+    """Return the variants an application, or a bundle as yielded by group_bundles, is generated in.
+
+    Applications listing "scopes" or "architectures" are only generated in variants with one of
+    them; a variant that lets winget choose the architecture matches every application. A bundle
+    is generated in the variants all its members are generated in.
+    """
+    entries = application["members"] if "members" in application else [application]
+    return [
+        variant for variant in variants
+        if all(
+            variant.scope in entry.get("scopes", SCOPES)
+            and (variant.architecture is None or variant.architecture in entry.get("architectures", ARCHITECTURES))
+            for entry in entries
+        )
+    ]
@@ -0,0 +1,156 @@
+"""winget_cache.py
+
+Persistent cache of `winget show` output so that repeated runs with --show
+don't start a winget process for every application.
+
+Entries are stored in a SQLite database keyed by winget id and source, and
+expire after a configurable time to live.
+"""
+
+
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import intunify
+
+
+DEFAULT_CACHE_PATH = Path.home() / ".intunify" / "winget_show.sqlite3"
+DEFAULT_TTL_HOURS = 24
+
+
+class WingetShowCache:
+    """Cache of `winget show` output, safe to share between threads.
+
+    Args:
+        path (Path): SQLite database file. Created if it doesn't exist.
+        ttl (float): seconds after which a cached entry is fetched again
+        refresh (bool): treat every entry cached before this cache was opened as expired
+    """
+
+    def __init__(self, path: Path = DEFAULT_CACHE_PATH, ttl: float = DEFAULT_TTL_HOURS * 3600, refresh: bool = False):
+        self.path = Path(path)
+        self.ttl = ttl
+        self._not_before = time.time() if refresh else 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        # winget show runs this cache started that succeeded and failed
+        self.fetched = 0
+        self.failed = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS show_output ("
+                "winget_id TEXT NOT NULL, source TEXT NOT NULL, output TEXT NOT NULL, fetched_at REAL NOT NULL, "
+                "PRIMARY KEY (winget_id, source))"
+            )
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def _key(winget_id: str, source: str or None):
+        # winget ids are case insensitive
+        return winget_id.lower(), source or ""
+
+    def lookup(self, winget_id: str, source: str or None = None) -> str or None:
+        """Return the cached output for 'winget_id' if there is a fresh entry, without running winget."""
+        not_before = max(time.time() - self.ttl, self._not_before)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT output FROM show_output WHERE winget_id = ? AND source = ? AND fetched_at >= ?",
+                (*self._key(winget_id, source), not_before),
+            ).fetchone()
+        return row[0] if row else None
+
+    def store(self, winget_id: str, output: str, source: str or None = None) -> None:
+        """Cache 'output' as the current `winget show` output for 'winget_id'."""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO show_output (winget_id, source, output, fetched_at) VALUES (?, ?, ?, ?)",
+                (*self._key(winget_id, source), output, time.time()),
+            )
+
+    def get(self, winget_id: str, source: str or None = None) -> str or None:
+        """Return the `winget show` output for 'winget_id', running winget only if there is no fresh entry.
+
+        Concurrent requests for the same id share a single winget process.
+
+        Returns:
+            str or None: None if winget failed
+        """
+        output = self.lookup(winget_id, source)
+        if output is not None:
+            return output
+
+        key = self._key(winget_id, source)
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            # A fetch that finished between the lookup above and taking the lock has stored its output
+            output = self.lookup(winget_id, source)
+            if output is None:
+                output = intunify.get_winget_show_output(winget_id, source=source)
+                if output is not None:
+                    self.store(winget_id, output, source)
+                with self._lock:
+                    if output is None:
+                        self.failed += 1
+                    else:
+                        self.fetched += 1
+            future.set_result(output)
+            return output
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def prefetch(self, winget_ids: Iterable[str], jobs: int = 4, source: str or None = None) -> int:
+        """Fetch every id without a fresh entry on a pool of 'jobs' workers.
+
+        Returns:
+            int: number of ids that had to be fetched and were fetched successfully
+        """
+        misses = {winget_id.lower(): winget_id for winget_id in winget_ids if self.lookup(winget_id, source) is None}
+        if not misses:
+            return 0
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            outputs = list(executor.map(lambda winget_id: self.get(winget_id, source), misses.values()))
+        return sum(output is not None for output in outputs)
+
+    def iter_prefetched(self, applications: Iterable[dict], executor, source: str or None = None) -> Iterator[dict]:
+        """Pass 'applications' through, submitting a fetch to 'executor' for every winget_id without a fresh entry.
+
+        Lets fetches run ahead of generation in a streaming pipeline. A later get() for an id
+        that is still being fetched waits for that fetch instead of starting another. The
+        fetched and failed attributes count the outcomes.
+
+        Args:
+            applications (Iterable[dict]): application config entries
+            executor (Executor): pool to run the fetches on
+
+        Yields:
+            dict: application config entry
+        """
+        for application in applications:
+            if self.lookup(application["winget_id"], source) is None:
+                executor.submit(self.get, application["winget_id"], source)
+            yield application
@@ -0,0 +1,489 @@
+r"""winget_index.py
+
+Offline index of a local checkout of the winget manifests repository
+(https://github.com/microsoft/winget-pkgs), used instead of `winget show` to
+write package_details.yaml, to validate winget ids and versions in catalogs
+and to resolve versions for lockfiles. It needs neither winget.exe nor a
+network connection, and works on any platform.
+
+    git clone --depth 1 https://github.com/microsoft/winget-pkgs
+    python winget_index.py index winget-pkgs --jobs 8
+    python winget_index.py show Git.Git
+    python winget_index.py validate example.json
+
+Every version folder of the repository (manifests/<letter>/<Publisher>/<Package>/<version>)
+is parsed into a SQLite database holding the package's id, version, name,
+publisher and description, and the installer type, architecture, scope and
+ProductCodes of each installer. Reindexing only parses the version folders
+whose files were added, changed or removed since the previous run, so keeping
+the index up to date after a `git pull` takes seconds.
+
+Indexing needs PyYAML. Reading an existing index doesn't.
+"""
+
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from catalog import iter_applications, iter_catalog
+
+try:
+    import yaml
+    # Every scalar is read as a string, so that e.g. PackageVersion 1.10 isn't read as the float 1.1
+    _Loader = getattr(yaml, "CBaseLoader", yaml.BaseLoader)
+except ImportError:
+    yaml = None
+
+
+DEFAULT_INDEX_PATH = Path.home() / ".intunify" / "winget_index.sqlite3"
+
+# Bump when the schema or the parsed fields change so existing indexes are rebuilt
+INDEX_FORMAT_VERSION = 1
+
+# Fields of the default locale manifest that are indexed, and the column each is stored in
+LOCALE_FIELDS = {
+    "PackageName": "name",
+    "Publisher": "publisher",
+    "PublisherUrl": "publisher_url",
+    "Author": "author",
+    "Moniker": "moniker",
+    "ShortDescription": "short_description",
+    "Description": "description",
+    "PackageUrl": "homepage",
+    "License": "license",
+    "LicenseUrl": "license_url",
+}
+
+# Installer fields that may be set on the installer manifest itself and are inherited by every installer
+INSTALLER_FIELDS = ["Architecture", "InstallerType", "Scope", "InstallerUrl", "InstallerSha256", "ProductCode"]
+
+# Headings of the package details, as printed by `winget show`
+DETAILS_FIELDS = [
+    ("Publisher", "publisher"),
+    ("Publisher Url", "publisher_url"),
+    ("Author", "author"),
+    ("Moniker", "moniker"),
+    ("Description", "description"),
+    ("Homepage", "homepage"),
+    ("License", "license"),
+    ("License Url", "license_url"),
+]
+INSTALLER_DETAILS_FIELDS = [
+    ("Architecture", "architecture"),
+    ("Installer Type", "installer_type"),
+    ("Scope", "scope"),
+    ("Installer Url", "installer_url"),
+    ("Installer SHA256", "installer_sha256"),
+    ("ProductCode", "product_code"),
+]
+
+_VERSION_PART_PATTERN = re.compile(r"(\d*)(.*)")
+
+
+def is_available() -> bool:
+    """Return True if the PyYAML package needed to index manifests is installed."""
+    return yaml is not None
+
+
+def version_key(version: str) -> tuple:
+    """Return a sort key ordering version strings the way winget does, e.g. "1.10" after "1.9".
+
+    Every dot-separated part is compared by its leading number first and the rest of the part second.
+    """
+    key = []
+    for part in version.split("."):
+        digits, rest = _VERSION_PART_PATTERN.match(part).groups()
+        key.append((int(digits) if digits else -1, rest))
+    # Trailing zero parts don't count: "1.0" is "1"
+    while key and key[-1] == (0, ""):
+        key.pop()
+    return tuple(key)
+
+
+def _signature(path: str, names: List[str]) -> str:
+    # Changes when a manifest file of the folder is added, removed, modified or replaced
+    digest = hashlib.sha1()
+    for name in sorted(names):
+        stat = os.stat(os.path.join(path, name))
+        digest.update(f"{name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8", "surrogateescape"))
+    return digest.hexdigest()
+
+
+def iter_version_folders(manifests_root: Path) -> Iterator[Tuple[str, str]]:
+    """Yield every folder of the manifests repository holding manifest files.
+
+    Yields:
+        Tuple[str, str]: (path relative to 'manifests_root' with forward slashes, signature of its manifest files)
+    """
+    manifests_root = str(manifests_root)
+    for folder, subfolders, files in os.walk(manifests_root):
+        subfolders.sort()
+        names = [name for name in files if name.endswith((".yaml", ".yml"))]
+        if names:
+            relative = os.path.relpath(folder, manifests_root).replace(os.sep, "/")
+            yield relative, _signature(folder, names)
+
+
+def parse_version_folder(folder: Path) -> dict:
+    """Parse the manifests of one package version into the record stored in the index.
+
+    Handles both singleton manifests and multi-file (version, installer and locale) manifests.
+
+    Returns:
+        dict: package_id, version, the columns of LOCALE_FIELDS and 'installers', a list of
+        dicts of the INSTALLER_FIELDS of each installer, with inherited values filled in.
+        Installers also carry 'product_codes', every ProductCode they register.
+
+    Raises:
+        RuntimeError: if PyYAML isn't installed
+        ValueError: if the folder doesn't hold a valid manifest
+    """
+    if yaml is None:
+        raise RuntimeError("Indexing winget manifests requires PyYAML. Run `pip install pyyaml`.")
+    manifests = {}
+    for path in sorted(Path(folder).iterdir()):
+        if path.suffix not in (".yaml", ".yml"):
+            continue
+        document = yaml.load(path.read_bytes(), Loader=_Loader)
+        if not isinstance(document, dict) or "ManifestType" not in document:
+            raise ValueError(f"{path.name} is not a winget manifest")
+        manifests.setdefault(document["ManifestType"], document)
+
+    if "singleton" in manifests:
+        version_manifest = installer_manifest = locale_manifest = manifests["singleton"]
+    else:
+        try:
+            version_manifest, installer_manifest, locale_manifest = manifests["version"], manifests["installer"], manifests["defaultLocale"]
+        except KeyError as exc:
+            raise ValueError(f"missing the {exc.args[0]} manifest") from None
+
+    package_id = version_manifest.get("PackageIdentifier")
+    version = version_manifest.get("PackageVersion")
+    if not package_id or not version:
+        raise ValueError("missing PackageIdentifier or PackageVersion")
+
+    record = {"package_id": package_id, "version": version}
+    for field, column in LOCALE_FIELDS.items():
+        value = locale_manifest.get(field)
+        record[column] = value if isinstance(value, str) else None
+
+    installers = []
+    for installer in installer_manifest.get("Installers") or []:
+        if not isinstance(installer, dict):
+            continue
+        values = {field: installer.get(field) or installer_manifest.get(field) for field in INSTALLER_FIELDS}
+        product_codes = [values["ProductCode"]] if values["ProductCode"] else []
+        for entry in installer.get("AppsAndFeaturesEntries") or installer_manifest.get("AppsAndFeaturesEntries") or []:
+            if isinstance(entry, dict) and entry.get("ProductCode") and entry["ProductCode"] not in product_codes:
+                product_codes.append(entry["ProductCode"])
+        values["product_codes"] = product_codes
+        installers.append(values)
+    record["installers"] = installers
+    return record
+
+
+def _parse(folder: str) -> Tuple[dict or None, str or None]:
+    # Worker for reindex; errors are returned rather than raised so that one bad folder doesn't stop the run
+    try:
+        return parse_version_folder(Path(folder)), None
+    except RuntimeError:
+        raise
+    except Exception as exc:
+        return None, f"{type(exc).__name__}: {exc}"
+
+
+class WingetIndex:
+    """Persistent index of winget manifests, safe to share between threads.
+
+    Args:
+        path (Path): SQLite database file. Created if it doesn't exist.
+    """
+
+    def __init__(self, path: Path = DEFAULT_INDEX_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._db:
+            if self._db.execute("PRAGMA user_version").fetchone()[0] != INDEX_FORMAT_VERSION:
+                for table in ["folders", "packages", "installers", "product_codes"]:
+                    self._db.execute(f"DROP TABLE IF EXISTS {table}")
+                self._db.execute(f"PRAGMA user_version = {INDEX_FORMAT_VERSION}")
+            self._db.execute("CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY, signature TEXT NOT NULL, id_key TEXT, version TEXT, error TEXT)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS packages ("
+                "id_key TEXT NOT NULL, package_id TEXT NOT NULL, version TEXT NOT NULL, "
+                + "".join(f"{column} TEXT, " for column in LOCALE_FIELDS.values())
+                + "PRIMARY KEY (id_key, version)) WITHOUT ROWID"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS installers ("
+                "id_key TEXT NOT NULL, version TEXT NOT NULL, architecture TEXT, installer_type TEXT, scope TEXT, "
+                "installer_url TEXT, installer_sha256 TEXT, product_code TEXT)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS installers_package ON installers (id_key, version)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS product_codes ("
+                "product_code_key TEXT NOT NULL, id_key TEXT NOT NULL, version TEXT NOT NULL, "
+                "PRIMARY KEY (product_code_key, id_key, version)) WITHOUT ROWID"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS product_codes_package ON product_codes (id_key, version)")
+        self._versions = {}
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _delete(self, id_key: str, version: str) -> None:
+        self._db.execute("DELETE FROM packages WHERE id_key = ? AND version = ?", (id_key, version))
+        self._db.execute("DELETE FROM installers WHERE id_key = ? AND version = ?", (id_key, version))
+        self._db.execute("DELETE FROM product_codes WHERE id_key = ? AND version = ?", (id_key, version))
+
+    def _insert(self, record: dict) -> None:
+        id_key, version = record["package_id"].lower(), record["version"]
+        self._delete(id_key, version)
+        self._db.execute(
+            f"INSERT INTO packages VALUES (?, ?, ?{', ?' * len(LOCALE_FIELDS)})",
+            (id_key, record["package_id"], version, *(record[column] for column in LOCALE_FIELDS.values())),
+        )
+        for installer in record["installers"]:
+            self._db.execute(
+                "INSERT INTO installers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (id_key, version, *(installer[field] for field in INSTALLER_FIELDS)),
+            )
+            for product_code in installer["product_codes"]:
+                self._db.execute("INSERT OR IGNORE INTO product_codes VALUES (?, ?, ?)", (product_code.lower(), id_key, version))
+
+    def reindex(self, repository: Path, jobs: int = 1, on_error=None) -> Dict[str, int]:
+        """Bring the index up to date with a checkout of the winget manifests repository.
+
+        Only version folders that are new or whose manifest files changed are parsed. Packages
+        whose folders were removed are removed from the index.
+
+        Args:
+            repository (Path): the checkout, or its manifests folder
+            jobs (int): number of processes parsing manifests
+            on_error (Callable[[str, str], None] or None): called with (folder, error) for every
+                folder that couldn't be parsed. Such folders are left out of the index.
+
+        Returns:
+            Dict[str, int]: counts of "parsed", "unchanged", "removed" and "failed" folders
+        """
+        repository = Path(repository)
+        manifests_root = repository / "manifests" if (repository / "manifests").is_dir() else repository
+        if not manifests_root.is_dir():
+            raise FileNotFoundError(f"{repository} is not a folder")
+        if yaml is None:
+            raise RuntimeError("Indexing winget manifests requires PyYAML. Run `pip install pyyaml`.")
+
+        with self._lock:
+            indexed = {path: (signature, id_key, version) for path, signature, id_key, version in self._db.execute("SELECT path, signature, id_key, version FROM folders")}
+        counts = {"parsed": 0, "unchanged": 0, "removed": 0, "failed": 0}
+        changed = []
+        for path, signature in iter_version_folders(manifests_root):
+            previous = indexed.pop(path, None)
+            if previous is not None and previous[0] == signature:
+                counts["unchanged"] += 1
+            else:
+                changed.append((path, signature, previous))
+
+        folders = [str(manifests_root / path) for path, _, _ in changed]
+        executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 and len(folders) > 1 else None
+        try:
+            results = executor.map(_parse, folders, chunksize=64) if executor else map(_parse, folders)
+            with self._lock, self._db:
+                for (path, signature, previous), (record, error) in zip(changed, results):
+                    if previous is not None and previous[1] is not None:
+                        self._delete(previous[1], previous[2])
+                    if record is None:
+                        counts["failed"] += 1
+                        if on_error is not None:
+                            on_error(path, error)
+                        self._db.execute("INSERT OR REPLACE INTO folders VALUES (?, ?, NULL, NULL, ?)", (path, signature, error))
+                        continue
+                    counts["parsed"] += 1
+                    self._insert(record)
+                    self._db.execute("INSERT OR REPLACE INTO folders VALUES (?, ?, ?, ?, NULL)", (path, signature, record["package_id"].lower(), record["version"]))
+                for path, (_, id_key, version) in indexed.items():
+                    counts["removed"] += 1
+                    if id_key is not None:
+                        self._delete(id_key, version)
+                    self._db.execute("DELETE FROM folders WHERE path = ?", (path,))
+                self._versions = {}
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return counts
+
+    def versions(self, winget_id: str) -> List[str]:
+        """Return the indexed versions of 'winget_id', newest first. Ids are matched case-insensitively.
+
+        Returns:
+            List[str]: empty if the id isn't indexed
+        """
+        id_key = winget_id.lower()
+        with self._lock:
+            versions = self._versions.get(id_key)
+            if versions is None:
+                rows = self._db.execute("SELECT version FROM packages WHERE id_key = ?", (id_key,)).fetchall()
+                versions = self._versions[id_key] = sorted((version for version, in rows), key=version_key, reverse=True)
+            return list(versions)
+
+    def latest_version(self, winget_id: str) -> str or None:
+        """Return the newest indexed version of 'winget_id', or None if it isn't indexed."""
+        versions = self.versions(winget_id)
+        return versions[0] if versions else None
+
+    def package(self, winget_id: str, version: str or None = None) -> dict or None:
+        """Return the indexed details of a package version.
+
+        Args:
+            winget_id (str): matched case-insensitively
+            version (str or None): defaults to the newest indexed version
+
+        Returns:
+            dict or None: package_id, version, the columns of LOCALE_FIELDS and 'installers'.
+            None if the id or version isn't indexed.
+        """
+        version = version or self.latest_version(winget_id)
+        if version is None:
+            return None
+        id_key = winget_id.lower()
+        with self._lock:
+            cursor = self._db.execute("SELECT * FROM packages WHERE id_key = ? AND version = ?", (id_key, version))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            package = dict(zip([column[0] for column in cursor.description], row))
+            cursor = self._db.execute(
+                "SELECT architecture, installer_type, scope, installer_url, installer_sha256, product_code FROM installers WHERE id_key = ? AND version = ?",
+                (id_key, version),
+            )
+            package["installers"] = [dict(zip([column[0] for column in cursor.description], row)) for row in cursor]
+        del package["id_key"]
+        return package
+
+    def find_product_code(self, product_code: str) -> List[Tuple[str, str]]:
+        """Return the packages whose installers register 'product_code', e.g. an MSI's Uninstall subkey name.
+
+        Returns:
+            List[Tuple[str, str]]: (winget id, version)
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT packages.package_id, packages.version FROM product_codes JOIN packages USING (id_key, version) WHERE product_code_key = ?",
+                (product_code.lower(),),
+            ).fetchall()
+
+    def check(self, winget_id: str, version: str or None = None) -> str or None:
+        """Return why 'winget_id' (at 'version', if given) can't be installed from the indexed repository,
+        or None if it can."""
+        versions = self.versions(winget_id)
+        if not versions:
+            return f"{winget_id} is not in the winget index"
+        if version and version not in versions:
+            return f"{winget_id} has no version {version} in the winget index (newest is {versions[0]})"
+        return None
+
+    def package_details(self, winget_id: str, version: str or None = None) -> str or None:
+        """Return the package details written to package_details.yaml, in the layout of `winget show` output
+        but listing every installer.
+
+        Returns:
+            str or None: YAML document. None if the id or version isn't indexed.
+        """
+        package = self.package(winget_id, version)
+        if package is None:
+            return None
+        # JSON strings are valid double-quoted YAML scalars
+        found = f"{package['name'] or package['package_id']} [{package['package_id']}]"
+        lines = [f"Found: {json.dumps(found)}", f"Version: {json.dumps(package['version'])}"]
+        package["description"] = package["description"] or package["short_description"]
+        for heading, column in DETAILS_FIELDS:
+            if package[column]:
+                lines.append(f"{heading}: {json.dumps(package[column])}")
+        if package["installers"]:
+            lines.append("Installers:")
+        for installer in package["installers"]:
+            fields = [f"{heading}: {json.dumps(installer[column])}" for heading, column in INSTALLER_DETAILS_FIELDS if installer[column]]
+            lines.extend(f"{'  - ' if i == 0 else '    '}{field}" for i, field in enumerate(fields or ["{}"]))
+        return "\n".join(lines) + "\n"
+
+
+def validate_applications(applications: Iterable[dict], index: WingetIndex, on_error=print) -> Iterator[dict]:
+    """Drop applications whose winget id, or pinned version, isn't in 'index'.
+
+    Args:
+        applications (Iterable[dict]): application config entries
+        index (WingetIndex)
+        on_error (Callable[[str], None]): called with the reason for every application dropped
+
+    Yields:
+        dict: application config entry
+    """
+    for application in applications:
+        error = index.check(application["winget_id"], application.get("version"))
+        if error is not None:
+            on_error(error)
+            continue
+        yield application
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(description="Index a local checkout of the winget manifests repository, and query it.")
+    parser.add_argument('--index', type=str, default=str(DEFAULT_INDEX_PATH), help=f"path to the index. Defaults to {DEFAULT_INDEX_PATH}")
+    commands = parser.add_subparsers(dest="command", required=True)
+    index_parser = commands.add_parser("index", help="parse the manifests added or changed since the last run")
+    index_parser.add_argument('repository', type=str, help="path to the winget-pkgs checkout, or its manifests folder")
+    index_parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help="number of processes parsing manifests. Defaults to the number of CPUs")
+    show_parser = commands.add_parser("show", help="print the package details of a winget id")
+    show_parser.add_argument('winget_id', type=str)
+    show_parser.add_argument('-v', '--version', type=str, default=None, help="defaults to the newest indexed version")
+    validate_parser = commands.add_parser("validate", help="check that the winget ids and pinned versions of a catalog are in the index")
+    validate_parser.add_argument('infile', type=str, help="path to JSON (array) or JSON Lines catalog")
+    args = parser.parse_args(argv)
+    if args.command == "index" and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with WingetIndex(Path(args.index)) as index:
+        if args.command == "index":
+            counts = index.reindex(Path(args.repository), jobs=args.jobs, on_error=lambda path, error: print(f"{path}: {error}"))
+            print(f"Parsed {counts['parsed']} version folders, {counts['unchanged']} unchanged, {counts['removed']} removed, {counts['failed']} failed.")
+        elif args.command == "show":
+            details = index.package_details(args.winget_id, args.version)
+            if details is None:
+                print(index.check(args.winget_id, args.version))
+                raise SystemExit(1)
+            sys.stdout.write(details)
+        else:
+            errors = []
+            def report(error):
+                errors.append(error)
+                print(f"{args.infile}: {error}")
+            applications = iter_applications(iter_catalog(Path(args.infile)), on_error=report)
+            valid = sum(1 for _ in validate_applications(applications, index, on_error=report))
+            print(f"{valid} applications valid, {len(errors)} invalid.")
+            if errors:
+                raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()